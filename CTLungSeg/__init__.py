@@ -2,6 +2,15 @@
 # -*- coding: utf-8 -*-
 
 from .__version__ import __version__
+from .threads import export_threads
+
+# the BLAS and OpenMP thread pools read their size only once, so the thread
+# budget must be exported before numpy is imported; the variables set by
+# the user are kept
+try :
+    export_threads(overwrite=False)
+except ValueError :
+    pass
 
 __author__  = ['Riccardo Biondi', 'Nico Curti']
 __email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
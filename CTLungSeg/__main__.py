@@ -7,10 +7,10 @@ import numpy as np
 from time import time
 
 from CTLungSeg.utils import read_image, write_volume, load_pickle
+from CTLungSeg.threads import add_threads_argument, set_threads
 
 
-from CTLungSeg import labeling
-from CTLungSeg import lung_extraction
+from CTLungSeg.pipeline import Pipeline
 
 def parse_args() :
     description = 'ggo identifications'
@@ -34,6 +34,7 @@ def parse_args() :
                         type=str,
                         action='store',
                         default='')
+    add_threads_argument(parser)
 
     args = parser.parse_args()
     return args
@@ -51,6 +52,7 @@ centroids = {
 if __name__ == '__main__':
     start = time()
     args = parse_args()
+    set_threads(args.threads)
     volume = read_image(filename=args.input)
 
     if args.center != '' :
@@ -58,8 +60,8 @@ if __name__ == '__main__':
     else :
         center = np.asarray([np.array(v) for _, v in centroids.items()])
 
-    lung = lung_extraction.main(volume)
-    labels = labeling.main(lung, center)
+    # lung extraction and labeling, with the lung image kept in memory
+    labels = Pipeline(center)(volume)
 
 
     write_volume(image=labels, output_filename=args.output)
@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import argparse
+import numpy as np
+
+from time import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+from CTLungSeg.utils import read_image, write_volume, load_pickle
+from CTLungSeg import labeling
+from CTLungSeg.threads import add_threads_argument, set_threads
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+MANIFEST = 'manifest.csv'
+MANIFEST_FIELDS = ['scan', 'output', 'status', 'seconds', 'message']
+
+
+def parse_args():
+    description = 'Batch processing of a directory of scans'
+    parser = argparse.ArgumentParser(description=description)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    label = subparsers.add_parser('labeling', help='GGO labeling of lung images')
+    label.add_argument('--input',
+                       dest='input',
+                       required=True,
+                       type=str,
+                       action='store',
+                       help='Input directory')
+    label.add_argument('--output',
+                       dest='output',
+                       required=True,
+                       type=str,
+                       action='store',
+                       help='Output directory')
+    label.add_argument('--centroids',
+                       dest='centroids',
+                       required=False,
+                       type=str,
+                       action='store',
+                       help='centroids',
+                       default='')
+    label.add_argument('--workers',
+                       dest='workers',
+                       required=False,
+                       type=int,
+                       action='store',
+                       help='number of worker processes',
+                       default=1)
+    label.add_argument('--n_jobs',
+                       dest='n_jobs',
+                       required=False,
+                       type=int,
+                       action='store',
+                       help='number of labeling threads for each worker',
+                       default=1)
+
+    lung = subparsers.add_parser('lung_extraction', help='lung extraction of CT scans')
+    lung.add_argument('--input',
+                      dest='input',
+                      required=True,
+                      type=str,
+                      action='store',
+                      help='Input directory')
+    lung.add_argument('--output',
+                      dest='output',
+                      required=True,
+                      type=str,
+                      action='store',
+                      help='Output directory')
+    lung.add_argument('--batch_size',
+                      dest='batch_size',
+                      required=False,
+                      type=int,
+                      action='store',
+                      help='number of slices processed at once by lungmask',
+                      default=20)
+    lung.add_argument('--torch_threads',
+                      dest='torch_threads',
+                      required=False,
+                      type=int,
+                      action='store',
+                      help='number of torch intra-op threads',
+                      default=None)
+    lung.add_argument('--slab_size',
+                      dest='slab_size',
+                      required=False,
+                      type=int,
+                      action='store',
+                      help='number of slices processed at once, to bound the memory',
+                      default=None)
+
+    for subparser in [label, lung] :
+        add_threads_argument(subparser)
+
+    args = parser.parse_args()
+    return args
+
+
+def list_scans(input_dir) :
+    '''
+    List the scans into the input directory: each file is a scan, as well as
+    each sub-directory, which is considered a DICOM series. Hidden entries,
+    the 'LUNG' folder and the batch manifest are ignored.
+
+    Parameters
+    ----------
+    input_dir : str
+        path to the input directory
+
+    Returns
+    -------
+    scans : list of str
+        sorted paths of the scans
+    '''
+    if not os.path.isdir(input_dir) :
+        raise FileNotFoundError(f"Could not find: {input_dir}")
+    names = [n for n in sorted(os.listdir(input_dir))
+             if not n.startswith('.') and n not in ['LUNG', MANIFEST]]
+    return [os.path.join(input_dir, n) for n in names]
+
+
+def output_filename(scan, output_dir, suffix='', ext='.nrrd') :
+    '''
+    Return the output filename of the scan : its name without extensions,
+    followed by the suffix and the output extension
+
+    Parameters
+    ----------
+    scan : str
+        path to the input scan
+    output_dir : str
+        path to the output directory
+    suffix : str
+        string appended to the name
+    ext : str
+        output extension
+
+    Returns
+    -------
+    filename : str
+        output filename
+    '''
+    name = os.path.basename(os.path.normpath(scan)).split('.')[0]
+    return os.path.join(output_dir, name + suffix + ext)
+
+
+def is_up_to_date(src, dst) :
+    '''
+    Check if the output exists and it is newer than its input
+
+    Parameters
+    ----------
+    src : str
+        path to the input file or directory
+    dst : str
+        path to the output file
+
+    Returns
+    -------
+    up_to_date : bool
+        True if dst exists and it was modified after src
+    '''
+    return os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src)
+
+
+def read_manifest(output_dir, latest=True) :
+    '''
+    Read the batch manifest of the output directory. The manifest is an
+    append-only log, with a row for each scan processed by each run; the
+    scans skipped as up to date are not logged.
+
+    Parameters
+    ----------
+    output_dir : str
+        path to the output directory
+    latest : bool
+        if True only the last row of each scan, i.e. its current state, is
+        returned, otherwise the whole log. Default True
+
+    Returns
+    -------
+    rows : list of dict
+        rows with scan, output, status ('done' or 'failed'), seconds and
+        message fields, in the order of the log. Empty if the manifest does
+        not exist
+    '''
+    filename = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(filename) :
+        return []
+    with open(filename, 'r', newline='') as fp :
+        rows = list(csv.DictReader(fp))
+    if latest :
+        last = {row['scan'] : i for i, row in enumerate(rows)}
+        rows = [row for i, row in enumerate(rows) if last[row['scan']] == i]
+    return rows
+
+
+def _append_manifest(output_dir, row) :
+    '''
+    Append a row to the batch manifest, writing the header if required
+    '''
+    filename = os.path.join(output_dir, MANIFEST)
+    header = not os.path.exists(filename)
+    with open(filename, 'a', newline='') as fp :
+        writer = csv.DictWriter(fp, fieldnames=MANIFEST_FIELDS)
+        if header :
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def _manifest_row(scan, output, status, seconds, message='') :
+    '''
+    Build a manifest row
+    '''
+    return {'scan' : scan, 'output' : output, 'status' : status,
+            'seconds' : '{:.3f}'.format(seconds), 'message' : message}
+
+
+def _error_message(error) :
+    '''
+    Format an exception as a single line message
+    '''
+    return '{}: {}'.format(type(error).__name__, ' '.join(str(error).split()))
+
+
+def _partial_filename(output) :
+    '''
+    Hidden filename, with the output extension, on which the output is
+    written before being moved into place
+    '''
+    head, tail = os.path.split(output)
+    return os.path.join(head, '.partial_' + tail)
+
+
+def _write_output(image, output) :
+    '''
+    Write the image to a partial file and rename it to the output only when
+    it is complete, so an interrupted run never leaves a truncated output
+    that is newer than its input, and thus skipped as up to date
+    '''
+    partial = _partial_filename(output)
+    try :
+        write_volume(image, partial)
+        os.replace(partial, output)
+    finally :
+        if os.path.exists(partial) :
+            os.remove(partial)
+
+
+def _pending_jobs(input_dir, output_dir, verbose) :
+    '''
+    List the scans to process and the skipped ones, which are not logged
+    into the manifest
+
+    Returns
+    -------
+    jobs : list of tuple
+        input and output filename of each scan to process
+    skipped : list of dict
+        manifest rows of the scans with an up to date output
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    skipped = []
+    for scan in list_scans(input_dir) :
+        output = output_filename(scan, output_dir)
+        if is_up_to_date(scan, output) :
+            skipped.append(_manifest_row(scan, output, 'skipped', 0., 'up to date'))
+        else :
+            jobs.append((scan, output))
+
+    if verbose :
+        print('Found {} scans, {} to process'.format(len(jobs) + len(skipped),
+                len(jobs)), flush=True)
+    return jobs, skipped
+
+
+def _record(output_dir, row, verbose) :
+    '''
+    Append the row to the manifest and print it
+    '''
+    _append_manifest(output_dir, row)
+    if verbose :
+        print('* {} [{}] {} s {}'.format(row['scan'], row['status'],
+                row['seconds'], row['message']), flush=True)
+
+
+# state of each worker process, initialized once by _init_labeling
+_worker = {}
+
+
+def _init_labeling(centroids, n_jobs) :
+    '''
+    Store the centroids and the labeling parameters into the worker process
+    '''
+    _worker['centroids'] = centroids
+    _worker['n_jobs'] = n_jobs
+    # the thread budget is inherited through the environment
+    set_threads()
+
+
+def _label_scan(scan, output) :
+    '''
+    Label a single scan in a worker process
+
+    Returns
+    -------
+    row : dict
+        manifest row of the scan
+    '''
+    start = time()
+    try :
+        volume = read_image(scan)
+        labels = labeling.main(volume, _worker['centroids'], n_jobs=_worker['n_jobs'])
+        _write_output(labels, output)
+        status, message = 'done', ''
+    except Exception as e :
+        status, message = 'failed', _error_message(e)
+    return _manifest_row(scan, output, status, time() - start, message)
+
+
+def run_labeling(input_dir, output_dir, centroids, workers=1, n_jobs=1, verbose=True) :
+    '''
+    Label all the scans of the input directory. The centroids are loaded once
+    and sent to a pool of worker processes, which label the scans concurrently.
+    Scans whose output is already up to date are skipped, so an interrupted
+    run can be resumed : the outputs are written to a hidden partial file and
+    renamed only when complete. The status and the time of each processed
+    scan are appended to the manifest.csv file of the output directory as
+    soon as it is done (see read_manifest).
+
+    Parameters
+    ----------
+    input_dir : str
+        path to the directory of the lung images
+    output_dir : str
+        path to the output directory
+    centroids : array-like of shape (n_centroids, n_features)
+        centroids used for the labeling
+    workers : int
+        number of worker processes
+    n_jobs : int
+        number of labeling threads for each worker
+    verbose : bool
+        if True, print the status of each scan
+
+    Returns
+    -------
+    rows : list of dict
+        manifest rows of this run
+
+    Example
+    -------
+    >>> from CTLungSeg.batch import run_labeling
+    >>> from CTLungSeg.utils import load_pickle
+    >>>
+    >>> centroids = load_pickle('centroids.pkl.npy')
+    >>> rows = run_labeling('path/to/LUNG', 'path/to/OUTPUT', centroids, workers=4)
+    '''
+    jobs, rows = _pending_jobs(input_dir, output_dir, verbose)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_labeling,
+                             initargs=(np.asarray(centroids), n_jobs)) as pool :
+        futures = [pool.submit(_label_scan, scan, output) for scan, output in jobs]
+        for future in as_completed(futures) :
+            rows.append(future.result())
+            _record(output_dir, rows[-1], verbose)
+
+    return rows
+
+
+def run_lung_extraction(input_dir, output_dir, batch_size=20, torch_threads=None,
+                        model=None, slab_size=None, verbose=True) :
+    '''
+    Run the lung extraction on all the scans of the input directory, loading
+    the lungmask model only once. The scans are streamed through the model :
+    while a scan is processed, the next one is read in background.
+    As for run_labeling, up to date outputs are skipped and the status of each
+    scan is appended to the manifest.csv file of the output directory.
+
+    Parameters
+    ----------
+    input_dir : str
+        path to the directory of the CT scans
+    output_dir : str
+        path to the output directory
+    batch_size : int
+        number of slices processed at once by lungmask
+    torch_threads : int
+        number of torch intra-op threads. Default None, which means the thread
+        budget (see CTLungSeg.threads), if set, otherwise the torch default
+    model : torch.nn.Module
+        lungmask model. Default None, which means that the default one is
+        loaded
+    slab_size : int
+        number of slices processed at once, see lung_extraction.main.
+        Default None, which means the whole scan
+    verbose : bool
+        if True, print the status of each scan
+
+    Returns
+    -------
+    rows : list of dict
+        manifest rows of this run
+
+    Example
+    -------
+    >>> from CTLungSeg.batch import run_lung_extraction
+    >>>
+    >>> rows = run_lung_extraction('path/to/INPUT', 'path/to/LUNG', batch_size=40,
+    >>>                            torch_threads=8)
+    '''
+    from CTLungSeg import lung_extraction
+
+    jobs, rows = _pending_jobs(input_dir, output_dir, verbose)
+    if not jobs :
+        return rows
+
+    if model is None :
+        model = lung_extraction.load_model()
+    # after the model loading, which applies the global thread budget
+    if torch_threads is not None :
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    with ThreadPoolExecutor(max_workers=1) as reader :
+        prefetch = reader.submit(read_image, jobs[0][0])
+        for i, (scan, output) in enumerate(jobs) :
+            start = time()
+            current = prefetch
+            if i + 1 < len(jobs) :
+                prefetch = reader.submit(read_image, jobs[i + 1][0])
+            try :
+                lung = lung_extraction.main(current.result(), model=model,
+                                            batch_size=batch_size,
+                                            slab_size=slab_size)
+                _write_output(lung, output)
+                status, message = 'done', ''
+            except Exception as e :
+                status, message = 'failed', _error_message(e)
+            rows.append(_manifest_row(scan, output, status, time() - start, message))
+            _record(output_dir, rows[-1], verbose)
+
+    return rows
+
+
+if __name__ == '__main__' :
+
+    start = time()
+    args = parse_args()
+    set_threads(args.threads)
+
+    if args.command == 'labeling' :
+        if args.centroids != '' :
+            center = load_pickle(filename=args.centroids)
+        else :
+            center = np.asarray([np.array(v) for _, v in labeling.centroids.items()])
+        rows = run_labeling(args.input, args.output, center, args.workers, args.n_jobs)
+    elif args.command == 'lung_extraction' :
+        rows = run_lung_extraction(args.input, args.output, args.batch_size,
+                                   args.torch_threads, slab_size=args.slab_size)
+
+    failed = sum(row['status'] == 'failed' for row in rows)
+    done = sum(row['status'] == 'done' for row in rows)
+    stop = time()
+    print('Process ended after {0:.3f} seconds, {1} failed'.format(stop - start, failed))
+    print('Throughput : {0:.1f} scans per hour'.format(3600. * done / (stop - start)))
+    if failed :
+        raise SystemExit(1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import SimpleITK as sitk
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['array_view', 'to_array', 'to_image', 'copy_geometry', 'copy_image']
+
+
+def array_view(image) :
+    '''
+    Return a read-only array which shares the buffer of the image, without
+    any copy. The view is valid only while the image is alive, so keep a
+    reference to the image as long as the view is used, e.g. never take the
+    view of the temporary output of a filter.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+
+    Returns
+    -------
+    view : array-like
+        read-only array with the image buffer, in (z, y, x) order
+
+    Example
+    -------
+    >>> from CTLungSeg.bridge import array_view
+    >>> from CTLungSeg.method import threshold
+    >>>
+    >>> mask = threshold(image, 4000, 1)
+    >>> weight = array_view(mask) # and not array_view(threshold(image, 4000, 1))
+    '''
+    return sitk.GetArrayViewFromImage(image)
+
+
+def to_array(image, dtype=None) :
+    '''
+    Return a writable copy of the image buffer. Use it only when the array
+    is modified or must outlive the image, otherwise use array_view.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+    dtype : numpy dtype
+        type of the array. Default None, which means the image pixel type
+
+    Returns
+    -------
+    array : array-like
+        writable array with the image values, in (z, y, x) order
+    '''
+    view = sitk.GetArrayViewFromImage(image)
+    if dtype is None :
+        return view.copy()
+    return view.astype(dtype)
+
+
+def copy_geometry(image, reference) :
+    '''
+    Copy origin, spacing and direction of the reference into the image
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        image to update, in place
+    reference : SimpleITK image
+        image with the same size, which provides the geometry
+
+    Returns
+    -------
+    image : SimpleITK image
+        the updated input image
+    '''
+    image.CopyInformation(reference)
+    return image
+
+
+def to_image(array, reference=None, is_vector=False) :
+    '''
+    Build an image from an array, with the geometry of the reference.
+    SimpleITK copies the array into the image buffer exactly once, so the
+    array is never converted or made contiguous beforehand if it is not
+    needed: boolean arrays are reinterpreted as uint8 without any copy.
+
+    Parameters
+    ----------
+    array : array-like
+        image values, in (z, y, x) order
+    reference : SimpleITK image
+        image which provides origin, spacing and direction. Default None,
+        which means the default geometry
+    is_vector : bool
+        if True the last axis of the array is the pixel components
+
+    Returns
+    -------
+    image : SimpleITK image
+        image with the array values
+    '''
+    array = np.asarray(array)
+    if array.dtype == bool :
+        array = array.view(np.uint8)
+    image = sitk.GetImageFromArray(array, isVector=is_vector)
+    if reference is not None :
+        copy_geometry(image, reference)
+    return image
+
+
+def copy_image(image) :
+    '''
+    Return a copy of the image. The buffer is shared with the input until
+    one of the two images is modified or viewed as an array, when SimpleITK
+    copies it once, so the copy costs nothing if it is only passed to the
+    filters.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        image to copy
+
+    Returns
+    -------
+    copy : SimpleITK image
+        copy of the input image, with the same geometry
+    '''
+    return sitk.Image(image)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import inspect
+import functools
+import threading
+
+from collections import OrderedDict
+
+from CTLungSeg.bridge import array_view, copy_image
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['FilterCache', 'cached', 'enable_cache', 'disable_cache',
+           'clear_cache', 'cache_info', 'image_digest']
+
+
+def image_digest(image) :
+    '''
+    Compute a digest of the image content and geometry
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+
+    Returns
+    -------
+    digest : str
+        hexadecimal digest of pixel type, size, origin, spacing, direction
+        and voxel values of the image
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((image.GetPixelIDValue(), image.GetSize(),
+                        image.GetOrigin(), image.GetSpacing(),
+                        image.GetDirection())).encode())
+    # the contiguous view is hashed in place, without copying the buffer
+    digest.update(array_view(image))
+    return digest.hexdigest()
+
+
+
+def _image_bytes(image) :
+    '''
+    Return the memory, in bytes, of the image buffer
+    '''
+    return (image.GetNumberOfPixels() * image.GetNumberOfComponentsPerPixel()
+            * image.GetSizeOfPixelComponent())
+
+
+
+class FilterCache :
+    '''
+    Least recently used cache of filter results, bounded by the total memory
+    of the stored images.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum memory, in bytes, of the stored images. When a new result
+        exceeds the budget, the least recently used ones are evicted
+
+    Example
+    -------
+    >>> from CTLungSeg.cache import FilterCache
+    >>>
+    >>> cache = FilterCache(max_bytes=2**30)
+    >>> cache.put(key, image)
+    >>> image = cache.get(key)
+    >>> cache.info()
+    {'hits': 1, 'misses': 0, 'evictions': 0, 'entries': 1, ...}
+    '''
+
+    def __init__(self, max_bytes) :
+
+        if max_bytes <= 0 :
+            raise ValueError('max_bytes must be greater than zero')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) :
+        return len(self._entries)
+
+    def get(self, key) :
+        '''
+        Return the image stored with the key, or None if it is not cached
+
+        Parameters
+        ----------
+        key : hashable
+            entry key
+
+        Returns
+        -------
+        image : SimpleITK image or None
+            cached image
+        '''
+        with self._lock :
+            if key not in self._entries :
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, image) :
+        '''
+        Store the image with the key, evicting the least recently used entries
+        if the memory budget is exceeded. Images larger than the whole budget
+        are not stored.
+
+        Parameters
+        ----------
+        key : hashable
+            entry key
+        image : SimpleITK image
+            image to store
+        '''
+        size = _image_bytes(image)
+        if size > self.max_bytes :
+            return
+        with self._lock :
+            if key in self._entries :
+                self.current_bytes -= _image_bytes(self._entries.pop(key))
+            while self.current_bytes + size > self.max_bytes :
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= _image_bytes(evicted)
+                self.evictions += 1
+            self._entries[key] = image
+            self.current_bytes += size
+
+    def clear(self) :
+        '''
+        Remove all the entries and reset the counters
+        '''
+        with self._lock :
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self) :
+        '''
+        Return the cache statistics
+
+        Returns
+        -------
+        info : dict
+            number of hits, misses, evictions and entries, used and maximum
+            memory in bytes
+        '''
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'entries' : len(self._entries),
+                'current_bytes' : self.current_bytes,
+                'max_bytes' : self.max_bytes}
+
+
+# global cache used by the decorated functions, None if disabled
+_cache = None
+
+
+def enable_cache(max_bytes=2**30) :
+    '''
+    Enable the memoization of the cached filters of CTLungSeg.method.
+    Results are keyed by the digest of the input image and by the filter
+    parameters, so repeated calls on the same volume with the same parameters
+    return the stored result.
+
+    Parameters
+    ----------
+    max_bytes : int
+        memory budget of the cache in bytes. Default 1 GB
+
+    Returns
+    -------
+    cache : FilterCache
+        the enabled cache
+
+    Example
+    -------
+    >>> from CTLungSeg.cache import enable_cache, cache_info
+    >>> from CTLungSeg.method import median_filter
+    >>>
+    >>> _ = enable_cache(max_bytes=4 * 2**30)
+    >>> filtered = median_filter(image, 3) # computed
+    >>> filtered = median_filter(image, 3) # returned from the cache
+    >>> cache_info()['hits']
+    1
+    '''
+    global _cache
+    _cache = FilterCache(max_bytes)
+    return _cache
+
+
+def disable_cache() :
+    '''
+    Disable the memoization and release the stored results
+    '''
+    global _cache
+    _cache = None
+
+
+def clear_cache() :
+    '''
+    Remove all the stored results, if the cache is enabled
+    '''
+    if _cache is not None :
+        _cache.clear()
+
+
+def cache_info() :
+    '''
+    Return the statistics of the cache, or None if it is disabled
+    '''
+    return None if _cache is None else _cache.info()
+
+
+def cached(func) :
+    '''
+    Decorator which memoizes a filter in the global cache, when enabled.
+    The first argument of the filter must be the input SimpleITK image, the
+    others are its parameters.
+
+    Parameters
+    ----------
+    func : callable
+        filter to memoize
+
+    Returns
+    -------
+    wrapped : callable
+        memoized filter
+    '''
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) :
+        if _cache is None :
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        image, *params = bound.arguments.values()
+        key = (func.__qualname__, image_digest(image), repr(params))
+
+        result = _cache.get(key)
+        if result is None :
+            result = func(*args, **kwargs)
+            _cache.put(key, result)
+        # shallow copy-on-write, so the caller cannot modify the stored image
+        return copy_image(result)
+
+    return wrapper
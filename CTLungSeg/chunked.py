@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import zlib
+import numpy as np
+import SimpleITK as sitk
+
+from CTLungSeg.bridge import array_view, to_image
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['EXTENSION', 'ChunkedVolume', 'is_chunked', 'write_chunked', 'read_chunked']
+
+
+# extension of the chunked volume directories
+EXTENSION = '.cvol'
+# sidecar with shape, type, chunking and geometry of the volume
+SIDECAR = 'volume.json'
+# buffer of the uncompressed volume, memory-mappable
+RAW = 'volume.raw'
+COMPRESSIONS = [None, 'zlib']
+
+
+def is_chunked(filename) :
+    '''
+    Return True if the filename has the chunked volume extension
+
+    Parameters
+    ----------
+    filename : str
+        path to the volume
+
+    Returns
+    -------
+    chunked : bool
+        True for the chunked volumes
+    '''
+    return os.path.normpath(filename).lower().endswith(EXTENSION)
+
+
+def _chunk_filename(i) :
+    '''
+    Name of the i-th compressed chunk
+    '''
+    return 'chunk_{:05d}.zlib'.format(i)
+
+
+def write_chunked(volume, filename, chunk_slices=16, compression=None, level=1, reference=None) :
+    '''
+    Write the volume as a chunked volume : a directory with a json sidecar
+    for shape, type and geometry, and the voxels split in chunks of
+    consecutive slices. Uncompressed chunks are stored contiguously in a
+    single raw file, which can be memory-mapped; compressed ones in a file
+    each. The volume is written one chunk at a time.
+
+    Parameters
+    ----------
+    volume : SimpleITK image or array-like
+        image, or array of shape (n_slices, height, width) or
+        (n_slices, height, width, n_channels), e.g. a feature stack
+    filename : str
+        path to the output directory, with the .cvol extension
+    chunk_slices : int
+        number of slices of each chunk
+    compression : str
+        None for raw chunks, 'zlib' for compressed ones
+    level : int
+        zlib compression level, from 1 (fastest) to 9
+    reference : SimpleITK image
+        image which provides the geometry of an array volume. Default None,
+        which means the geometry of volume, if it is an image, otherwise the
+        default one
+
+    Example
+    -------
+    >>> from CTLungSeg.utils import read_image
+    >>> from CTLungSeg.chunked import write_chunked, ChunkedVolume
+    >>>
+    >>> lung = read_image('path/to/lung.nrrd')
+    >>> write_chunked(lung, 'path/to/lung.cvol', chunk_slices=16)
+    >>> # read only the slices 100 to 131
+    >>> slab = ChunkedVolume('path/to/lung.cvol').read_slices(100, 132)
+    '''
+    if chunk_slices <= 0 :
+        raise ValueError('chunk_slices must be greater or equal than one')
+    if compression not in COMPRESSIONS :
+        raise ValueError('compression {} not supported'.format(compression))
+
+    if isinstance(volume, sitk.Image) :
+        reference = volume if reference is None else reference
+        components = volume.GetNumberOfComponentsPerPixel()
+        array = array_view(volume)
+    else :
+        array = np.asarray(volume)
+        components = array.shape[3] if array.ndim == 4 else 1
+    if reference is None :
+        reference = sitk.Image([1] * 3, sitk.sitkUInt8)
+
+    os.makedirs(filename, exist_ok=True)
+    # the sidecar is removed first and written last, so an interrupted
+    # writing does not leave a readable volume; so are the chunks of a
+    # previous volume
+    sidecar = os.path.join(filename, SIDECAR)
+    for f in os.listdir(filename) :
+        if f in (SIDECAR, RAW) or (f.startswith('chunk_') and f.endswith('.zlib')) :
+            os.remove(os.path.join(filename, f))
+
+    n_slices = array.shape[0]
+    if compression is None :
+        with open(os.path.join(filename, RAW), 'wb') as fp :
+            for start in range(0, n_slices, chunk_slices) :
+                np.ascontiguousarray(array[start : start + chunk_slices]).tofile(fp)
+    else :
+        for i, start in enumerate(range(0, n_slices, chunk_slices)) :
+            chunk = np.ascontiguousarray(array[start : start + chunk_slices])
+            with open(os.path.join(filename, _chunk_filename(i)), 'wb') as fp :
+                fp.write(zlib.compress(chunk.tobytes(), level))
+
+    info = {'shape' : list(array.shape),
+            'dtype' : array.dtype.str,
+            'components' : components,
+            'chunk_slices' : int(chunk_slices),
+            'compression' : compression,
+            'origin' : list(reference.GetOrigin()),
+            'spacing' : list(reference.GetSpacing()),
+            'direction' : list(reference.GetDirection())}
+    with open(sidecar, 'w') as fp :
+        json.dump(info, fp, indent=2)
+
+
+
+class ChunkedVolume :
+    '''
+    Chunked volume written by write_chunked, which reads only the chunks of
+    the required slices. Uncompressed volumes can also be memory-mapped.
+
+    Parameters
+    ----------
+    filename : str
+        path to the volume directory
+
+    Example
+    -------
+    >>> from CTLungSeg.chunked import ChunkedVolume
+    >>>
+    >>> volume = ChunkedVolume('path/to/lung.cvol')
+    >>> # slab of slices, reading only its chunks
+    >>> slab = volume.read_slices(100, 132)
+    >>> # or the whole volume as a read-only memory map, if not compressed
+    >>> array = volume.memmap()
+    '''
+
+    def __init__(self, filename) :
+
+        sidecar = os.path.join(filename, SIDECAR)
+        if not os.path.isfile(sidecar) :
+            raise FileNotFoundError(f"Could not find: {sidecar}")
+        with open(sidecar) as fp :
+            info = json.load(fp)
+
+        self.filename = filename
+        self.shape = tuple(info['shape'])
+        self.dtype = np.dtype(info['dtype'])
+        self.components = info['components']
+        self.chunk_slices = info['chunk_slices']
+        self.compression = info['compression']
+        self.origin = tuple(info['origin'])
+        self.spacing = tuple(info['spacing'])
+        self.direction = tuple(info['direction'])
+
+    @property
+    def n_chunks(self) :
+        '''
+        Number of chunks of the volume
+        '''
+        return -(-self.shape[0] // self.chunk_slices)
+
+    def memmap(self, mode='r') :
+        '''
+        Memory-map the whole volume, only for the uncompressed ones
+
+        Parameters
+        ----------
+        mode : str
+            numpy.memmap mode, 'r' for read-only and 'r+' for read and write
+
+        Returns
+        -------
+        array : numpy.memmap
+            array of the volume shape
+        '''
+        if self.compression is not None :
+            raise ValueError('Only the uncompressed volumes can be memory-mapped')
+        return np.memmap(os.path.join(self.filename, RAW), dtype=self.dtype,
+                         mode=mode, shape=self.shape)
+
+    def read_chunk(self, i) :
+        '''
+        Read the i-th chunk
+
+        Parameters
+        ----------
+        i : int
+            index of the chunk
+
+        Returns
+        -------
+        chunk : array-like
+            slices from i * chunk_slices of the volume
+        '''
+        if not 0 <= i < self.n_chunks :
+            raise IndexError('chunk {} out of range [0, {})'.format(i, self.n_chunks))
+        start = i * self.chunk_slices
+        shape = (min(self.chunk_slices, self.shape[0] - start), ) + self.shape[1:]
+
+        if self.compression is None :
+            return np.array(self.memmap()[start : start + shape[0]])
+        with open(os.path.join(self.filename, _chunk_filename(i)), 'rb') as fp :
+            buffer = zlib.decompress(fp.read())
+        return np.frombuffer(buffer, dtype=self.dtype).reshape(shape).copy()
+
+    def read_slices(self, start, stop) :
+        '''
+        Read the slices in [start, stop), decoding only their chunks
+
+        Parameters
+        ----------
+        start : int
+            first slice
+        stop : int
+            last slice, excluded
+
+        Returns
+        -------
+        slab : array-like
+            array of shape (stop - start, ) + the shape of a slice
+        '''
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        if self.compression is None :
+            return np.array(self.memmap()[start : stop])
+
+        first = start // self.chunk_slices
+        last = -(-stop // self.chunk_slices)
+        chunks = [self.read_chunk(i) for i in range(first, last)]
+        slab = np.concatenate(chunks, axis=0) if chunks else \
+               np.empty((0, ) + self.shape[1:], dtype=self.dtype)
+        offset = first * self.chunk_slices
+        return slab[start - offset : stop - offset]
+
+    def to_image(self, start=0, stop=None) :
+        '''
+        Read the slices in [start, stop) as an image with the volume geometry
+
+        Parameters
+        ----------
+        start : int
+            first slice
+        stop : int
+            last slice, excluded. Default None, which means the last slice
+
+        Returns
+        -------
+        image : SimpleITK image
+            image of the slices, with the origin moved to the first slice
+        '''
+        stop = self.shape[0] if stop is None else stop
+        if self.compression is None :
+            # copied only once, from the memory map into the image
+            slab = self.memmap()[slice(start, stop)]
+        else :
+            slab = self.read_slices(start, stop)
+        image = to_image(slab, is_vector=self.components > 1)
+        image.SetSpacing(self.spacing)
+        image.SetDirection(self.direction)
+        image.SetOrigin(self.origin)
+        if start :
+            image.SetOrigin(image.TransformContinuousIndexToPhysicalPoint([0., 0., float(start)]))
+        return image
+
+
+
+def read_chunked(filename) :
+    '''
+    Read the whole chunked volume as an image
+
+    Parameters
+    ----------
+    filename : str
+        path to the volume directory
+
+    Returns
+    -------
+    image : SimpleITK image
+        image with the volume geometry
+    '''
+    return ChunkedVolume(filename).to_image()
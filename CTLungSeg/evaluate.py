@@ -1,10 +1,10 @@
 import os
 import argparse
 import numpy as np
-import pandas as pd
-import SimpleITK as sitk
 
 from CTLungSeg.utils import read_image
+from CTLungSeg.bridge import array_view
+from CTLungSeg.threads import add_threads_argument, set_threads
 
 from CTLungSeg.metrics import dice
 from CTLungSeg.metrics import recall
@@ -41,6 +41,7 @@ def parse_args():
                             required=False,
                             default=None,
                             help='Path to the output .csv file  to store the evaluation results')
+    add_threads_argument(parser)
     args = parser.parse_args()
 
     return args
@@ -49,15 +50,16 @@ def parse_args():
 def main():
 
     args = parse_args()
+    set_threads(args.threads)
 
-    # read the images
-    gt = read_image(args.gt)
-    pred = read_image(args.pred)
+    # read the images, kept alive as long as their views are used
+    gt_image = read_image(args.gt)
+    pred_image = read_image(args.pred)
 
-    # convert to array
+    # read-only views of the images
 
-    gt = sitk.GetArrayFromImage(gt)
-    pred = sitk.GetArrayFromImage(pred)
+    gt = array_view(gt_image)
+    pred = array_view(pred_image)
 
 
     # and compute all the required metrics
@@ -87,6 +89,7 @@ def main():
             raise ValueError(f'output file must be a .csv, received .{ext} instead')
         
         # and save the results
+        import pandas as pd
         df = pd.DataFrame().from_dict(metrics_dict)
         _ = df.to_csv(args.output, sep=',', index=False)
 
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from CTLungSeg.method import median_filter, std_filter
+from CTLungSeg.method import adaptive_histogram_equalization, adjust_gamma
+from CTLungSeg.utils import image_statistics, normalize
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['FeatureExtractor']
+
+
+class FeatureExtractor :
+    '''
+    Build the multichannel image used for the voxel clustering. Each channel
+    is the response of a filter, normalized according to its mean and
+    standard deviation. The channels are, in order :
+
+        - adaptive histogram equalization
+        - median filter
+        - gamma correction
+        - standard deviation filter
+
+    Each normalized channel is written directly into a float32 buffer of shape
+    (n_images, height, width, n_channels), without intermediate copies.
+
+    Parameters
+    ----------
+    ahe_radius : int
+        neighbourhood radius of the adaptive histogram equalization
+    median_radius : int
+        neighbourhood radius of the median filter
+    std_radius : int
+        neighbourhood radius of the standard deviation filter
+    gamma : float
+        power of the gamma correction
+    ahe_mode : str
+        mode of the adaptive histogram equalization, can be ['exact', 'tiled']
+        (see adaptive_histogram_equalization). Default 'exact'
+
+    Example
+    -------
+    >>> from CTLungSeg.utils import read_image
+    >>> from CTLungSeg.features import FeatureExtractor
+    >>>
+    >>> image = read_image('path/to/lung/image.nrrd')
+    >>> extractor = FeatureExtractor(ahe_radius=5, median_radius=3)
+    >>> features = extractor(image)
+    >>> features.shape
+    (n_images, height, width, 4)
+    '''
+
+    channels = ('equalized', 'median', 'gamma', 'std')
+
+    def __init__(self, ahe_radius=5, median_radius=3, std_radius=3, gamma=1.5,
+                 ahe_mode='exact') :
+
+        self.ahe_radius = ahe_radius
+        self.median_radius = median_radius
+        self.std_radius = std_radius
+        self.gamma = gamma
+        self.ahe_mode = ahe_mode
+
+    @property
+    def n_channels(self) :
+        '''
+        Number of feature channels
+        '''
+        return len(self.channels)
+
+    @property
+    def halo(self) :
+        '''
+        Largest neighbourhood radius of the filters
+        '''
+        return max(self.ahe_radius, self.median_radius, self.std_radius)
+
+    def get_params(self) :
+        '''
+        Return the parameters of each channel filter
+
+        Returns
+        -------
+        params : dict
+            filter parameters
+        '''
+        return {'ahe_radius' : self.ahe_radius,
+                'median_radius' : self.median_radius,
+                'std_radius' : self.std_radius,
+                'gamma' : self.gamma,
+                'ahe_mode' : self.ahe_mode}
+
+    def response(self, image, channel) :
+        '''
+        Compute the filter response of the specified channel, not normalized
+
+        Parameters
+        ----------
+        image : SimpleITK image
+            image to process
+        channel : str
+            channel name, one of FeatureExtractor.channels
+
+        Returns
+        -------
+        filtered : SimpleITK image
+            filter response
+        '''
+        if channel == 'equalized' :
+            return adaptive_histogram_equalization(image=image, radius=self.ahe_radius,
+                                                   mode=self.ahe_mode)
+        if channel == 'median' :
+            return median_filter(img=image, radius=self.median_radius)
+        if channel == 'gamma' :
+            return adjust_gamma(image=image, gamma=self.gamma)
+        return std_filter(image=image, radius=self.std_radius)
+
+    def transform(self, image, out=None, n_voxels=None, statistics=None) :
+        '''
+        Compute the normalized feature channels of the image
+
+        Parameters
+        ----------
+        image : SimpleITK image
+            image to process
+        out : array-like of shape (n_images, height, width, n_channels)
+            float32 buffer in which the features are written. Default None,
+            which means that a new buffer is allocated
+        n_voxels : int
+            if image is a crop of a larger zero-valued image, number of voxels
+            of the whole image, used to compute the normalization statistics.
+            Default None, which means that the statistics of image are used
+        statistics : list of tuple
+            mean and standard deviation of each channel response, used instead
+            of the ones of image, e.g. when image is a block of a larger image.
+            Default None
+
+        Returns
+        -------
+        features : array-like of shape (n_images, height, width, n_channels)
+            normalized features
+        '''
+        shape = image.GetSize()[::-1] + (self.n_channels, )
+        if out is None :
+            out = np.empty(shape, dtype=np.float32)
+        elif out.shape != shape :
+            raise ValueError('Buffer shape doesn t match the features one : {} != {}'.format(
+                                out.shape, shape))
+
+        for i, channel in enumerate(self.channels) :
+            filtered = self.response(image, channel)
+            if statistics is None :
+                channel_statistics = image_statistics(filtered, n_voxels=n_voxels)
+            else :
+                channel_statistics = statistics[i]
+            normalize(filtered, out=out[..., i], statistics=channel_statistics)
+
+        return out
+
+    __call__ = transform
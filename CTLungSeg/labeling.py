@@ -7,11 +7,14 @@ import SimpleITK as sitk
 
 from time import time
 
-from CTLungSeg.utils import read_image, load_pickle, normalize
-from CTLungSeg.utils import write_volume
-from CTLungSeg.method import median_filter, std_filter, threshold
-from CTLungSeg.method import adaptive_histogram_equalization, adjust_gamma
-from CTLungSeg.segmentation import imlabeling
+from CTLungSeg.utils import read_image, load_pickle
+from CTLungSeg.utils import write_volume, foreground_bounding_box
+from CTLungSeg.utils import paste_into_empty
+from CTLungSeg.bridge import array_view, to_image
+from CTLungSeg.method import majority_filter, threshold
+from CTLungSeg.features import FeatureExtractor
+from CTLungSeg.segmentation import imlabeling_target
+from CTLungSeg.threads import add_threads_argument, set_threads
 
 __author__ = ['Riccado Biondi', 'Nico Curti']
 __email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
@@ -40,6 +43,36 @@ def parse_args():
                         type=str,
                         action='store',
                         help='output name label')
+    parser.add_argument('--max_memory',
+                        dest='max_memory',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='memory budget for the labeling, in MB, shared by the --n_jobs threads',
+                        default=None)
+    parser.add_argument('--n_jobs',
+                        dest='n_jobs',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of labeling threads, -1 to use all the cores',
+                        default=1)
+    parser.add_argument('--coarse_factor',
+                        dest='coarse_factor',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='in-plane downsampling factor of the coarse-to-fine labeling',
+                        default=None)
+    parser.add_argument('--ahe_mode',
+                        dest='ahe_mode',
+                        required=False,
+                        type=str,
+                        choices=['exact', 'tiled'],
+                        action='store',
+                        help='mode of the adaptive histogram equalization',
+                        default='exact')
+    add_threads_argument(parser)
 
     args = parser.parse_args()
     return args
@@ -52,27 +85,185 @@ centroids = {'healthy lung': [1.0291475, 1.7986686, 1.3147535, 1.6199226],
             'Noise'     : [8.233303,  1.9194404, 6.503928,  6.670035]}
 
 
-def main(volume, centroids):
+def _blocks(shape, block) :
+    '''
+    Return the slices of the blocks which tile an array of the given shape
+    '''
+    ranges = [range(0, n, block) for n in shape]
+    return [tuple(slice(s, min(s + block, n)) for s, n in zip(start, shape))
+            for start in np.stack(np.meshgrid(*ranges, indexing='ij'), -1).reshape(-1, len(shape))]
+
+
+def _block_image(volume, block, halo) :
+    '''
+    Extract the block, enlarged by halo voxels, from the volume and return
+    it with the slices of the block core into the extracted image
+    '''
+    shape = volume.GetSize()[::-1]
+    lower = [max(b.start - halo, 0) for b in block]
+    upper = [min(b.stop + halo, n) for b, n in zip(block, shape)]
+    image = volume[lower[2]:upper[2], lower[1]:upper[1], lower[0]:upper[0]]
+    core = tuple(slice(b.start - l, b.stop - l) for b, l in zip(block, lower))
+    return image, core
+
+
+def _sampled_statistics(volume, extractor, blocks, n_voxels) :
+    '''
+    Estimate mean and standard deviation of each feature channel of the whole
+    image from the filter responses on a sample of blocks of the volume.
+    The voxels of the whole image outside the volume are zeros.
+    '''
+    n_channels = extractor.n_channels
+    sums = np.zeros((n_channels, 3))
+    for block in blocks :
+        image, core = _block_image(volume, block, extractor.halo)
+        for i, channel in enumerate(extractor.channels) :
+            response = extractor.response(image, channel)
+            values = array_view(response)[core].astype(np.float64)
+            sums[i] += [values.size, values.sum(), np.square(values).sum()]
 
+    n_crop = volume.GetNumberOfPixels()
+    statistics = []
+    for count, total, squares in sums :
+        # extrapolate the sums to the volume and add the outside zeros
+        total, squares = total * n_crop / count, squares * n_crop / count
+        mean = total / n_voxels
+        sigma = np.sqrt(max(squares - n_voxels * mean**2, 0.) / (n_voxels - 1))
+        if np.isclose(sigma, 0) :
+            raise ZeroDivisionError('Cannot normalize image with Sigma == 0')
+        statistics.append((mean, sigma))
+    return statistics
 
-    # prepare the image
-    weight = sitk.GetArrayFromImage(threshold(image=volume, upper=4000, lower=1))
-    equalized = normalize(adaptive_histogram_equalization(image=volume, radius=5))
-    median = normalize(median_filter(img=volume, radius=3))
-    std = normalize(std_filter(image=volume, radius=3))
-    gamma = normalize(adjust_gamma(image=volume, gamma=1.5))
 
-    mc = np.stack([sitk.GetArrayFromImage(equalized),
-                   sitk.GetArrayFromImage(median),
-                   sitk.GetArrayFromImage(gamma),
-                   sitk.GetArrayFromImage(std)], axis = -1)
+def coarse_to_fine(volume, centroids, extractor, target=3, factor=2, band=None,
+                   block=64, sample_fraction=.1, n_voxels=None, n_jobs=1, seed=42) :
+    '''
+    Identify the voxels of the target cluster with a coarse-to-fine approach.
+    The volume is downsampled in-plane by factor, its features are computed
+    and labeled, and the target mask is upsampled to the full resolution.
+    Only the voxels in a band around the boundary of the target mask are then
+    labeled again from full resolution features, computed block-wise only
+    on the blocks which contain band voxels. The normalization statistics of
+    the full resolution features are estimated on a random sample of blocks.
+
+    Parameters
+    ----------
+    volume : SimpleITK image
+        lung image
+    centroids : array-like of shape (n_centroids, n_features)
+        centroids used for the labeling
+    extractor : FeatureExtractor
+        feature extractor
+    target : int
+        index of the target centroid
+    factor : int
+        in-plane downsampling factor
+    band : int
+        half-width, in voxels, of the band around the target boundary.
+        Default None, which means factor
+    block : int
+        side of the cubic blocks used for the full resolution features
+    sample_fraction : float
+        fraction of blocks used to estimate the normalization statistics
+    n_voxels : int
+        number of voxels of the whole image, if volume is a crop of a larger
+        zero-valued image. Default None, which means the volume size
+    n_jobs : int
+        number of labeling threads
+    seed : int
+        seed of the block sampling
+
+    Returns
+    -------
+    target : array-like of shape (n_images, height, width)
+        uint8 array, 1 for the voxels of the target cluster
+    '''
+    n_voxels = volume.GetNumberOfPixels() if n_voxels is None else n_voxels
+    band = factor if band is None else band
+    shape = volume.GetSize()[::-1]
+    # the masks are kept alive as long as their views are used
+    foreground = threshold(image=volume, upper=4000, lower=1)
+    weight = array_view(foreground)
+
+    # coarse labeling
+    coarse = sitk.BinShrink(volume, [factor, factor, 1])
+    coarse_foreground = threshold(image=coarse, upper=4000, lower=1)
+    coarse_weight = array_view(coarse_foreground)
+    features = extractor(coarse, n_voxels=max(n_voxels // factor**2, 2))
+    coarse_target = imlabeling_target(image=features, centroids=centroids, target=target,
+                                      weight=coarse_weight, n_jobs=n_jobs)
+    del features
+    coarse_target = coarse_target.astype(np.uint8)
+
+    # nearest neighbour upsampling, replicating the last row and column if the
+    # size is not a multiple of the factor
+    upsampled = np.repeat(np.repeat(coarse_target, factor, axis=1), factor, axis=2)
+    pad = [(0, 0)] + [(0, max(n - u, 0)) for n, u in zip(shape[1:], upsampled.shape[1:])]
+    result = np.pad(upsampled, pad, mode='edge')[:, :shape[1], :shape[2]]
+    result = np.ascontiguousarray(result) * (weight != 0)
+
+    # band around the boundary of the target mask
+    mask = to_image(result)
+    radius = [band] * 3
+    boundary = sitk.And(sitk.BinaryDilate(mask, radius), sitk.Not(sitk.BinaryErode(mask, radius)))
+    refine = (array_view(boundary) != 0) & (weight != 0)
+
+    blocks = _blocks(shape, block)
+    rng = np.random.default_rng(seed)
+    n_sample = max(int(round(sample_fraction * len(blocks))), 1)
+    sample = [blocks[i] for i in rng.choice(len(blocks), n_sample, replace=False)]
+    statistics = _sampled_statistics(volume, extractor, sample, n_voxels)
+
+    # full resolution labeling of the band
+    for b in blocks :
+        todo = refine[b]
+        if not todo.any() :
+            continue
+        # shrink the block to the bounding box of its band voxels
+        index = np.nonzero(todo)
+        b = tuple(slice(s.start + i.min(), s.start + i.max() + 1) for s, i in zip(b, index))
+        todo = refine[b]
+        image, core = _block_image(volume, b, extractor.halo)
+        features = extractor(image, statistics=statistics)[core]
+        is_target = imlabeling_target(image=features, centroids=centroids, target=target,
+                                      weight=todo, n_jobs=n_jobs)
+        result[b][todo] = is_target[todo]
+
+    return result.astype(np.uint8)
+
+
+def main(volume, centroids, max_memory=None, n_jobs=1, crop=True, extractor=None,
+         coarse_factor=None):
+
+    if extractor is None :
+        extractor = FeatureExtractor(ahe_radius=5, median_radius=3,
+                                     std_radius=3, gamma=1.5)
+    # process only the bounding box of the lung, enlarged by the largest
+    # filter radius : outside of it the volume is zero, and so are the
+    # filter responses and the labels
+    reference = volume
+    n_voxels = volume.GetNumberOfPixels()
+    if crop :
+        index, size = foreground_bounding_box(volume, halo=max(extractor.halo, 3))
+        volume = sitk.RegionOfInterest(volume, size, index)
+
+    if coarse_factor is not None :
+        labels = coarse_to_fine(volume, centroids, extractor, target=3,
+                                factor=coarse_factor, n_voxels=n_voxels,
+                                n_jobs=n_jobs)
+    else :
+        # prepare the image
+        foreground = threshold(image=volume, upper=4000, lower=1)
+        weight = array_view(foreground)
+        mc = extractor(volume, n_voxels=n_voxels)
 
+        labels = imlabeling_target(image=mc, centroids=centroids, target=3, weight=weight,
+                                   max_memory=max_memory, n_jobs=n_jobs)
+    labels = to_image(labels, reference=volume)
+    labels = majority_filter(img=labels, radius=3)
 
-    labels = imlabeling(image=mc, centroids=centroids, weight=weight)
-    labels = (labels == 3).astype(np.uint8)
-    labels = sitk.GetImageFromArray(labels)
-    labels.CopyInformation(volume)
-    labels = median_filter(img=labels, radius=3)
+    if crop :
+        labels = paste_into_empty(labels, reference, index)
 
     return labels
 
@@ -82,13 +273,18 @@ if __name__ == '__main__' :
     start = time()
     #load parameters
     args = parse_args()
+    set_threads(args.threads)
     volume = read_image(filename=args.filename)
     if args.centroids != '' :
         center = load_pickle(filename=args.centroids)
     else :
         center =np.asarray([np.array(v) for _, v in centroids.items()])
 
-    labels = main(volume, center)
+    max_memory = None if args.max_memory is None else args.max_memory * 2**20
+    extractor = FeatureExtractor(ahe_radius=5, median_radius=3, std_radius=3,
+                                 gamma=1.5, ahe_mode=args.ahe_mode)
+    labels = main(volume, center, max_memory=max_memory, n_jobs=args.n_jobs,
+                  extractor=extractor, coarse_factor=args.coarse_factor)
 
     write_volume(image=labels, output_filename=args.output)
 
@@ -2,21 +2,24 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import numpy as np
-import SimpleITK as sitk
 
 from time import time
-from lungmask.mask import apply
 from CTLungSeg.utils import read_image, write_volume
-from CTLungSeg.utils import shift_and_crop
+from CTLungSeg.utils import shift_and_crop, process_in_slabs
+from CTLungSeg.bridge import to_image
 from CTLungSeg.method import apply_mask
-from CTLungSeg.segmentation import remove_vessels
+from CTLungSeg.segmentation import remove_vessels, vessel_halo
+from CTLungSeg.threads import add_threads_argument, set_threads, set_torch_threads
 
 
 __author__  = ['Riccardo Biondi', 'Nico Curti']
 __email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
 
 
+# sigma of the gaussian smoothing applied before the vesselness
+VESSEL_SIGMA = 2.
+
+
 def parse_args():
     description = 'Lung Extraction'
     parser = argparse.ArgumentParser(description=description)
@@ -33,35 +36,161 @@ def parse_args():
                         type=str,
                         action='store',
                         help='Masked image filename')
+    parser.add_argument('--slab_size',
+                        dest='slab_size',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of slices processed at once, to bound the memory',
+                        default=None)
+    parser.add_argument('--vessel_spacing',
+                        dest='vessel_spacing',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='spacing, in mm, of the coarser image on which the vessels are '
+                             'found. Default the image spacing',
+                        default=None)
+    parser.add_argument('--vessel_intensity',
+                        dest='vessel_intensity',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='minimum HU of the removed vessel voxels. Default no minimum',
+                        default=None)
+    add_threads_argument(parser)
 
     args = parser.parse_args()
+    if args.slab_size is not None and args.vessel_spacing is not None :
+        parser.error('--vessel_spacing cannot be combined with --slab_size')
     return args
 
 
-def main(image) :
-
-    # find the lungmask
-    mask = apply(image)
+def load_model(modeltype='unet', modelname='R231') :
+    '''
+    Load the lungmask model, so it can be reused across several scans
+
+    Parameters
+    ----------
+    modeltype : str
+        lungmask model architecture
+    modelname : str
+        name of the lungmask pre-trained weights
+
+    Returns
+    -------
+    model : torch.nn.Module
+        lungmask model with the loaded weights
+    '''
+    from lungmask.mask import get_model
+    set_torch_threads()
+    return get_model(modeltype, modelname)
+
+
+def _extract(image, model=None, batch_size=20, vessel_spacing=None, vessel_intensity=None) :
+    '''
+    Lung extraction pipeline : lungmask, masking, vessel removal and HU
+    shift of the image
+    '''
+    # lungmask (and torch) is imported here, since it is slow to load
+    from lungmask.mask import apply
+    if model is None :
+        set_torch_threads()
+
+    # find the lungmask, the default model is loaded if not provided
+    mask = apply(image, model=model, batch_size=batch_size)
     # remove the distinction between left and right lung label
-    mask = (mask != 0).astype(np.uint8)
-    mask = sitk.GetImageFromArray(mask)
-    mask.CopyInformation(image)
+    mask = to_image(mask != 0, reference=image)
 
     masked = apply_mask(image=image, mask=mask, outside_value=-1000)
-    
-    wo_vessels = remove_vessels(image=masked)
+
+    # smoothing and vesselness are computed only around the lungs
+    wo_vessels = remove_vessels(image=masked, sigma=VESSEL_SIGMA, mask=mask,
+                                spacing=vessel_spacing, intensity=vessel_intensity)
     out = shift_and_crop(image=wo_vessels)
 
     return out
 
 
+def slab_halo(image, sigma=VESSEL_SIGMA) :
+    '''
+    Number of slices required on each side of a slab to cover the support of
+    the gaussian smoothing (4 sigma) and of the Hessian finite differences
+    used by the vessel removal
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+    sigma : float
+        sigma, in physical units, of the vessel removal smoothing
+
+    Returns
+    -------
+    halo : int
+        number of slices
+    '''
+    return vessel_halo(image, sigma)[2]
+
+
+def main(image, model=None, batch_size=20, slab_size=None, vessel_spacing=None,
+         vessel_intensity=None) :
+    '''
+    Lung extraction of the CT scan, optionally over overlapping slabs of
+    slices. The slab halo covers the support of the full resolution vessel
+    removal, so the result is the same as on the whole scan; the coarse
+    vessel removal resamples each slab on its own grid, so vessel_spacing
+    cannot be combined with slab_size.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        CT scan
+    model : torch.nn.Module
+        lungmask model. Default None, which means that the default model is
+        loaded, only once for all the slabs
+    batch_size : int
+        number of slices processed at once by lungmask
+    slab_size : int
+        number of slices processed at once. Default None, which means the
+        whole scan
+    vessel_spacing : float
+        spacing of the vessel removal, see segmentation.remove_vessels
+    vessel_intensity : float
+        minimum HU of the removed vessels, see segmentation.remove_vessels
+
+    Returns
+    -------
+    lung : SimpleITK image
+        lung image, zero outside the lungs
+    '''
+    if slab_size is not None and vessel_spacing is not None :
+        raise ValueError('vessel_spacing cannot be combined with slab_size')
+
+    if slab_size is None :
+        return _extract(image, model=model, batch_size=batch_size,
+                        vessel_spacing=vessel_spacing, vessel_intensity=vessel_intensity)
+
+    # the model is loaded only once, instead of once for each slab
+    if model is None :
+        model = load_model()
+    extract = lambda image : _extract(image, model=model, batch_size=batch_size,
+                                      vessel_intensity=vessel_intensity)
+    # process overlapping slabs, so the peak memory of the intermediate images
+    # depends on the slab size instead of the number of slices
+    return process_in_slabs(image, extract, slab_size=slab_size, halo=slab_halo(image))
+
+
 if __name__ == '__main__' :
 
     start = time()
 
     args = parse_args()
+    set_threads(args.threads)
     volume = read_image(filename=args.input)
-    lung = main(image=volume)
+    lung = main(image=volume, slab_size=args.slab_size,
+                vessel_spacing=args.vessel_spacing,
+                vessel_intensity=args.vessel_intensity)
     print(args.output)
     write_volume(image=lung, output_filename=args.output)
 
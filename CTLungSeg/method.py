@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import itertools
+import numpy as np
 import SimpleITK as sitk
 
+from CTLungSeg.cache import cached
+from CTLungSeg.bridge import array_view, to_array, to_image
+
 __author__  = ['Riccardo Biondi', 'Nico Curti']
 __email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
 
@@ -13,9 +18,75 @@ bounding_values = {'uint8' : [0, 255],
 image_types = {'uint8' : sitk.sitkUInt8,
             'uint16': sitk.sitkUInt16,
             'HU' : sitk.sitkUInt16 }
+# scalar pixel types corrected by look-up table in adjust_gamma, and the
+# maximum number of entries of the table
+_integer_types = (sitk.sitkUInt8, sitk.sitkInt8, sitk.sitkUInt16,
+                  sitk.sitkInt16, sitk.sitkUInt32, sitk.sitkInt32)
+_LUT_SIZE = 2**16 + 1
+
+
+
+def _summed_area_table(array, dtype) :
+    '''
+    Compute the summed-area table of the array, with a leading zero plane
+    along each axis
+
+    Parameters
+    ----------
+    array : array-like
+        input array
+    dtype : numpy dtype
+        type of the table, wide enough to store the sum of the array
+
+    Returns
+    -------
+    table : array-like
+        summed-area table, with one more element than array along each axis
+    '''
+    table = np.zeros(tuple(n + 1 for n in array.shape), dtype=dtype)
+    table[(slice(1, None), ) * array.ndim] = array
+    for axis in range(array.ndim) :
+        np.cumsum(table, axis=axis, out=table)
+    return table
+
+
+
+def _box_sums(table, shape, side, offset=0) :
+    '''
+    Compute the sums over the boxes of the given side from a summed-area
+    table, by inclusion-exclusion over the box corners. The box of the output
+    element i starts at the element i + offset of the summed array.
+
+    Parameters
+    ----------
+    table : array-like
+        summed-area table (see _summed_area_table)
+    shape : tuple
+        shape of the output
+    side : int
+        side of the boxes
+    offset : int
+        offset of the boxes along each axis
 
+    Returns
+    -------
+    sums : array-like
+        sum over the box of each output element
+    '''
+    ndim = len(shape)
+    sums = np.zeros(shape, dtype=table.dtype)
+    for corner in itertools.product((0, 1), repeat=ndim) :
+        index = tuple(slice(offset + side * c, offset + side * c + n)
+                      for c, n in zip(corner, shape))
+        if (ndim - sum(corner)) % 2 :
+            sums -= table[index]
+        else :
+            sums += table[index]
+    return sums
 
 
+
+@cached
 def median_filter(img, radius):
     '''
     Apply median blurring filter on the specified image.
@@ -54,10 +125,175 @@ def median_filter(img, radius):
 
 
 
+@cached
+def majority_filter(img, radius):
+    '''
+    Apply a majority vote filter on the specified binary image: each voxel is
+    set to the foreground value if more than half of its neighbourhood is
+    foreground. On binary images this is the median filter, but the
+    neighbourhood counts are computed in constant time per voxel from the
+    summed-area table of the image bounding box of the foreground. As for
+    the median filter, the voxels outside the image are the replica of the
+    nearest border voxel.
+
+    Parameters
+    ----------
+
+    img: SimleITK image
+        binary image or stack of images to filter, with zero background
+    radius : int
+        neighbourhood radius. must be greater or equal than one.
+
+    Returns
+    -------
+    filtered : SimpleITK image
+        filtered image, with the same type of the input one
+
+    Examples
+    --------
+    >>> from CTLungSeg.utils import read_image
+    >>> from CTLungSeg.method import majority_filter
+    >>> # load the binary mask
+    >>> mask = read_image('path/to/input/mask.nrrd')
+    >>> # equal to median_filter(mask, 3), but faster
+    >>> filtered = majority_filter(mask, 3)
+    '''
+
+    if radius <=0 :
+        raise ValueError('Radius must be greater or equal than one')
+    radius = int(radius)
+    array = array_view(img)
+    out = np.zeros(array.shape, dtype=array.dtype)
+
+    foreground = np.nonzero(array)
+    if len(foreground[0]) :
+        # outside the bounding box of the foreground enlarged by radius all
+        # the neighbourhoods are empty; since the crop border is zero, or
+        # it is the image border, the edge padding reproduces the image
+        # boundary condition of the median filter
+        lower = [max(int(f.min()) - radius, 0) for f in foreground]
+        upper = [min(int(f.max()) + radius + 1, n) for f, n in zip(foreground, array.shape)]
+        box = tuple(slice(l, u) for l, u in zip(lower, upper))
+        crop = array[box]
+        padded = np.pad(crop != 0, radius, mode='edge')
+
+        table = _summed_area_table(padded, dtype=np.int32)
+        side = 2 * radius + 1
+        counts = _box_sums(table, crop.shape, side)
+        out[box][counts > side**crop.ndim // 2] = crop.max()
+
+    filtered = to_image(out, reference=img)
+    return filtered
+
+
+
+def local_statistics(image, radius, slab_size=32, mean=True, dtype=np.float64):
+    '''
+    Compute the mean and the standard deviation of the cubic neighbourhood of
+    each voxel. Both are computed in constant time per voxel from the
+    summed-area tables of the image and of its square, built slab by slab
+    along the first array axis. The tables are int64 for 8 and 16 bit integer
+    images, so that the sums are exact, and float64 otherwise, on the image
+    shifted by its mean to limit the round-off of the sums. As for
+    sitk.NoiseImageFilter the standard deviation is the sample one, and the
+    voxels outside the image are the replica of the nearest border voxel.
+    Several radii can be computed from the same tables in a single call.
+    Only the output images are allocated for the whole image, so skip the
+    mean and choose a narrow output type when they are not required.
+
+    Parameters
+    ----------
+
+    image : SimpleITK image
+        image to filter
+
+    radius: int or list of int
+        radius of the neighborhood, or list of radii
+
+    slab_size : int
+        number of slices of the summed-area tables
+
+    mean : bool
+        if False the local mean is not computed. Default True
+
+    dtype : numpy dtype
+        type of the output images, the values are cast as by sitk.Cast.
+        Default float64
+
+    Returns
+    -------
+
+    statistics : tuple or list of tuple
+        local mean (None if mean is False) and local standard deviation
+        SimpleITK images, one tuple for each radius if radius is a list
+
+    Examples
+    --------
+    >>> from CTLungSeg.utils import read_image
+    >>> from CTLungSeg.method import local_statistics
+    >>>
+    >>> volume = read_image('path/to/input/series/')
+    >>> mean, std = local_statistics(volume, 3)
+    >>> (mean1, std1), (mean3, std3) = local_statistics(volume, [1, 3])
+    '''
+    radii = list(radius) if isinstance(radius, (list, tuple)) else [radius]
+    if any(r <= 0 for r in radii) :
+        raise ValueError('Radius must be greater or equal than one')
+    if slab_size <= 0 :
+        raise ValueError('slab_size must be greater or equal than one')
+    radii = [int(r) for r in radii]
+
+    array = array_view(image)
+    halo = max(radii)
+    # the sums of 8 and 16 bit integers are exact with int64 tables, as in
+    # NoiseImageFilter; the other images are shifted by their mean
+    exact = np.issubdtype(array.dtype, np.integer) and array.dtype.itemsize <= 2
+    table_type = np.int64 if exact else np.float64
+    shift = 0. if exact else float(np.mean(array, dtype=np.float64))
+
+    means = [np.empty(array.shape, dtype=dtype) if mean else None for _ in radii]
+    stds = [np.empty(array.shape, dtype=dtype) for _ in radii]
+    for start in range(0, array.shape[0], slab_size) :
+        stop = min(start + slab_size, array.shape[0])
+        # only the slab is padded, replicating the border slices if needed
+        lower = max(start - halo, 0)
+        upper = min(stop + halo, array.shape[0])
+        pad = [(halo - start + lower, halo - upper + stop)] + [(halo, halo)] * (array.ndim - 1)
+        slab = np.pad(array[lower:upper].astype(table_type), pad, mode='edge')
+        if not exact :
+            slab -= shift
+        sums = _summed_area_table(slab, dtype=table_type)
+        squares = _summed_area_table(np.square(slab, out=slab), dtype=table_type)
+        del slab
+
+        shape = (stop - start, ) + array.shape[1:]
+        for r, local_mean, local_std in zip(radii, means, stds) :
+            side = 2 * r + 1
+            n = side**array.ndim
+            total = _box_sums(sums, shape, side, offset=halo - r).astype(np.float64)
+            variance = _box_sums(squares, shape, side, offset=halo - r).astype(np.float64)
+            variance -= total * total / n
+            variance /= n - 1
+            local_std[start:stop] = np.sqrt(np.maximum(variance, 0., out=variance), out=variance)
+            if local_mean is not None :
+                local_mean[start:stop] = total / n + shift
+
+    statistics = []
+    for local_mean, local_std in zip(means, stds) :
+        statistics.append((None if local_mean is None else to_image(local_mean, reference=image),
+                           to_image(local_std, reference=image)))
+
+    return statistics if isinstance(radius, (list, tuple)) else statistics[0]
+
+
+
+@cached
 def std_filter(image, radius):
     '''
-    Replace each pixel value with the standard deviation computed on a circular
-    neighbourhood with specified radius
+    Replace each pixel value with the standard deviation computed on a cubic
+    neighbourhood with specified radius. The result is equal to the one of
+    sitk.NoiseImageFilter, but it is computed in constant time per voxel
+    (see local_statistics).
 
     Parameters
     ----------
@@ -72,17 +308,18 @@ def std_filter(image, radius):
     -------
 
     filtered : SimpleITK image
-        filtered image
+        filtered image, with the same type of the input one
     '''
     if radius <=0 :
         raise ValueError('Radius must be greater or equal than one')
 
-    std = sitk.NoiseImageFilter()
-    std.SetRadius(radius)
-    return std.Execute(image)
+    # neither the mean nor a float64 copy of the std are allocated
+    _, std = local_statistics(image, radius, mean=False, dtype=array_view(image).dtype)
+    return std
 
 
 
+@cached
 def gauss_smooth(image, sigma = 1.):
     '''
     Apply a gaussian smoothing to the input image
@@ -105,7 +342,113 @@ def gauss_smooth(image, sigma = 1.):
 
 
 
-def adaptive_histogram_equalization(image, radius):
+def _tile_interpolation(n, tile) :
+    '''
+    Compute, for each position along an axis of length n split in tiles of
+    the given size, the two nearest tile centres and the linear
+    interpolation weight of the second one
+
+    Parameters
+    ----------
+    n : int
+        length of the axis
+    tile : int
+        size of the tiles
+
+    Returns
+    -------
+    lower : array-like of shape (n, )
+        index of the tile centre before the position
+    upper : array-like of shape (n, )
+        index of the tile centre after the position
+    weight : array-like of shape (n, )
+        interpolation weight of the upper tile
+    '''
+    n_tiles = -(-n // tile)
+    starts = np.arange(n_tiles) * tile
+    centres = (starts + np.minimum(starts + tile, n) - 1) / 2
+    position = np.arange(n)
+    lower = np.clip(np.searchsorted(centres, position, side='right') - 1, 0, n_tiles - 1)
+    upper = np.minimum(lower + 1, n_tiles - 1)
+    distance = centres[upper] - centres[lower]
+    weight = np.divide(position - centres[lower], distance,
+                       out=np.zeros(n), where=distance > 0)
+    return lower, upper, np.clip(weight, 0., 1.)
+
+
+
+def _tiled_equalization(image, radius, alpha, beta, n_bins=256) :
+    '''
+    Approximate the adaptive histogram equalization with the statistics of a
+    grid of tiles of side 2 * radius + 1, trilinearly interpolated between the
+    tile centres as in CLAHE.
+    As in AdaptiveHistogramEqualizationImageFilter, the GL u are scaled
+    to [-0.5, 0.5] and each one is mapped to the mean over the neighbourhood
+    voxels v of 0.5 sign(u - v)|2(u - v)|^alpha - beta (u - v) + beta u.
+    The first term is approximated as (1 - alpha)(cdf(u) - 0.5) +
+    alpha (u - mean), exact for alpha equal to 0 or 1, where cdf and mean are
+    the ones of the tile histograms. For alpha = beta = 1 the mapping is the
+    identity.
+    '''
+    array = array_view(image)
+    lo, hi = float(array.min()), float(array.max())
+    if hi == lo or (alpha == 1 and beta == 1) :
+        return sitk.Image(image)
+
+    u = (array.astype(np.float64) - lo) / (hi - lo) - .5
+    tile = 2 * int(radius) + 1
+    n_tiles = tuple(-(-n // tile) for n in array.shape)
+
+    # tile index of each voxel, as the outer product of the axis ones
+    tile_id = np.zeros(array.shape, dtype=np.int64)
+    for axis, n in enumerate(array.shape) :
+        index = np.arange(n) // tile
+        shape = [1] * array.ndim
+        shape[axis] = n
+        tile_id = tile_id * n_tiles[axis] + index.reshape(shape)
+
+    counts = np.bincount(tile_id.ravel(), minlength=int(np.prod(n_tiles)))
+    means = np.bincount(tile_id.ravel(), weights=u.ravel(), minlength=len(counts)) / counts
+
+    bins = np.clip(((u + .5) * n_bins).astype(np.int64), 0, n_bins - 1)
+    if alpha != 1 :
+        histograms = np.bincount((tile_id * n_bins + bins).ravel(),
+                                 minlength=len(counts) * n_bins).reshape(-1, n_bins)
+        # fraction of lower voxels, with half of the equal ones
+        cdfs = (np.cumsum(histograms, axis=1) - .5 * histograms) / counts[:, None]
+    del tile_id
+
+    # trilinear interpolation between the tile centres
+    interpolation = [_tile_interpolation(n, tile) for n in array.shape]
+    mean = np.zeros(array.shape)
+    cdf = np.zeros(array.shape) if alpha != 1 else None
+    for corner in itertools.product((0, 1), repeat=array.ndim) :
+        weight = np.ones([1] * array.ndim)
+        corner_id = np.zeros([1] * array.ndim, dtype=np.int64)
+        for axis, (c, (lower, upper, w)) in enumerate(zip(corner, interpolation)) :
+            shape = [1] * array.ndim
+            shape[axis] = -1
+            weight = weight * (w if c else 1. - w).reshape(shape)
+            corner_id = corner_id * n_tiles[axis] + (upper if c else lower).reshape(shape)
+        mean += weight * means[corner_id]
+        if cdf is not None :
+            cdf += weight * cdfs[corner_id, bins]
+
+    out = (alpha - beta) * (u - mean) + beta * u
+    if cdf is not None :
+        out += (1 - alpha) * (cdf - .5)
+    out = (out + .5) * (hi - lo) + lo
+
+    if np.issubdtype(array.dtype, np.integer) :
+        info = np.iinfo(array.dtype)
+        out = np.clip(np.rint(out), info.min, info.max)
+    equalized = to_image(out.astype(array.dtype), reference=image)
+    return equalized
+
+
+
+@cached
+def adaptive_histogram_equalization(image, radius, mode='exact', alpha=1., beta=1.):
     '''
     Apply the histogram equalization in a neighbourhood of each voxel.
 
@@ -116,23 +459,44 @@ def adaptive_histogram_equalization(image, radius):
     radius : int > 0
         neighbourhood radius
 
+    mode : str
+        can be ['exact', 'tiled']. 'exact' uses the
+        AdaptiveHistogramEqualizationImageFilter, which computes the histogram
+        of the neighbourhood of each voxel; 'tiled' computes the histograms
+        on a grid of tiles of side 2 * radius + 1 and trilinearly interpolates
+        them between the tile centres. Default 'exact'
+
+    alpha : float
+        how much the filter acts like the classical histogram equalization
+        (0) or like an unsharp mask (1). Default 1
+
+    beta : float
+        how much the filter acts like an unsharp mask (0) or like a pass
+        through filter (1). Default 1, with alpha = 1 the output is equal to
+        the input up to the rounding
+
     Returns
     -------
     equalized : SimpleITK image
         equalized image or stack of images
     '''
+    if mode not in ['exact', 'tiled'] :
+        raise ValueError('mode {} not supported'.format(mode))
+    if mode == 'tiled' :
+        return _tiled_equalization(image, radius, alpha, beta)
+
     ahe = sitk.AdaptiveHistogramEqualizationImageFilter()
-    ahe.SetAlpha(1)
-    ahe.SetBeta(1)
+    ahe.SetAlpha(alpha)
+    ahe.SetBeta(beta)
     ahe.SetRadius(radius)
 
     return ahe.Execute(image)
 
 
 
-def adjust_gamma(image, gamma=1.0, image_type='HU'):
+def _gamma_pow(image, gamma, image_type) :
     '''
-    Apply a gamma correction on the input image: $GL_{out} = GL_{in}^{\gamma}$
+    Apply the gamma correction voxel-wise, on a float32 copy of the image
 
     Parameters
     ----------
@@ -148,10 +512,6 @@ def adjust_gamma(image, gamma=1.0, image_type='HU'):
     out : SimpleITK image
         gamma corected image
     '''
-    if gamma == 0 :
-        raise Exception('gamma vlaue cannot be zero')
-    if image_type not in ['HU', 'uint8', 'uint16'] :
-        raise Exception('image type {} not supported'.format(type))
     invGamma = 1.0 / gamma
 
     # cast image to float
@@ -167,6 +527,83 @@ def adjust_gamma(image, gamma=1.0, image_type='HU'):
 
 
 
+def _gamma_lut(image, gamma, image_type, slab_size=16) :
+    '''
+    Apply the gamma correction to an integer image by a look-up table,
+    computed once on the range of the image values
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        integer image stack to adjust
+    gamma : float
+        power of the correction
+    image_type : str
+        input data type: can be ['uint8', 'uint16', 'HU'].
+    slab_size : int
+        number of slices indexed at once
+
+    Returns
+    -------
+    out : SimpleITK image
+        gamma corected image, None if the range of the values is too wide
+        for a look-up table
+    '''
+    array = array_view(image)
+    low, high = int(array.min()), int(array.max())
+    if high - low >= _LUT_SIZE :
+        return None
+
+    # the table is the voxel-wise correction of all the values in the range,
+    # so the result is the same by construction
+    values = np.arange(low, high + 1, dtype=array.dtype)
+    lut = to_array(_gamma_pow(to_image(values.reshape(1, -1)), gamma, image_type)).ravel()
+
+    out = np.empty(array.shape, dtype=lut.dtype)
+    for start in range(0, array.shape[0], slab_size) :
+        slab = slice(start, start + slab_size)
+        index = array[slab].astype(np.intp)
+        index -= low
+        np.take(lut, index, out=out[slab])
+
+    out = to_image(out, reference=image)
+    return out
+
+
+
+def adjust_gamma(image, gamma=1.0, image_type='HU'):
+    '''
+    Apply a gamma correction on the input image: $GL_{out} = GL_{in}^{\gamma}$.
+    Integer images are corrected by a look-up table on their range of values,
+    without the float intermediate image; the other ones voxel-wise.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        image stack to adjust
+    gamma : float
+        power of the correction
+    image_type : str
+        input data type: can be ['uint8', 'uint16', 'HU'].
+
+    Returns
+    -------
+    out : SimpleITK image
+        gamma corected image
+    '''
+    if gamma == 0 :
+        raise Exception('gamma vlaue cannot be zero')
+    if image_type not in ['HU', 'uint8', 'uint16'] :
+        raise Exception('image type {} not supported'.format(type))
+
+    if image.GetPixelID() in _integer_types :
+        out = _gamma_lut(image, gamma, image_type)
+        if out is not None :
+            return out
+    return _gamma_pow(image, gamma, image_type)
+
+
+
 def apply_mask(image, mask, masking_value=0, outside_value=-1500):
     '''
     Apply a mask to image
@@ -189,6 +626,7 @@ def apply_mask(image, mask, masking_value=0, outside_value=-1500):
 
 
 
+@cached
 def vesselness(image):
     '''
     Apply Frangi filter to find the likelihood of image regions to contains
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import numpy as np
+
+from time import time
+
+from CTLungSeg.utils import read_image, write_volume, load_pickle
+from CTLungSeg.features import FeatureExtractor
+from CTLungSeg import labeling
+from CTLungSeg.threads import add_threads_argument, set_threads
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'GGO segmentation of CT scans, from lung extraction to labeling, in a single process'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--input',
+                        dest='input',
+                        required=True,
+                        type=str,
+                        nargs='+',
+                        action='store',
+                        help='Input filenames')
+    parser.add_argument('--output',
+                        dest='output',
+                        required=True,
+                        type=str,
+                        nargs='+',
+                        action='store',
+                        help='output label filenames, one for each input')
+    parser.add_argument('--centroids',
+                        dest='centroids',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='centroids',
+                        default='')
+    parser.add_argument('--lung_dir',
+                        dest='lung_dir',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='if provided, directory where the lung images are also written '
+                             'as <input name>_lung.nrrd',
+                        default=None)
+    parser.add_argument('--slab_size',
+                        dest='slab_size',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of slices of the lung extraction processed at once',
+                        default=None)
+    parser.add_argument('--vessel_spacing',
+                        dest='vessel_spacing',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='spacing, in mm, of the coarser image on which the vessels are found',
+                        default=None)
+    parser.add_argument('--vessel_intensity',
+                        dest='vessel_intensity',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='minimum HU of the removed vessel voxels',
+                        default=None)
+    parser.add_argument('--n_jobs',
+                        dest='n_jobs',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of labeling threads, -1 to use all the cores',
+                        default=1)
+    parser.add_argument('--coarse_factor',
+                        dest='coarse_factor',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='in-plane downsampling factor of the coarse-to-fine labeling',
+                        default=None)
+    parser.add_argument('--ahe_mode',
+                        dest='ahe_mode',
+                        required=False,
+                        type=str,
+                        choices=['exact', 'tiled'],
+                        action='store',
+                        help='mode of the adaptive histogram equalization',
+                        default='exact')
+    add_threads_argument(parser)
+
+    args = parser.parse_args()
+    if len(args.input) != len(args.output) :
+        parser.error('--input and --output must have the same number of filenames')
+    if args.slab_size is not None and args.vessel_spacing is not None :
+        parser.error('--vessel_spacing cannot be combined with --slab_size')
+    return args
+
+
+
+class Pipeline :
+    '''
+    GGO segmentation of CT scans : lung extraction, vessel removal, feature
+    extraction, labeling and post-filter. The intermediate images are passed
+    in memory from a stage to the next one, and the lungmask model is loaded
+    only once for all the scans; the lung images are written to disk only if
+    required.
+
+    Parameters
+    ----------
+    centroids : array-like of shape (n_centroids, n_features)
+        centroids used for the labeling
+    model : torch.nn.Module
+        lungmask model. Default None, which means that the default model is
+        loaded at the first scan
+    extractor : FeatureExtractor
+        features used for the labeling. Default None, which means the
+        labeling default ones
+    lung_dir : str
+        if provided, directory where the lung image of each named scan is
+        written as <name>_lung.nrrd. Default None, which means that the lung
+        images are not written
+    batch_size : int
+        number of slices processed at once by lungmask
+    slab_size : int
+        number of slices of the lung extraction processed at once, see
+        lung_extraction.main
+    vessel_spacing : float
+        spacing of the vessel removal, see segmentation.remove_vessels. It
+        cannot be combined with slab_size
+    vessel_intensity : float
+        minimum HU of the removed vessels, see segmentation.remove_vessels
+    max_memory : int
+        memory budget of the labeling, in bytes, shared by the n_jobs threads
+    n_jobs : int
+        number of labeling threads
+    coarse_factor : int
+        in-plane downsampling factor of the coarse-to-fine labeling. Default
+        None, which means the full resolution labeling
+
+    Example
+    -------
+    >>> from CTLungSeg.pipeline import Pipeline
+    >>> from CTLungSeg.utils import load_pickle, read_image
+    >>>
+    >>> pipeline = Pipeline(load_pickle('centroids.pkl.npy'))
+    >>> labels = pipeline(read_image('path/to/scan.nii'))
+    >>> # or from file to file, keeping the lung image
+    >>> pipeline.lung_dir = 'path/to/LUNG'
+    >>> pipeline.run('path/to/scan.nii', 'path/to/labels.nrrd')
+    '''
+
+    def __init__(self, centroids, model=None, extractor=None, lung_dir=None,
+                 batch_size=20, slab_size=None, vessel_spacing=None,
+                 vessel_intensity=None, max_memory=None, n_jobs=1,
+                 coarse_factor=None) :
+
+        self.centroids = np.asarray(centroids)
+        self.model = model
+        self.extractor = extractor
+        self.lung_dir = lung_dir
+        self.batch_size = batch_size
+        self.slab_size = slab_size
+        self.vessel_spacing = vessel_spacing
+        self.vessel_intensity = vessel_intensity
+        self.max_memory = max_memory
+        self.n_jobs = n_jobs
+        self.coarse_factor = coarse_factor
+
+    def load(self) :
+        '''
+        Load the lungmask model, if not already provided
+        '''
+        if self.model is None :
+            from CTLungSeg.lung_extraction import load_model
+            self.model = load_model()
+
+    def lung(self, volume) :
+        '''
+        Lung extraction and vessel removal
+
+        Parameters
+        ----------
+        volume : SimpleITK image
+            CT scan
+
+        Returns
+        -------
+        lung : SimpleITK image
+            lung image, zero outside the lungs
+        '''
+        # lungmask (and torch) is imported here, since it is slow to load
+        from CTLungSeg import lung_extraction
+        self.load()
+        return lung_extraction.main(volume, model=self.model, batch_size=self.batch_size,
+                                    slab_size=self.slab_size,
+                                    vessel_spacing=self.vessel_spacing,
+                                    vessel_intensity=self.vessel_intensity)
+
+    def label(self, lung) :
+        '''
+        Feature extraction, labeling and post-filter of the lung image
+
+        Parameters
+        ----------
+        lung : SimpleITK image
+            lung image
+
+        Returns
+        -------
+        labels : SimpleITK image
+            GGO label image
+        '''
+        return labeling.main(lung, self.centroids, max_memory=self.max_memory,
+                             n_jobs=self.n_jobs, extractor=self.extractor,
+                             coarse_factor=self.coarse_factor)
+
+    def __call__(self, volume, name=None) :
+        '''
+        Segment the GGO of the CT scan
+
+        Parameters
+        ----------
+        volume : SimpleITK image
+            CT scan
+        name : str
+            name of the scan, used for the lung image filename if lung_dir
+            is set
+
+        Returns
+        -------
+        labels : SimpleITK image
+            GGO label image
+        '''
+        lung = self.lung(volume)
+        if self.lung_dir is not None and name is not None :
+            os.makedirs(self.lung_dir, exist_ok=True)
+            write_volume(lung, os.path.join(self.lung_dir, '{}_lung.nrrd'.format(name)))
+        return self.label(lung)
+
+    def run(self, input, output) :
+        '''
+        Segment the GGO of the CT scan file and write the label image
+
+        Parameters
+        ----------
+        input : str
+            path to the CT scan
+        output : str
+            path to the output label image
+        '''
+        labels = self(read_image(input), name=os.path.basename(os.path.normpath(input)))
+        write_volume(labels, output)
+
+
+
+if __name__ == '__main__' :
+
+    start = time()
+    args = parse_args()
+    set_threads(args.threads)
+
+    if args.centroids != '' :
+        center = load_pickle(filename=args.centroids)
+    else :
+        center = np.asarray([np.array(v) for _, v in labeling.centroids.items()])
+
+    extractor = FeatureExtractor(ahe_radius=5, median_radius=3, std_radius=3,
+                                 gamma=1.5, ahe_mode=args.ahe_mode)
+    pipeline = Pipeline(center, extractor=extractor, lung_dir=args.lung_dir,
+                        slab_size=args.slab_size, vessel_spacing=args.vessel_spacing,
+                        vessel_intensity=args.vessel_intensity, n_jobs=args.n_jobs,
+                        coarse_factor=args.coarse_factor)
+
+    for input, output in zip(args.input, args.output) :
+        pipeline.run(input, output)
+        print(output, flush=True)
+
+    stop = time()
+    print('Process ended after {0:.3f} seconds'.format(stop - start))
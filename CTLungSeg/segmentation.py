@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import cv2
+import os
 import numpy as np
+import SimpleITK as sitk
 
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
 from CTLungSeg.method import gauss_smooth
 from CTLungSeg.method import vesselness
 from CTLungSeg.method import apply_mask
 from CTLungSeg.method import threshold
+from CTLungSeg.utils import foreground_bounding_box
 
 
 __author__  = ['Riccardo Biondi', 'Nico Curti']
@@ -17,10 +19,71 @@ __email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
 
 
 
-def remove_vessels(image, sigma=2., thr=8) :
+def vessel_halo(image, sigma=2.) :
+    '''
+    Number of voxels required on each side of a region to cover the support
+    of the gaussian smoothing (4 sigma) and of the Hessian finite differences
+    used by the vessel removal
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+    sigma : float
+        sigma, in physical units, of the vessel removal smoothing
+
+    Returns
+    -------
+    halo : list of int
+        number of voxels for each axis, in (x, y, z) order
+    '''
+    return [int(np.ceil(4. * sigma / s)) + 2 for s in image.GetSpacing()]
+
+
+
+def _coarse_vessels(image, sigma, thr, spacing) :
+    '''
+    Compute the vessel mask on the image resampled to a coarser spacing and
+    resample it back to the image grid with nearest neighbour interpolation
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+    sigma : float
+        sigma of the gaussian smoothing filter
+    thr : float
+        fixed threshold value
+    spacing : float or list of float
+        spacing of the resampled image, for all the axes or for each axis
+
+    Returns
+    -------
+    mask : SimpleITK image
+        mask with the geometry of image, 0 on the vessels and 1 elsewhere
+    '''
+    if np.isscalar(spacing) :
+        spacing = [spacing] * image.GetDimension()
+    # the axes with a spacing already coarser are not resampled
+    spacing = [max(float(c), s) for c, s in zip(spacing, image.GetSpacing())]
+    size = [int(np.ceil(n * s / c)) for n, s, c in zip(image.GetSize(), image.GetSpacing(), spacing)]
+
+    coarse = sitk.Resample(image, size, sitk.Transform(), sitk.sitkLinear,
+                           image.GetOrigin(), spacing, image.GetDirection(),
+                           -1000, sitk.sitkFloat32)
+    vessel = vesselness(gauss_smooth(coarse, sigma))
+    mask = threshold(vessel, 4000, thr, 0, 1)
+    return sitk.Resample(mask, image, sitk.Transform(), sitk.sitkNearestNeighbor, 1)
+
+
+
+def remove_vessels(image, sigma=2., thr=8, mask=None, spacing=None, intensity=None) :
     '''
     Remove vessels by applying a fixed threshold to the vesselness map.
     Before computing the vesselness a Gaussian smoothing is applied.
+    If the lung mask is provided, smoothing and vesselness are computed only
+    on its bounding box, enlarged by the support of the filters, and the
+    voxels outside it are left untouched.
 
     Parameters
     ----------
@@ -30,23 +93,202 @@ def remove_vessels(image, sigma=2., thr=8) :
         sigma of the gaussian smoothing filter
     thr : float
         fixed threshold value
+    mask : SimpleITK image
+        lung mask; the vessels are removed only in its bounding box.
+        Default None, which means the whole image
+    spacing : float or list of float
+        if provided, the vesselness is computed on the image resampled to
+        this coarser spacing, in physical units, and the vessel mask is
+        resampled back with nearest neighbour interpolation.
+        Default None, which means the image spacing
+    intensity : float
+        if provided, only the voxels of the vessel mask with a grey level
+        greater or equal than intensity are removed
 
     Return
     ------
     wo_vessels : SimpleITK image
         Image without the vessels
     '''
-    smooth = gauss_smooth(image, sigma)
-    vessel = vesselness(smooth)
-    mask = threshold(vessel, 4000, thr, 0, 1)
+    if mask is not None :
+        index, size = foreground_bounding_box(mask, halo=vessel_halo(image, sigma))
+        roi = remove_vessels(sitk.RegionOfInterest(image, size, index), sigma=sigma,
+                             thr=thr, spacing=spacing, intensity=intensity)
+        return sitk.Paste(image, roi, size, [0] * image.GetDimension(), index)
+
+    if spacing is not None :
+        mask = _coarse_vessels(image, sigma, thr, spacing)
+    else :
+        smooth = gauss_smooth(image, sigma)
+        vessel = vesselness(smooth)
+        mask = threshold(vessel, 4000, thr, 0, 1)
+    if intensity is not None :
+        # keep the dark voxels of the vessel mask
+        mask = sitk.Or(mask, sitk.Cast(image < intensity, mask.GetPixelID()))
     return apply_mask(image, mask, outside_value=-1000)
 
 
 
-def imlabeling(image, centroids, weight=None) :
+def _slab_size(image, centroids, chunk_slices=None, max_memory=None, n_workers=1) :
+    '''
+    Compute the number of slices to label at once so that the temporary
+    arrays required by the labeling fit into the memory budget. The budget
+    is shared by the slabs processed concurrently.
+
+    Parameters
+    ----------
+    image : array-like of shape (n_images, height, width, n_channels)
+        image stack to label
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+    chunk_slices : int
+        number of slices for each slab. If provided, max_memory is ignored
+    max_memory : int
+        maximum amount of memory, in bytes, for the labeling temporaries
+    n_workers : int
+        number of slabs processed concurrently, each of them gets
+        max_memory / n_workers bytes
+
+    Returns
+    -------
+    n_slices : int
+        number of slices for each slab
+    '''
+    if chunk_slices is not None :
+        if chunk_slices <= 0 :
+            raise ValueError('chunk_slices must be greater or equal than one')
+        return int(chunk_slices)
+    if max_memory is None :
+        return max(image.shape[0], 1)
+    if max_memory <= 0 :
+        raise ValueError('max_memory must be greater than zero')
+    # for each voxel : one float64 distance for each centroid, the float64
+    # difference with the current centroid, its norm and the output label
+    voxel_bytes = 8 * (len(centroids) + image.shape[-1] + 2)
+    slice_bytes = voxel_bytes * int(np.prod(image.shape[1:-1]))
+    return max(int(max_memory // n_workers // slice_bytes), 1)
+
+
+
+def _label_dtype(n_centroids) :
+    '''
+    Return the smallest unsigned integer type able to store the labels
+
+    Parameters
+    ----------
+    n_centroids : int
+        number of centroids
+
+    Returns
+    -------
+    dtype : numpy dtype
+        smallest unsigned integer type which can represent n_centroids - 1
+    '''
+    return np.min_scalar_type(max(n_centroids - 1, 0))
+
+
+
+def nearest_centroid(voxels, centroids) :
+    '''
+    Assign each voxel to the nearest centroid by using the expansion
+    ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2 of the squared euclidean distance.
+    Since ||x||^2 does not depend on the centroid, and the square root does
+    not change the argmin, only -2 x.c + ||c||^2 is computed, with a single
+    float32 matrix product against the centroid matrix.
+
+    Parameters
+    ----------
+    voxels : array-like of shape (n_voxels, n_channels)
+        voxels to label
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+
+    Returns
+    -------
+    labels : array-like of shape (n_voxels, )
+        index of the nearest centroid for each voxel, stored with the
+        smallest unsigned integer type which fits the number of centroids
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from CTLungSeg.segmentation import nearest_centroid
+    >>>
+    >>> voxels = np.random.rand(1000, 4)
+    >>> centroids = np.random.rand(5, 4)
+    >>> labels = nearest_centroid(voxels, centroids)
+    '''
+    centroids = np.asarray(centroids, dtype=np.float32)
+    voxels = np.asarray(voxels, dtype=np.float32)
+    distances = voxels @ (-2. * centroids.T)
+    distances += np.einsum('ij,ij->i', centroids, centroids)
+    return np.argmin(distances, axis=1).astype(_label_dtype(len(centroids)))
+
+
+
+def _label_slab(image, centroids, labels, mask=None, engine='norm') :
+    '''
+    Assign each voxel of a slab to the nearest centroid and write the result
+    into the provided label slab.
+
+    Parameters
+    ----------
+    image : array-like of shape (n_images, height, width, n_channels)
+        slab of the image stack to label
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+    labels : array-like of shape (n_images, height, width)
+        output slab, modified in place
+    mask : array-like of shape (n_images, height, width)
+        boolean array, only the voxels marked as True are labeled
+    engine : str
+        distance computation engine, can be ['norm', 'gemm']
+    '''
+    voxels = image[mask] if mask is not None else image.reshape((-1, image.shape[-1]))
+    if engine == 'gemm' :
+        assigned = nearest_centroid(voxels, centroids)
+    else :
+        distances = np.asarray([np.linalg.norm(voxels - c, axis=1) for c in centroids])
+        assigned = np.argmin(distances, axis=0)
+
+    if mask is not None :
+        labels[mask] = assigned
+    else :
+        labels[...] = assigned.reshape(labels.shape)
+
+
+
+def _n_workers(n_jobs) :
+    '''
+    Return the number of worker threads to use
+
+    Parameters
+    ----------
+    n_jobs : int
+        number of requested jobs. Negative values count backward from the
+        number of available cores, so -1 means all of them
+
+    Returns
+    -------
+    n_workers : int
+        number of worker threads
+    '''
+    if n_jobs == 0 :
+        raise ValueError('n_jobs cannot be zero')
+    if n_jobs < 0 :
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return int(n_jobs)
+
+
+
+def imlabeling(image, centroids, weight=None, chunk_slices=None, max_memory=None,
+               engine='norm', n_jobs=1) :
     '''
     Label an input stack of multichannel images according to the provided
     centroids and weight.
+    The stack is labeled in slabs of consecutive images, writing the results
+    into a preallocated label array, so the memory required by the distance
+    computation is bounded by the slab size instead of by the whole stack.
 
     Parameters
     ----------
@@ -60,6 +302,28 @@ def imlabeling(image, centroids, weight=None) :
         int array, each element marked as 0 will be removes from the
         labeling.
 
+    chunk_slices : int
+        number of images labeled at once. Default None, which means that
+        the slab size is estimated from max_memory
+
+    max_memory : int
+        maximum amount of memory, in bytes, used by the temporary arrays of
+        the slabs; it is split among the n_jobs threads, so each slab gets
+        max_memory / n_jobs bytes. Default None, which means that the whole
+        stack is labeled at once
+
+    engine : str
+        distance computation engine, can be ['norm', 'gemm']. 'norm' computes
+        the euclidean distance from each centroid, 'gemm' uses a single
+        float32 matrix product (see nearest_centroid) and, if no weight is
+        provided, returns the labels with the smallest integer type which fits
+        the number of centroids. Default 'norm'
+
+    n_jobs : int
+        number of threads used to label the slabs concurrently; -1 means
+        all the available cores. Each thread writes its slabs in place into
+        the output array. Default 1
+
     Returns
     -------
     labeled : array-like of shape (n_images, height, width )
@@ -77,24 +341,226 @@ def imlabeling(image, centroids, weight=None) :
     >>> to_label = load_image(filename)
     >>> centroids = load_image(centroids_file)
     >>> labeled = imlabeling(to_label, centroids)
+    >>> # label in slabs of 16 images
+    >>> labeled = imlabeling(to_label, centroids, chunk_slices=16)
+    >>> # label the slabs with 8 threads
+    >>> labeled = imlabeling(to_label, centroids, engine='gemm', n_jobs=8)
     '''
 
     if centroids.shape[1] != image.shape[-1] :
         raise Exception('Number of image channel doesn t match the number of \
                             centroids features : {} != {}\
                             '.format(image.shape[-1], centroids.shape[1]))
+    if engine not in ['norm', 'gemm'] :
+        raise ValueError('engine {} not supported'.format(engine))
     if weight  is not None :
         if weight.shape != image.shape[:-1] :
             raise Exception('Weight shape doesn t match image one : {} != {}\
                                 '.format( weight.shape, image.shape[:-1]))
-        distances = np.asarray([np.linalg.norm(image[weight != 0] -c, axis = 1) for c in centroids])
-        weight[weight != 0] = np.argmin(distances, axis=0)
-        return weight
+        labels = weight
+    elif engine == 'gemm' :
+        labels = np.empty(image.shape[:-1], dtype=_label_dtype(len(centroids)))
+    else :
+        labels = np.empty(image.shape[:-1], dtype=np.intp)
+
+    n_workers = _n_workers(n_jobs)
+    n_slices = _slab_size(image, centroids, chunk_slices, max_memory, n_workers)
+    # ensure that there is at least one slab for each worker
+    n_slices = min(n_slices, max(-(-image.shape[0] // n_workers), 1))
+
+    def label(start) :
+        stop = start + n_slices
+        mask = None if weight is None else labels[start:stop] != 0
+        _label_slab(image[start:stop], centroids, labels[start:stop], mask, engine)
+
+    starts = range(0, image.shape[0], n_slices)
+    if n_workers == 1 :
+        for start in starts :
+            label(start)
+    else :
+        # numpy releases the GIL inside its kernels, so the slabs are
+        # processed in parallel by the threads
+        with ThreadPoolExecutor(max_workers=n_workers) as pool :
+            list(pool.map(label, starts))
+
+    return labels
+
+
+
+
+def _half_spaces(centroids, target) :
+    '''
+    Compute the half-spaces whose intersection is the Voronoi cell of the
+    target centroid. A voxel x is nearer to the target centroid c_t than to
+    c_j if x.(c_j - c_t) < (||c_j||^2 - ||c_t||^2) / 2; since the argmin
+    returns the first of equally distant centroids, the inequality is not
+    strict for the centroids which follow the target.
+
+    Parameters
+    ----------
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+    target : int
+        index of the target centroid
+
+    Returns
+    -------
+    normals : array-like of shape (n_centroids - 1, n_channels)
+        float32 normal of each bisecting hyperplane
+    offsets : array-like of shape (n_centroids - 1, )
+        float32 offset of each bisecting hyperplane
+    strict : array-like of shape (n_centroids - 1, )
+        True if the inequality of the hyperplane is strict
+    '''
+    centroids = np.asarray(centroids, dtype=np.float32)
+    if not 0 <= target < len(centroids) :
+        raise ValueError('target {} out of range for {} centroids'.format(target, len(centroids)))
+    others = np.arange(len(centroids)) != target
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+
+    normals = centroids[others] - centroids[target]
+    offsets = (norms[others] - norms[target]) / 2
+    strict = np.flatnonzero(others) < target
+    return normals, offsets.astype(np.float32), strict
+
+
+
+def is_nearest_centroid(voxels, centroids, target) :
+    '''
+    Check if the target centroid is the nearest one of each voxel, by testing
+    the voxels against the bisecting hyperplanes between the target and each
+    other centroid (see _half_spaces). Each test is a dot product with the
+    hyperplane normal and only the voxels which pass it are tested against the
+    next hyperplane, so most of the voxels are rejected after the first tests.
+    The result is equal to nearest_centroid(voxels, centroids) == target, up
+    to the float32 rounding of almost equally distant voxels.
+
+    Parameters
+    ----------
+    voxels : array-like of shape (n_voxels, n_channels)
+        voxels to check
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+    target : int
+        index of the target centroid
+
+    Returns
+    -------
+    is_target : array-like of shape (n_voxels, )
+        boolean array, True for the voxels whose nearest centroid is the target
+
+    Example
+    -------
+    >>> import numpy as np
+    >>> from CTLungSeg.segmentation import is_nearest_centroid
+    >>>
+    >>> voxels = np.random.rand(1000, 4)
+    >>> centroids = np.random.rand(5, 4)
+    >>> is_target = is_nearest_centroid(voxels, centroids, target=3)
+    '''
+    normals, offsets, strict = _half_spaces(centroids, target)
+    voxels = np.asarray(voxels, dtype=np.float32)
+
+    alive = None
+    for normal, offset, is_strict in zip(normals, offsets, strict) :
+        projection = (voxels if alive is None else voxels[alive]) @ normal
+        passed = projection < offset if is_strict else projection <= offset
+        alive = np.flatnonzero(passed) if alive is None else alive[passed]
+        if not len(alive) :
+            break
+
+    is_target = np.zeros(len(voxels), dtype=bool)
+    is_target[alive] = True
+    return is_target
+
+
+
+def imlabeling_target(image, centroids, target, weight=None, chunk_slices=None,
+                      max_memory=None, n_jobs=1) :
+    '''
+    Identify the voxels of an input stack of multichannel images whose
+    nearest centroid is the target one, without computing the full labeling.
+    This is equivalent to imlabeling(image, centroids, weight) == target, but
+    each voxel is only tested against the bisecting hyperplanes between the
+    target and the other centroids (see is_nearest_centroid), and the result
+    is a boolean array.
+
+    Parameters
+    ----------
+    image : array-like of shape (n_images, height, width, n_channels)
+        image stack to label
+
+    centroids : array-like of shape (n_centroids, n_channels)
+        Centroids vector
+
+    target : int
+        index of the target centroid
+
+    weight : array-like of shape (n_images, height, width)
+        int array, each element marked as 0 will be removed from the
+        labeling. Unlike imlabeling, it is not modified
+
+    chunk_slices : int
+        number of images processed at once. Default None, which means that
+        the slab size is estimated from max_memory
+
+    max_memory : int
+        maximum amount of memory, in bytes, used by the temporary arrays of
+        the slabs; it is split among the n_jobs threads, so each slab gets
+        max_memory / n_jobs bytes. Default None, which means that the whole
+        stack is processed at once
+
+    n_jobs : int
+        number of threads used to process the slabs concurrently; -1 means
+        all the available cores. Default 1
+
+    Returns
+    -------
+    is_target : array-like of shape (n_images, height, width)
+        boolean array, True for the voxels of the target cluster
+
+    Example
+    -------
+    >>> from CTLungSeg.utils import load_image
+    >>> from CTLungSeg.segmentation import imlabeling_target
+    >>>
+    >>> to_label = load_image('path/to/input/file')
+    >>> centroids = load_image('path/to/centroids/file')
+    >>> ggo = imlabeling_target(to_label, centroids, target=3, n_jobs=8)
+    '''
+    if centroids.shape[1] != image.shape[-1] :
+        raise Exception('Number of image channel doesn t match the number of \
+                            centroids features : {} != {}\
+                            '.format(image.shape[-1], centroids.shape[1]))
+    if weight is not None and weight.shape != image.shape[:-1] :
+        raise Exception('Weight shape doesn t match image one : {} != {}\
+                            '.format( weight.shape, image.shape[:-1]))
+
+    is_target = np.zeros(image.shape[:-1], dtype=bool)
+    n_workers = _n_workers(n_jobs)
+    n_slices = _slab_size(image, centroids, chunk_slices, max_memory, n_workers)
+    n_slices = min(n_slices, max(-(-image.shape[0] // n_workers), 1))
+
+    def label(start) :
+        stop = start + n_slices
+        slab = image[start:stop]
+        if weight is None :
+            is_target[start:stop] = is_nearest_centroid(
+                slab.reshape((-1, slab.shape[-1])), centroids, target
+            ).reshape(slab.shape[:-1])
+        else :
+            mask = weight[start:stop] != 0
+            is_target[start:stop][mask] = is_nearest_centroid(slab[mask], centroids, target)
+
+    starts = range(0, image.shape[0], n_slices)
+    if n_workers == 1 :
+        for start in starts :
+            label(start)
     else :
-        distances = np.asarray([np.linalg.norm(image - c, axis=3) for c in centroids])
-        labels = np.argmin(distances, axis=0)
-        return labels
+        with ThreadPoolExecutor(max_workers=n_workers) as pool :
+            list(pool.map(label, starts))
 
+    return is_target
 
 
 
@@ -111,8 +577,11 @@ def kmeans_on_subsamples(imgs,
 
     Parameters
     ----------
-    imgs : array-like of shape (n_subsamples, n_imgs, heigth, width, n_channels)
-        array of images tensor
+    imgs : array-like of shape (n_subsamples, n_imgs, heigth, width, n_channels) or iterable
+        array of images tensor, or iterable of subsamples, e.g. the generator
+        returned by FeatureStore.subsamples. Each subsample can also be an
+        array of shape (n_voxels, n_features) of already selected voxels,
+        used as it is, whatever the weight flag
     n_centroids : int
         number of centroids to find
     stopping_criteria :
@@ -154,19 +623,24 @@ def kmeans_on_subsamples(imgs,
     >>> sub = subsamples(mc)
     >>> ret, center = kmeans_on_subsamples(sub, n_centroids,  stop_criteria, init, True)
     '''
-    ns = imgs[0].shape[-1]
-    if weight :
-        vector = np.asarray([el[:, :, :, :- 1][el[: , :, :, - 1] != 0] for el in imgs],
-                                dtype=np.ndarray)
-    else :
-        vector = np.asarray([el.reshape((-1, ns)) for el in imgs],
-                            dtype=np.ndarray)
+    # imported here to keep the package import fast
+    import cv2
+    from tqdm import tqdm
 
     centroids = []
     ret = []
-    for el in tqdm(vector) :
+    # the subsamples are read one at a time, so a generator never holds the
+    # whole dataset in memory
+    for el in tqdm(imgs, total=len(imgs) if hasattr(imgs, '__len__') else None) :
+
+        el = np.asarray(el)
+        # 2D subsamples are voxels already selected, e.g. by a FeatureStore
+        if el.ndim > 2 and weight :
+            el = el[..., :-1][el[..., -1] != 0]
+        elif el.ndim > 2 :
+            el = el.reshape((-1, el.shape[-1]))
 
-        r, _, centr = cv2.kmeans(el.astype(np.float32),
+        r, _, centr = cv2.kmeans(el.astype(np.float32, copy=False),
                                  n_centroids,
                                  None,
                                  stopping_criteria,
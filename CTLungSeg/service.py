@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+import argparse
+import threading
+import numpy as np
+
+from time import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from CTLungSeg.utils import read_image, write_volume, load_pickle
+from CTLungSeg import labeling
+from CTLungSeg.threads import add_threads_argument, set_threads
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Local GGO segmentation service'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--host',
+                        dest='host',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='address to listen on',
+                        default='127.0.0.1')
+    parser.add_argument('--port',
+                        dest='port',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='port to listen on',
+                        default=8765)
+    parser.add_argument('--centroids',
+                        dest='centroids',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='centroids',
+                        default='')
+    parser.add_argument('--queue',
+                        dest='queue',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='maximum number of pending jobs',
+                        default=8)
+    parser.add_argument('--workers',
+                        dest='workers',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of jobs processed concurrently',
+                        default=1)
+    parser.add_argument('--n_jobs',
+                        dest='n_jobs',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of labeling threads for each job',
+                        default=1)
+    add_threads_argument(parser)
+
+    args = parser.parse_args()
+    return args
+
+
+
+class Job :
+    '''
+    Segmentation request, filled with the results once processed
+
+    Parameters
+    ----------
+    input : str
+        path to the scan to segment
+    output : str
+        path to the output label image
+    '''
+
+    def __init__(self, input, output) :
+
+        self.input = input
+        self.output = output
+        self.status = 'queued'
+        self.message = ''
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def result(self) :
+        '''
+        Return the job status and latency
+
+        Returns
+        -------
+        result : dict
+            input, output, status, error message, seconds spent in the queue,
+            seconds of processing and total latency
+        '''
+        return {'input' : self.input,
+                'output' : self.output,
+                'status' : self.status,
+                'message' : self.message,
+                'queue_seconds' : round(self.started - self.submitted, 3),
+                'processing_seconds' : round(self.finished - self.started, 3),
+                'seconds' : round(self.finished - self.submitted, 3)}
+
+
+
+class SegmentationService :
+    '''
+    Long running GGO segmentation, which keeps the lungmask model and the
+    centroids in memory and processes the submitted jobs from a bounded queue
+    with a fixed pool of worker threads.
+
+    Parameters
+    ----------
+    centroids : array-like of shape (n_centroids, n_features)
+        centroids used for the labeling
+    model : torch.nn.Module
+        lungmask model. Default None, which means that the default model is
+        loaded once when the service starts
+    max_queue : int
+        maximum number of pending jobs; further submissions are rejected
+    workers : int
+        number of jobs processed concurrently
+    n_jobs : int
+        number of labeling threads for each job
+
+    Example
+    -------
+    >>> from CTLungSeg.service import SegmentationService
+    >>>
+    >>> service = SegmentationService(centroids)
+    >>> service.start()
+    >>> job = service.submit('path/to/scan.nii', 'path/to/labels.nrrd')
+    >>> job.done.wait()
+    >>> job.result()['seconds']
+    '''
+
+    def __init__(self, centroids, model=None, max_queue=8, workers=1, n_jobs=1) :
+
+        if max_queue <= 0 :
+            raise ValueError('max_queue must be greater than zero')
+        self.centroids = np.asarray(centroids)
+        self.model = model
+        self.workers = workers
+        self.n_jobs = n_jobs
+        self.processed = 0
+        self.failed = 0
+        self.total_seconds = 0.
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def load(self) :
+        '''
+        Load the lungmask model, if not already provided
+        '''
+        if self.model is None :
+            from CTLungSeg.lung_extraction import load_model
+            self.model = load_model()
+
+    def segment(self, volume) :
+        '''
+        Run lung extraction and labeling on the volume
+
+        Parameters
+        ----------
+        volume : SimpleITK image
+            CT scan
+
+        Returns
+        -------
+        labels : SimpleITK image
+            GGO label image
+        '''
+        from CTLungSeg import lung_extraction
+        lung = lung_extraction.main(volume, model=self.model)
+        return labeling.main(lung, self.centroids, n_jobs=self.n_jobs)
+
+    def _process(self, job) :
+        '''
+        Process a single job, recording its status and timings
+        '''
+        job.started = time()
+        job.status = 'running'
+        try :
+            write_volume(self.segment(read_image(job.input)), job.output)
+            job.status = 'done'
+        except Exception as e :
+            job.status = 'failed'
+            job.message = '{}: {}'.format(type(e).__name__, ' '.join(str(e).split()))
+        job.finished = time()
+
+        with self._lock :
+            self.processed += 1
+            self.failed += job.status == 'failed'
+            self.total_seconds += job.finished - job.submitted
+        job.done.set()
+
+    def _run(self) :
+        '''
+        Worker loop, a None job stops it
+        '''
+        while True :
+            job = self._queue.get()
+            if job is None :
+                break
+            self._process(job)
+
+    def start(self) :
+        '''
+        Load the model and start the worker threads
+        '''
+        self.load()
+        for _ in range(self.workers) :
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) :
+        '''
+        Stop the worker threads, once the pending jobs are processed
+        '''
+        for _ in self._threads :
+            self._queue.put(None)
+        for thread in self._threads :
+            thread.join()
+        self._threads = []
+
+    def submit(self, input, output) :
+        '''
+        Add a segmentation job to the queue.
+        Will raise queue.Full if there are already max_queue pending jobs.
+
+        Parameters
+        ----------
+        input : str
+            path to the scan to segment
+        output : str
+            path to the output label image
+
+        Returns
+        -------
+        job : Job
+            submitted job, its done event is set once processed
+        '''
+        job = Job(input, output)
+        self._queue.put_nowait(job)
+        return job
+
+    def info(self) :
+        '''
+        Return the service statistics
+
+        Returns
+        -------
+        info : dict
+            number of pending, processed and failed jobs, mean latency
+        '''
+        with self._lock :
+            mean = self.total_seconds / self.processed if self.processed else 0.
+            return {'pending' : self._queue.qsize(),
+                    'processed' : self.processed,
+                    'failed' : self.failed,
+                    'mean_seconds' : round(mean, 3)}
+
+
+
+class _Handler(BaseHTTPRequestHandler) :
+    '''
+    HTTP interface of the service :
+
+        - POST /segment with a JSON body {"input": ..., "output": ...}
+          waits for the job and returns its result and latency
+        - GET /status returns the service statistics
+    '''
+
+    service = None
+
+    def _reply(self, code, body) :
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) :
+        if self.path != '/status' :
+            return self._reply(404, {'message' : 'not found'})
+        self._reply(200, self.service.info())
+
+    def do_POST(self) :
+        if self.path != '/segment' :
+            return self._reply(404, {'message' : 'not found'})
+        try :
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            input, output = request['input'], request['output']
+        except (ValueError, KeyError, TypeError) :
+            return self._reply(400, {'message' : 'expected a JSON body with input and output'})
+
+        try :
+            job = self.service.submit(input, output)
+        except queue.Full :
+            return self._reply(503, {'message' : 'queue is full'})
+
+        job.done.wait()
+        self._reply(200 if job.status == 'done' else 500, job.result())
+
+    def log_message(self, format, *args) :
+        pass
+
+
+
+def make_server(service, host='127.0.0.1', port=8765) :
+    '''
+    Create the HTTP server of the service
+
+    Parameters
+    ----------
+    service : SegmentationService
+        started service
+    host : str
+        address to listen on
+    port : int
+        port to listen on, 0 to pick a free one
+
+    Returns
+    -------
+    server : http.server.ThreadingHTTPServer
+        server, not yet serving
+    '''
+    handler = type('Handler', (_Handler, ), {'service' : service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__' :
+
+    args = parse_args()
+    set_threads(args.threads)
+    if args.centroids != '' :
+        center = load_pickle(filename=args.centroids)
+    else :
+        center = np.asarray([np.array(v) for _, v in labeling.centroids.items()])
+
+    start = time()
+    service = SegmentationService(center, max_queue=args.queue,
+                                  workers=args.workers, n_jobs=args.n_jobs)
+    service.start()
+    server = make_server(service, args.host, args.port)
+    print('Service ready after {0:.3f} seconds, listening on {1}:{2}'.format(
+            time() - start, args.host, server.server_address[1]), flush=True)
+    try :
+        server.serve_forever()
+    except KeyboardInterrupt :
+        pass
+    finally :
+        server.server_close()
+        service.stop()
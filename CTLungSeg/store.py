@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import tempfile
+import numpy as np
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['FeatureStore']
+
+
+# index with the number of features and the offsets of each scan
+INDEX = 'index.json'
+# float32 buffer of the voxel features, one row for each voxel
+FEATURES = 'features.f32'
+
+
+class FeatureStore :
+    '''
+    On-disk store of the features of the training voxels. The features of
+    the masked voxels of each scan are appended as float32 rows to a single
+    memory-mappable file, and an index records the first row of each scan,
+    so the training set is never held in memory as a whole. An existing
+    store is opened, and can be extended, by creating it on the same path.
+
+    Parameters
+    ----------
+    path : str
+        path to the store directory
+
+    Example
+    -------
+    >>> from CTLungSeg.store import FeatureStore
+    >>> from CTLungSeg.utils import read_image
+    >>>
+    >>> store = FeatureStore('path/to/store')
+    >>> for f in files :
+    >>>     image = read_image(f)
+    >>>     store.append(extractor(image), mask=sitk.GetArrayFromImage(image) != 0, name=f)
+    >>> # random disjoint subsamples of voxels, read one at a time
+    >>> for voxels in store.subsamples(100) :
+    >>>     print(voxels.shape)
+    '''
+
+    def __init__(self, path) :
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        index = os.path.join(path, INDEX)
+        if os.path.isfile(index) :
+            with open(index) as fp :
+                info = json.load(fp)
+            self.n_features = info['n_features']
+            self.offsets = info['offsets']
+            self.names = info['names']
+        else :
+            self.n_features = None
+            self.offsets = [0]
+            self.names = []
+
+    def __len__(self) :
+        return self.offsets[-1]
+
+    @property
+    def n_scans(self) :
+        '''
+        Number of scans in the store
+        '''
+        return len(self.names)
+
+    def _write_index(self) :
+        '''
+        Write the index, after the features of the last scan
+        '''
+        with open(os.path.join(self.path, INDEX), 'w') as fp :
+            json.dump({'n_features' : self.n_features,
+                       'offsets' : self.offsets,
+                       'names' : self.names}, fp)
+
+    def append(self, features, mask=None, name=None, slab_size=16) :
+        '''
+        Append the features of the masked voxels of a scan
+
+        Parameters
+        ----------
+        features : array-like of shape (n_slices, height, width, n_features)
+            feature stack of the scan
+        mask : array-like of shape (n_slices, height, width)
+            only the voxels where mask is not zero are stored. Default None,
+            which means all the voxels
+        name : str
+            name of the scan. Default None, which means its index
+        slab_size : int
+            number of slices copied at once
+
+        Returns
+        -------
+        n_voxels : int
+            number of stored voxels of the scan
+        '''
+        n_features = features.shape[-1]
+        if self.n_features is None :
+            self.n_features = int(n_features)
+        if n_features != self.n_features :
+            raise ValueError('The store has {} features, got {}'.format(self.n_features, n_features))
+        if mask is not None and np.shape(mask) != features.shape[:-1] :
+            raise ValueError('mask and features must have the same shape: '
+                             '{} != {}'.format(np.shape(mask), features.shape[:-1]))
+
+        n_voxels = 0
+        # the file is truncated to the last indexed row, so the rows of an
+        # interrupted append are discarded
+        with open(os.path.join(self.path, FEATURES), 'ab') as fp :
+            fp.truncate(len(self) * self.n_features * 4)
+            for start in range(0, features.shape[0], slab_size) :
+                slab = features[start : start + slab_size]
+                if mask is not None :
+                    slab = slab[np.asarray(mask[start : start + slab_size]) != 0]
+                rows = np.ascontiguousarray(slab.reshape(-1, self.n_features), dtype=np.float32)
+                rows.tofile(fp)
+                n_voxels += len(rows)
+
+        self.offsets.append(len(self) + n_voxels)
+        self.names.append(str(self.n_scans) if name is None else name)
+        self._write_index()
+        return n_voxels
+
+    def memmap(self) :
+        '''
+        Read-only memory map of all the stored voxels
+
+        Returns
+        -------
+        voxels : numpy.memmap of shape (n_voxels, n_features)
+            features of the stored voxels
+        '''
+        if not len(self) :
+            return np.empty((0, self.n_features or 0), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, FEATURES), dtype=np.float32,
+                         mode='r', shape=(len(self), self.n_features))
+
+    def scan(self, i) :
+        '''
+        Features of the voxels of the i-th scan
+
+        Parameters
+        ----------
+        i : int
+            index of the scan
+
+        Returns
+        -------
+        voxels : numpy.memmap of shape (n_voxels, n_features)
+            features of the scan voxels
+        '''
+        return self.memmap()[self.offsets[i] : self.offsets[i + 1]]
+
+    def subsamples(self, n_subsamples, seed=42, block=2**20) :
+        '''
+        Split the stored voxels into random disjoint subsamples of about the
+        same size and read them one at a time. The store is read only once:
+        the rows of each block are assigned to a random subsample and
+        appended to a temporary file of that subsample, so only a block, and
+        later a subsample, are in memory at once.
+
+        Parameters
+        ----------
+        n_subsamples : int
+            number of subsamples
+        seed : int
+            seed of the random split
+        block : int
+            number of rows read at once
+
+        Returns
+        -------
+        subsamples : generator of array-like of shape (n_voxels, n_features)
+            float32 features of the voxels of each subsample
+        '''
+        if n_subsamples <= 0 :
+            raise ValueError('n_subsamples must be greater or equal than one')
+        voxels = self.memmap()
+        rng = np.random.default_rng(seed)
+
+        with tempfile.TemporaryDirectory(dir=self.path) as tmp :
+            filenames = [os.path.join(tmp, 'subsample_{:05d}.f32'.format(k))
+                         for k in range(n_subsamples)]
+            for f in filenames :
+                open(f, 'wb').close()
+
+            for start in range(0, len(voxels), block) :
+                rows = np.asarray(voxels[start : start + block])
+                labels = rng.integers(0, n_subsamples, len(rows))
+                # rows sorted by subsample, keeping their order in the store
+                order = np.argsort(labels, kind='stable')
+                bounds = np.cumsum(np.bincount(labels, minlength=n_subsamples))[:-1]
+                for f, rows_k in zip(filenames, np.split(rows[order], bounds)) :
+                    if len(rows_k) :
+                        with open(f, 'ab') as fp :
+                            rows_k.tofile(fp)
+
+            for f in filenames :
+                subsample = np.fromfile(f, dtype=np.float32).reshape(-1, voxels.shape[1])
+                os.remove(f)
+                yield subsample
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+__author__  = ['Riccardo Biondi', 'Nico Curti']
+__email__   = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+__all__ = ['THREADS_VARIABLE', 'add_threads_argument', 'get_threads',
+           'export_threads', 'set_threads', 'set_torch_threads']
+
+
+# environment variable with the thread budget of each process
+THREADS_VARIABLE = 'CTLUNGSEG_THREADS'
+# environment variables read by the BLAS, OpenMP and OpenCV thread pools
+# when they are initialized
+POOL_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                  'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                  'OPENCV_FOR_THREADS_NUM']
+
+
+def add_threads_argument(parser) :
+    '''
+    Add the --threads option to a command line parser
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        command line parser
+    '''
+    parser.add_argument('--threads',
+                        dest='threads',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='maximum number of threads of each library thread pool. '
+                             'Default the {} environment variable, if set, '
+                             'otherwise all the cores'.format(THREADS_VARIABLE),
+                        default=None)
+
+
+def get_threads(threads=None) :
+    '''
+    Return the thread budget of the process
+
+    Parameters
+    ----------
+    threads : int
+        requested number of threads. Default None, which means the value of
+        the CTLUNGSEG_THREADS environment variable
+
+    Returns
+    -------
+    threads : int
+        number of threads, None if no budget is set
+    '''
+    if threads is None :
+        threads = os.environ.get(THREADS_VARIABLE, '') or None
+    if threads is None :
+        return None
+    threads = int(threads)
+    if threads <= 0 :
+        raise ValueError('The number of threads must be greater or equal than one')
+    return threads
+
+
+def export_threads(threads=None, overwrite=True) :
+    '''
+    Export the thread budget to the environment variables read by the thread
+    pools when they are initialized, so that it applies to the libraries
+    imported later and to the child processes. The package exports it at
+    import time, if CTLUNGSEG_THREADS is set, keeping the pool variables
+    already set by the user.
+
+    Parameters
+    ----------
+    threads : int
+        number of threads. Default None, which means the value of the
+        CTLUNGSEG_THREADS environment variable
+    overwrite : bool
+        if False, only the variables which are not set are exported
+
+    Returns
+    -------
+    threads : int
+        number of threads, None if no budget is set
+    '''
+    threads = get_threads(threads)
+    if threads is None :
+        return None
+
+    for variable in [THREADS_VARIABLE] + POOL_VARIABLES :
+        if overwrite :
+            os.environ[variable] = str(threads)
+        else :
+            os.environ.setdefault(variable, str(threads))
+    return threads
+
+
+def set_torch_threads(threads=None) :
+    '''
+    Limit the torch intra-op and inter-op thread pools to the thread budget.
+    The inter-op pool can only be set before its first use, later calls
+    leave it unchanged.
+
+    Parameters
+    ----------
+    threads : int
+        number of threads. Default None, which means the value of the
+        CTLUNGSEG_THREADS environment variable
+
+    Returns
+    -------
+    threads : int
+        number of threads, None if no budget is set
+    '''
+    threads = get_threads(threads)
+    if threads is None :
+        return None
+
+    import torch
+    torch.set_num_threads(threads)
+    try :
+        torch.set_num_interop_threads(threads)
+    except RuntimeError :
+        pass
+    return threads
+
+
+def set_threads(threads=None) :
+    '''
+    Limit the thread pools of SimpleITK, BLAS, OpenCV and torch to the thread
+    budget. The budget is exported to the environment, so it is inherited by
+    the child processes and by the libraries imported later; the libraries
+    already imported are limited directly (BLAS only if threadpoolctl is
+    installed).
+
+    Parameters
+    ----------
+    threads : int
+        number of threads. Default None, which means the value of the
+        CTLUNGSEG_THREADS environment variable
+
+    Returns
+    -------
+    threads : int
+        number of threads, None if no budget is set and nothing is changed
+
+    Example
+    -------
+    >>> from CTLungSeg.threads import set_threads
+    >>> # run all the filters with 4 threads
+    >>> set_threads(4)
+    '''
+    threads = export_threads(threads)
+    if threads is None :
+        return None
+
+    # imported here, since the package exports the budget before numpy and
+    # SimpleITK are loaded
+    import SimpleITK as sitk
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+
+    try :
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError :
+        pass
+
+    if 'cv2' in sys.modules :
+        sys.modules['cv2'].setNumThreads(threads)
+    if 'torch' in sys.modules :
+        set_torch_threads(threads)
+
+    return threads
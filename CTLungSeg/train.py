@@ -2,21 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import os
-import gc
-import cv2
+import shutil
 import argparse
+import tempfile
 import numpy as np
-import SimpleITK as sitk
 
 from glob import glob
 from time import time
-from tqdm import tqdm
 
 from CTLungSeg.utils import read_image, save_pickle
-from CTLungSeg.utils import shuffle_and_split, normalize
-from CTLungSeg.method import std_filter, adaptive_histogram_equalization
-from CTLungSeg.method import median_filter, adjust_gamma, threshold
+from CTLungSeg.store import FeatureStore
+from CTLungSeg.bridge import array_view
+from CTLungSeg.method import threshold
+from CTLungSeg.features import FeatureExtractor
 from CTLungSeg.segmentation import kmeans_on_subsamples
+from CTLungSeg.threads import add_threads_argument, set_threads
 
 
 __author__ = ['Riccardo Biondi', 'Nico Curti']
@@ -53,6 +53,15 @@ def parse_args():
                         action='store',
                         help='centroid initialization technique',
                         default=0)
+    parser.add_argument('--store',
+                        dest='store',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='directory of the feature store, kept after the training; '
+                             'the scans already in the store are not processed again',
+                        default=None)
+    add_threads_argument(parser)
 
     args = parser.parse_args()
     return args
@@ -60,6 +69,12 @@ def parse_args():
 
 def main():
 
+    args = parse_args()
+    # imported after the argument parsing to keep --help fast
+    import cv2
+    from tqdm import tqdm
+    set_threads(args.threads)
+
     # kmeans clustering aguments :
     # - initalization technique -> choose between random or kmeans++
     # - stop_criteria : criteria used to stop the kmeans algorithm
@@ -67,67 +82,45 @@ def main():
     centroid_init = [cv2.KMEANS_RANDOM_CENTERS, cv2.KMEANS_PP_CENTERS]
     stop_criteria = (cv2.TERM_CRITERIA_EPS
                     + cv2.TERM_CRITERIA_MAX_ITER, 10, .001)
-    args = parse_args()
 
     print("I'm Loading...", flush=True)
 
     files = glob(os.path.join(args.folder, '*.nrrd'))
 
-    stks = []
-    for f in tqdm(files) :
-        img = read_image(f)
-        # create the mask to remove the background
-        mask = threshold(img, 4000, 1)
-        # filter all the images, normalize and convert to numpy array
-
-        he = normalize(adaptive_histogram_equalization(img, 2))
-        med = normalize(median_filter(img, 3))
-        std = normalize(std_filter(img, 3))
-        gamma = normalize(adjust_gamma(img, 1.5))
-
-        he = sitk.GetArrayFromImage(he)
-        med = sitk.GetArrayFromImage(med)
-        std = sitk.GetArrayFromImage(std)
-        gamma = sitk.GetArrayFromImage(gamma)
-        mask = sitk.GetArrayFromImage(mask)
-
-        stk = np.stack([he, med, gamma, std, mask], axis=-1)
-
-        del he
-        del med
-        del gamma
-        del std
-        del mask
-        gc.collect()
-
-        stks.append(stk)
-
-        del stk
-        gc.collect()
-
-
-    imgs = np.concatenate(stks, axis=0)
-    n_imgs = imgs.shape[0]
-
-
-    print('Loaded {:d} files from {}\n'.format(len(files),args.folder),
-            flush=True)
-
-    imgs = shuffle_and_split(imgs, args.n)
-    #Recap for better parameters control
-    print('*****Starting clustering*****',flush=True)
-    print('\tNumber of subsamples--> {:d}'.format(args.n) , flush=True)
-    print('\tTotal images --> {:d}'.format(n_imgs), flush=True)
-    print('\tCentroid initialization technique--> {}'.format(init[args.init]),
-            flush=True)
-
-    #First clustering
-    print("\nI'm clustering...", flush = True)
-    ret, centr = kmeans_on_subsamples(imgs,
-                                  5,
-                                  stop_criteria,
-                                  centroid_init[args.init],
-                                  True)
+    extractor = FeatureExtractor(ahe_radius=2, median_radius=3, std_radius=3,
+                                 gamma=1.5)
+    # the features of the lung voxels are written to disk one scan at a
+    # time, so only a scan and a subsample are in memory at once
+    path = tempfile.mkdtemp() if args.store is None else args.store
+    try :
+        store = FeatureStore(path)
+        for f in tqdm(files) :
+            if f in store.names :
+                continue
+            img = read_image(f)
+            mask = threshold(img, 4000, 1)
+            store.append(extractor(img), mask=array_view(mask), name=f)
+
+        print('Loaded {:d} files from {}\n'.format(len(files),args.folder),
+                flush=True)
+
+        #Recap for better parameters control
+        print('*****Starting clustering*****',flush=True)
+        print('\tNumber of subsamples--> {:d}'.format(args.n) , flush=True)
+        print('\tTotal voxels --> {:d}'.format(len(store)), flush=True)
+        print('\tCentroid initialization technique--> {}'.format(init[args.init]),
+                flush=True)
+
+        #First clustering
+        print("\nI'm clustering...", flush = True)
+        ret, centr = kmeans_on_subsamples(store.subsamples(args.n),
+                                      5,
+                                      stop_criteria,
+                                      centroid_init[args.init])
+    finally :
+        # the temporary store is removed even if the training fails
+        if args.store is None :
+            shutil.rmtree(path)
 
     center = centr[np.argmin(ret)]
     center = center[center[:, 0].argsort()]
@@ -6,6 +6,9 @@ import pickle
 import SimpleITK as sitk
 import numpy as np
 
+from CTLungSeg.bridge import array_view, to_image, copy_image
+from CTLungSeg.chunked import is_chunked, read_chunked, write_chunked
+
 
 __author__ = ['Riccardo Biondi', 'Nico Curti']
 __email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
@@ -90,7 +93,8 @@ def read_image(filename):
     Parameters
     ----------
     filename: str
-        Path to the image file, each format supported by SimpleITK is allowed.
+        Path to the image file, each format supported by SimpleITK is allowed,
+        and the chunked volumes (.cvol directories, see CTLungSeg.chunked).
         To load a DICOM series, provide the path to the directory containing
         only the .dcm files for the single series
 
@@ -112,6 +116,8 @@ def read_image(filename):
 
     '''
     if os.path.exists(filename) :
+        if is_chunked(filename) :
+            return read_chunked(filename)
         if os.path.isfile(filename) :
             reader = _read_image(filename)
         else :
@@ -127,7 +133,10 @@ def read_image(filename):
 def write_volume(image, output_filename):
     '''
     Write the image volume in a specified format. Each format supported by
-    SimpleITK is supported.
+    SimpleITK is supported. With the .cvol extension the image is written as
+    a chunked volume of uncompressed chunks of 16 slices, see
+    CTLungSeg.chunked, whose slabs can be read without decoding the whole
+    volume.
     .. note: It does not write as .dcm series.
 
     Parameters
@@ -152,6 +161,9 @@ def write_volume(image, output_filename):
     >>>  output_name = 'path/to/output/filename.nii'
     >>> write_volume(image, output_name)
     '''
+    if is_chunked(output_filename) :
+        write_chunked(image, output_filename)
+        return
     writer = sitk.ImageFileWriter()
     writer.SetFileName(output_filename)
     writer.Execute(image)
@@ -172,30 +184,125 @@ def save_pickle(filename, data):
         pickle.dump(data, fp)
 
 
-def normalize(image) :
+def _merge_statistics(first, second) :
+    '''
+    Merge the (count, mean, sum of squared deviations) statistics of two
+    disjoint groups of values, with the formula of Chan et al.
+    '''
+    n_a, mean_a, m2_a = first
+    n_b, mean_b, m2_b = second
+    n = n_a + n_b
+    if n == 0 :
+        return 0, 0., 0.
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta * delta * n_a * n_b / n
+    return n, mean, m2
+
+
+def image_statistics(image, mask=None, n_voxels=None, slab_size=16) :
+    '''
+    Compute mean and standard deviation of the image GL in a single pass.
+    The statistics of each slab of slices are computed in float64 and merged
+    into a running accumulator of count, mean and sum of squared deviations,
+    which is numerically stable also for large images.
+
+    Parameters
+    ----------
+    image : SimpleITK image object
+        input image
+    mask : SimpleITK image object or array-like
+        if provided, only the voxels where mask is not zero are used
+    n_voxels : int
+        if image is a crop of a larger zero-valued image, number of voxels of
+        the whole image; the voxels outside the crop are counted as zeros.
+        Default None, which means the number of voxels of image
+    slab_size : int
+        number of slices of each slab
+
+    Returns
+    -------
+    mean : float
+        mean of the image GL
+    sigma : float
+        standard deviation of the image GL, with N - 1 degrees of freedom
+        as in sitk.StatisticsImageFilter
+    '''
+    array = array_view(image)
+    if mask is not None :
+        mask = array_view(mask) if isinstance(mask, sitk.Image) else np.asarray(mask)
+        if mask.shape != array.shape :
+            raise ValueError('Mask shape doesn t match image one : {} != {}'.format(
+                                mask.shape, array.shape))
+
+    accumulator = (0, 0., 0.)
+    for start in range(0, max(array.shape[0], 1), slab_size) :
+        slab = array[start:start + slab_size]
+        if mask is not None :
+            slab = slab[mask[start:start + slab_size] != 0]
+        if not slab.size :
+            continue
+        slab = slab.astype(np.float64)
+        mean = slab.mean()
+        slab -= mean
+        accumulator = _merge_statistics(accumulator, (slab.size, mean, np.dot(slab.ravel(), slab.ravel())))
+
+    if n_voxels is not None :
+        accumulator = _merge_statistics(accumulator, (n_voxels - accumulator[0], 0., 0.))
+
+    n, mean, m2 = accumulator
+    sigma = np.sqrt(m2 / (n - 1)) if n > 1 else 0.
+    return mean, sigma
+
+
+def normalize(image, mask=None, out=None, statistics=None) :
     '''
-    Rescale each GL according to the mean and std of the whole image
+    Rescale each GL according to the mean and std of the whole image.
+    The statistics are computed once (see image_statistics) and the image is
+    rescaled in a single float32 copy, optionally written into a buffer
+    provided by the caller.
     Will raise ZeroDivisionError if the provided image has constant pixel GL.
 
     Parameters
     ----------
     image : SimpleITK image object
         image to normalize
+    mask : SimpleITK image object or array-like
+        if provided, the statistics are computed only on the voxels where
+        mask is not zero. All the voxels are rescaled
+    out : array-like
+        float32 array with the shape of the image array, if provided the
+        normalized image is written into it
+    statistics : tuple
+        mean and standard deviation used instead of the image ones
 
     Returns
     -------
     normalized : SimpleITK image
-        normalized image
+        float32 normalized image, or out if provided
     '''
-    # check if the image is not constant
-    stats = sitk.StatisticsImageFilter()
-    stats.Execute(image)
+    array = array_view(image)
+    if out is None :
+        buffer = np.empty(array.shape, dtype=np.float32)
+    else :
+        if out.shape != array.shape or out.dtype != np.float32 :
+            raise ValueError('out must be a float32 array of shape {}, given {} {}'.format(
+                                array.shape, out.dtype, out.shape))
+        buffer = out
 
-    if np.isclose(stats.GetSigma(), 0) :
+    mean, sigma = image_statistics(image, mask) if statistics is None else statistics
+    # check if the image is not constant
+    if np.isclose(sigma, 0) :
         raise ZeroDivisionError('Cannot normalize image with Sigma == 0')
-    norm = sitk.NormalizeImageFilter()
 
-    return norm.Execute(image)
+    np.copyto(buffer, array, casting='unsafe')
+    buffer -= mean
+    buffer /= sigma
+
+    if out is not None :
+        return out
+    normalized = to_image(buffer, reference=image)
+    return normalized
 
 
 def shift_and_crop(image) :
@@ -256,8 +363,136 @@ def deep_copy(image) :
     copy : SimpleITK image
         copy of the input image
     '''
-    copy = sitk.GetArrayFromImage(image).copy()
-    copy = sitk.GetImageFromArray(copy)
-    copy.CopyInformation(image)
+    return copy_image(image)
 
-    return copy
+
+
+def foreground_bounding_box(image, halo=0) :
+    '''
+    Compute the bounding box of the non-zero voxels of the image, enlarged by
+    halo voxels on each side and clipped to the image extent.
+    If the image has no non-zero voxels, the whole image extent is returned.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        input image
+    halo : int or list of int
+        number of voxels added on each side of the bounding box, for all the
+        axes or for each axis in (x, y, z) order
+
+    Returns
+    -------
+    index : list of int
+        index of the first voxel of the bounding box, in (x, y, z) order
+    size : list of int
+        size of the bounding box, in (x, y, z) order
+
+    Example
+    -------
+    >>> import SimpleITK as sitk
+    >>> from CTLungSeg.utils import read_image, foreground_bounding_box
+    >>>
+    >>> image = read_image('path/to/lung/image.nrrd')
+    >>> index, size = foreground_bounding_box(image, halo=5)
+    >>> cropped = sitk.RegionOfInterest(image, size, index)
+    '''
+    dim = image.GetDimension()
+    shape = sitk.LabelShapeStatisticsImageFilter()
+    shape.ComputePerimeterOff()
+    shape.ComputeFeretDiameterOff()
+    shape.Execute(sitk.Cast(image != 0, sitk.sitkUInt8))
+
+    if not shape.HasLabel(1) :
+        return [0] * dim, list(image.GetSize())
+
+    if np.isscalar(halo) :
+        halo = [halo] * dim
+    bbox = shape.GetBoundingBox(1)
+    lower = [max(b - h, 0) for b, h in zip(bbox[:dim], halo)]
+    upper = [min(b + s + h, n) for b, s, h, n in zip(bbox[:dim], bbox[dim:], halo,
+                                                       image.GetSize())]
+    return lower, [u - l for u, l in zip(upper, lower)]
+
+
+
+def paste_into_empty(image, reference, index) :
+    '''
+    Paste the image into a zero-valued image with the same geometry of the
+    reference one, starting at the specified index.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        image to paste, e.g. a crop of reference obtained with
+        SimpleITK.RegionOfInterest
+    reference : SimpleITK image
+        image which provides size, origin, spacing and direction
+    index : list of int
+        index of reference where the first voxel of image is placed
+
+    Returns
+    -------
+    pasted : SimpleITK image
+        image with the same pixel type of image and the geometry of reference
+    '''
+    empty = sitk.Image(reference.GetSize(), image.GetPixelID())
+    empty.CopyInformation(reference)
+    return sitk.Paste(empty, image, image.GetSize(), [0] * image.GetDimension(),
+                      [int(i) for i in index])
+
+
+
+def process_in_slabs(image, func, slab_size, halo=0) :
+    '''
+    Apply a filter to overlapping slabs of consecutive slices and stitch the
+    results. Each slab is enlarged by halo slices on both sides, so that
+    filters with a finite support of at most halo slices give the same
+    result as on the whole image, while the filter temporaries scale with
+    the slab size. The input image and one output image are held as a
+    whole : the core of each slab is pasted in place into the output.
+
+    Parameters
+    ----------
+    image : SimpleITK image
+        3D image to process
+    func : callable
+        filter which takes a SimpleITK image and returns a SimpleITK image
+        with the same size
+    slab_size : int
+        number of slices for each slab, halo excluded
+    halo : int
+        number of slices added on each side of the slab
+
+    Returns
+    -------
+    out : SimpleITK image
+        stitched filter output, with the same geometry of image
+
+    Example
+    -------
+    >>> from CTLungSeg.utils import read_image, process_in_slabs
+    >>> from CTLungSeg.method import median_filter
+    >>>
+    >>> image = read_image('path/to/image.nrrd')
+    >>> filtered = process_in_slabs(image, lambda x : median_filter(x, 3),
+    >>>                             slab_size=32, halo=3)
+    '''
+    if slab_size <= 0 :
+        raise ValueError('slab_size must be greater or equal than one')
+    depth = image.GetSize()[2]
+    out = None
+    for core_start in range(0, depth, slab_size) :
+        core_stop = min(core_start + slab_size, depth)
+        start = max(core_start - halo, 0)
+        stop = min(core_stop + halo, depth)
+
+        result = func(image[:, :, start:stop])
+        if out is None :
+            out = sitk.Image(image.GetSize(), result.GetPixelID(),
+                             result.GetNumberOfComponentsPerPixel())
+            out.CopyInformation(image)
+        # slice assignment pastes the core in place, without copying out
+        out[:, :, core_start:core_stop] = result[:, :, core_start - start : core_stop - start]
+
+    return out
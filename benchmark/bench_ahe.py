@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from time import perf_counter
+
+from CTLungSeg import labeling
+from CTLungSeg.batch import list_scans
+from CTLungSeg.features import FeatureExtractor
+from CTLungSeg.metrics import dice
+from CTLungSeg.method import adaptive_histogram_equalization
+from CTLungSeg.utils import read_image, load_pickle
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Speed-up and GGO Dice score of the tiled adaptive histogram equalization'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--input',
+                        dest='input',
+                        required=True,
+                        type=str,
+                        action='store',
+                        help='directory of lung images (lung extraction output)')
+    parser.add_argument('--centroids',
+                        dest='centroids',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='centroids',
+                        default='')
+    parser.add_argument('--radii',
+                        dest='radii',
+                        required=False,
+                        type=int,
+                        nargs='+',
+                        action='store',
+                        help='equalization radii timed on each scan',
+                        default=[2, 5])
+    parser.add_argument('--output',
+                        dest='output',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='output .csv file',
+                        default='ahe.csv')
+
+    args = parser.parse_args()
+    return args
+
+
+def timeit(func) :
+    '''
+    Return the wall time of func and its output
+    '''
+    start = perf_counter()
+    out = func()
+    return perf_counter() - start, out
+
+
+def main():
+
+    args = parse_args()
+    if args.centroids != '' :
+        center = load_pickle(filename=args.centroids)
+    else :
+        center = np.asarray([np.array(v) for _, v in labeling.centroids.items()])
+
+    rows = []
+    for scan in list_scans(args.input) :
+        volume = read_image(scan)
+        row = {'scan' : scan}
+
+        # filter only
+        for radius in args.radii :
+            t_exact, _ = timeit(lambda : adaptive_histogram_equalization(volume, radius))
+            t_tiled, _ = timeit(lambda : adaptive_histogram_equalization(volume, radius,
+                                                                         mode='tiled'))
+            row['exact_r{}'.format(radius)] = t_exact
+            row['tiled_r{}'.format(radius)] = t_tiled
+
+        # downstream GGO labeling
+        results = {}
+        for mode in ['exact', 'tiled'] :
+            extractor = FeatureExtractor(ahe_radius=5, median_radius=3, std_radius=3,
+                                         gamma=1.5, ahe_mode=mode)
+            elapsed, labels = timeit(lambda : labeling.main(volume, center, extractor=extractor))
+            row['labeling_{}'.format(mode)] = elapsed
+            results[mode] = sitk.GetArrayFromImage(labels)
+        row['speedup'] = row['labeling_exact'] / row['labeling_tiled']
+        row['dice'] = dice(results['exact'], results['tiled'])
+        rows.append(row)
+
+        print('{scan}: labeling {labeling_exact:.2f} s -> {labeling_tiled:.2f} s '
+              '(speed-up {speedup:.2f}), GGO Dice {dice:.4f}'.format(**row), flush=True)
+
+    with open(args.output, 'w', newline='') as fp :
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print('mean speed-up {:.2f}, mean GGO Dice {:.4f}'.format(
+            np.mean([r['speedup'] for r in rows]), np.mean([r['dice'] for r in rows])))
+
+
+if __name__ == '__main__' :
+    main()
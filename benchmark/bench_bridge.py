@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+import resource
+import subprocess
+import numpy as np
+
+from time import perf_counter
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Peak RSS and wall time of the labeling and evaluation of a scan'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--slices',
+                        dest='slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of 512x512 slices of the synthetic lung volume',
+                        default=100)
+    parser.add_argument('--centroids',
+                        dest='centroids',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='centroids',
+                        default='centroids.pkl.npy')
+    parser.add_argument('--repeat',
+                        dest='repeat',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of scans, each one in a new process',
+                        default=3)
+    parser.add_argument('--scan',
+                        dest='scan',
+                        action='store_true',
+                        help=argparse.SUPPRESS,
+                        default=False)
+
+    args = parser.parse_args()
+    return args
+
+
+def peak_rss() :
+    '''
+    Peak resident set size of the process, in MB
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def scan(slices, centroids) :
+    '''
+    Label and evaluate a synthetic lung volume, printing the wall time and
+    the peak RSS above the one after the volume creation as json
+    '''
+    import SimpleITK as sitk
+    from CTLungSeg import labeling
+    from CTLungSeg.utils import load_pickle
+    from CTLungSeg.metrics import dice
+    from CTLungSeg.features import FeatureExtractor
+
+    rng = np.random.default_rng(42)
+    shape = (slices, 512, 512)
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    lung = ((z - shape[0] / 2) / (shape[0] * .45))**2 + \
+           ((y - shape[1] / 2) / (shape[1] * .35))**2 + \
+           ((x - shape[2] / 2) / (shape[2] * .4))**2 < 1
+    array = rng.integers(100, 1200, shape, dtype=np.int16) * lung
+    volume = sitk.GetImageFromArray(array.astype(np.int16))
+    volume.SetSpacing((.7, .7, 1.25))
+    centroids = load_pickle(centroids)
+    del array, lung, z, y, x
+    baseline = peak_rss()
+
+    start = perf_counter()
+    # the tiled equalization, so that the time is not dominated by the filters
+    extractor = FeatureExtractor(5, 3, 3, 1.5, ahe_mode='tiled')
+    labels = labeling.main(volume, centroids, extractor=extractor)
+    labels_array = sitk.GetArrayViewFromImage(labels)
+    score = dice(labels_array, labels_array)
+    elapsed = perf_counter() - start
+
+    print(json.dumps({'time' : elapsed, 'rss' : peak_rss() - baseline, 'dice' : score}))
+
+
+def main():
+
+    args = parse_args()
+    if args.scan :
+        scan(args.slices, args.centroids)
+        return
+
+    results = []
+    for _ in range(args.repeat) :
+        out = subprocess.run([sys.executable, '-m', 'benchmark.bench_bridge', '--scan',
+                              '--slices={}'.format(args.slices),
+                              '--centroids={}'.format(args.centroids)],
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print('Volume ({}, 512, 512) int16'.format(args.slices))
+    print('wall time per scan : {:.3f} s (best of {})'.format(min(r['time'] for r in results), args.repeat))
+    print('peak RSS above the input volume : {:.1f} MB (max of {})'.format(max(r['rss'] for r in results), args.repeat))
+
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from time import perf_counter
+
+from CTLungSeg import labeling
+from CTLungSeg.batch import list_scans
+from CTLungSeg.metrics import dice
+from CTLungSeg.utils import read_image, load_pickle
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Speed-up and Dice score of the coarse-to-fine labeling'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--input',
+                        dest='input',
+                        required=True,
+                        type=str,
+                        action='store',
+                        help='directory of lung images (lung extraction output)')
+    parser.add_argument('--gt',
+                        dest='gt',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='optional directory of ground truth masks, with the same names',
+                        default=None)
+    parser.add_argument('--centroids',
+                        dest='centroids',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='centroids',
+                        default='')
+    parser.add_argument('--factors',
+                        dest='factors',
+                        required=False,
+                        type=int,
+                        nargs='+',
+                        action='store',
+                        help='in-plane downsampling factors to evaluate',
+                        default=[2, 3, 4])
+    parser.add_argument('--output',
+                        dest='output',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='output .csv file',
+                        default='coarse_to_fine.csv')
+
+    args = parser.parse_args()
+    return args
+
+
+def ground_truth(gt_dir, scan) :
+    '''
+    Return the ground truth array of the scan, or None if not available
+    '''
+    if gt_dir is None :
+        return None
+    name = os.path.basename(os.path.normpath(scan)).split('.')[0]
+    for f in os.listdir(gt_dir) :
+        if f.split('.')[0] == name :
+            return sitk.GetArrayFromImage(read_image(os.path.join(gt_dir, f)))
+    return None
+
+
+def main():
+
+    args = parse_args()
+    if args.centroids != '' :
+        center = load_pickle(filename=args.centroids)
+    else :
+        center = np.asarray([np.array(v) for _, v in labeling.centroids.items()])
+
+    rows = []
+    for scan in list_scans(args.input) :
+        volume = read_image(scan)
+        gt = ground_truth(args.gt, scan)
+
+        start = perf_counter()
+        full = sitk.GetArrayFromImage(labeling.main(volume, center))
+        reference = perf_counter() - start
+        rows.append({'scan' : scan, 'factor' : 1, 'seconds' : reference, 'speedup' : 1.,
+                     'dice_vs_full' : 1.,
+                     'dice_vs_gt' : '' if gt is None else dice(gt, full)})
+
+        for factor in args.factors :
+            start = perf_counter()
+            coarse = sitk.GetArrayFromImage(labeling.main(volume, center,
+                                                          coarse_factor=factor))
+            elapsed = perf_counter() - start
+            rows.append({'scan' : scan, 'factor' : factor, 'seconds' : elapsed,
+                         'speedup' : reference / elapsed,
+                         'dice_vs_full' : dice(full, coarse),
+                         'dice_vs_gt' : '' if gt is None else dice(gt, coarse)})
+
+        for row in rows[-len(args.factors) - 1:] :
+            print('{scan} factor {factor}: {seconds:.2f} s, speed-up {speedup:.2f}, '
+                  'Dice vs full resolution {dice_vs_full:.4f}'.format(**row), flush=True)
+
+    with open(args.output, 'w', newline='') as fp :
+        writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # summary over the evaluation set for each factor
+    for factor in [1] + args.factors :
+        selected = [r for r in rows if r['factor'] == factor]
+        print('factor {}: mean speed-up {:.2f}, mean Dice vs full resolution {:.4f}'.format(
+                factor, np.mean([r['speedup'] for r in selected]),
+                np.mean([r['dice_vs_full'] for r in selected])))
+
+
+if __name__ == '__main__' :
+    main()
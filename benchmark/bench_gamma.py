@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from time import perf_counter
+
+from CTLungSeg.method import adjust_gamma, _gamma_pow
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Benchmark of the look-up table gamma correction against the voxel-wise one'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--slices',
+                        dest='slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of 512x512 slices of the synthetic volume',
+                        default=300)
+    parser.add_argument('--gamma',
+                        dest='gamma',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='power of the correction',
+                        default=1.5)
+    parser.add_argument('--repeat',
+                        dest='repeat',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of repetitions, the best time is reported',
+                        default=3)
+
+    args = parser.parse_args()
+    return args
+
+
+def timeit(func, repeat) :
+    '''
+    Return the best wall time of func over repeat runs and its last output
+    '''
+    best = np.inf
+    for _ in range(repeat) :
+        start = perf_counter()
+        out = func()
+        best = min(best, perf_counter() - start)
+    return best, out
+
+
+def main():
+
+    args = parse_args()
+    rng = np.random.default_rng(42)
+    # the values of a volume after shift_and_crop
+    array = rng.integers(0, 2048, (args.slices, 512, 512), dtype=np.int16)
+    image = sitk.GetImageFromArray(array)
+
+    print('Volume {} int16'.format(array.shape), flush=True)
+    t_pow, expected = timeit(lambda : _gamma_pow(image, args.gamma, 'HU'), args.repeat)
+    t_lut, adjusted = timeit(lambda : adjust_gamma(image, args.gamma, 'HU'), args.repeat)
+    equal = np.all(sitk.GetArrayFromImage(adjusted) == sitk.GetArrayFromImage(expected))
+    print('voxel-wise {:.3f} s, look-up table {:.3f} s ({:.1f}x), equal : {}'.format(
+          t_pow, t_lut, t_pow / t_lut, equal))
+
+
+if __name__ == '__main__' :
+    main()
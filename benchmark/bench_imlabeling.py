@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+
+from time import perf_counter
+
+from CTLungSeg.segmentation import imlabeling
+from CTLungSeg.segmentation import imlabeling_target
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Benchmark of the imlabeling distance engines and of the target fast path'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--slices',
+                        dest='slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of 512x512 slices of the synthetic volume',
+                        default=300)
+    parser.add_argument('--fraction',
+                        dest='fraction',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='fraction of voxels inside the weight mask',
+                        default=.15)
+    parser.add_argument('--repeat',
+                        dest='repeat',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of repetitions, the best time is reported',
+                        default=3)
+
+    args = parser.parse_args()
+    return args
+
+
+def timeit(func, repeat) :
+    '''
+    Return the best wall time of func over repeat runs and its last output
+    '''
+    best = np.inf
+    for _ in range(repeat) :
+        start = perf_counter()
+        out = func()
+        best = min(best, perf_counter() - start)
+    return best, out
+
+
+def main():
+
+    args = parse_args()
+    rng = np.random.default_rng(42)
+
+    # same centroids of the labeling script
+    centroids = np.asarray([[1.0291475, 1.7986686, 1.3147535, 1.6199226],
+                            [2.4449115, 2.8337748, 1.556249,  2.9394238],
+                            [3.4244044, 2.1809669, 4.172402,  3.652266],
+                            [5.1485806, 5.3843336, 2.7543516, 4.812335],
+                            [8.233303,  1.9194404, 6.503928,  6.670035]])
+    shape = (args.slices, 512, 512)
+    image = rng.normal(3., 2., shape + (4, ))
+    weight = (rng.random(shape) < args.fraction).astype(np.uint8)
+
+    print('Volume {} x 4 channels, {:.1f}% of voxels to label'.format(
+            shape, 100. * weight.mean()), flush=True)
+
+    for name, w in [('full volume', None), ('weighted', weight)] :
+        t_norm, norm = timeit(lambda : imlabeling(image, centroids,
+                                w if w is None else w.copy()), args.repeat)
+        t_gemm, gemm = timeit(lambda : imlabeling(image, centroids,
+                                w if w is None else w.copy(), engine='gemm'),
+                                args.repeat)
+        print('{}:'.format(name))
+        print('\tnorm : {:.3f} s'.format(t_norm))
+        print('\tgemm : {:.3f} s ({:.1f}x)'.format(t_gemm, t_norm / t_gemm))
+        print('\tlabel dtype : {} -> {}'.format(norm.dtype, gemm.dtype))
+        print('\tagreement : {:.6f}'.format(np.mean(norm == gemm)))
+        # binary GGO mask : full argmin against the hyperplane tests
+        t_target, target = timeit(lambda : imlabeling_target(image, centroids, 3, w),
+                                  args.repeat)
+        reference = (gemm == 3) if w is None else (gemm == 3) & (w != 0)
+        print('\ttarget : {:.3f} s ({:.1f}x vs gemm)'.format(t_target, t_gemm / t_target))
+        print('\ttarget agreement : {:.6f}'.format(np.mean(reference == target)), flush=True)
+
+
+if __name__ == '__main__' :
+    main()
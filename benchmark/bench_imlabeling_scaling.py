@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import numpy as np
+
+from time import perf_counter
+
+from CTLungSeg.segmentation import imlabeling
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Thread scaling of imlabeling'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--slices',
+                        dest='slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of 512x512 slices of the synthetic volume',
+                        default=300)
+    parser.add_argument('--engine',
+                        dest='engine',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='distance engine, norm or gemm',
+                        default='gemm')
+    parser.add_argument('--max_jobs',
+                        dest='max_jobs',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='maximum number of threads',
+                        default=os.cpu_count())
+    parser.add_argument('--chunk_slices',
+                        dest='chunk_slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of slices for each slab',
+                        default=8)
+
+    args = parser.parse_args()
+    return args
+
+
+def main():
+
+    args = parse_args()
+    rng = np.random.default_rng(42)
+
+    centroids = np.asarray([[1.0291475, 1.7986686, 1.3147535, 1.6199226],
+                            [2.4449115, 2.8337748, 1.556249,  2.9394238],
+                            [3.4244044, 2.1809669, 4.172402,  3.652266],
+                            [5.1485806, 5.3843336, 2.7543516, 4.812335],
+                            [8.233303,  1.9194404, 6.503928,  6.670035]])
+    shape = (args.slices, 512, 512)
+    image = rng.normal(3., 2., shape + (4, )).astype(np.float32)
+    n_voxels = np.prod(shape)
+
+    # powers of two up to max_jobs
+    n_jobs = sorted(set([2**i for i in range(int(np.log2(args.max_jobs)) + 1)]
+                        + [args.max_jobs]))
+
+    print('Volume {} x 4 channels, engine {}, slabs of {} slices'.format(
+            shape, args.engine, args.chunk_slices), flush=True)
+    print('{:>8} {:>10} {:>14} {:>9} {:>11}'.format(
+            'n_jobs', 'time [s]', 'Mvoxel / s', 'speedup', 'efficiency'))
+
+    reference = None
+    for n in n_jobs :
+        start = perf_counter()
+        imlabeling(image, centroids, engine=args.engine,
+                   chunk_slices=args.chunk_slices, n_jobs=n)
+        elapsed = perf_counter() - start
+        reference = elapsed if reference is None else reference
+        speedup = reference / elapsed
+        print('{:>8d} {:>10.3f} {:>14.2f} {:>9.2f} {:>11.2f}'.format(
+                n, elapsed, n_voxels / elapsed * 1e-6, speedup, speedup / n),
+                flush=True)
+
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from time import perf_counter
+
+from CTLungSeg.method import local_statistics
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Benchmark of the summed-area table local statistics against NoiseImageFilter'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--slices',
+                        dest='slices',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of 512x512 slices of the synthetic volume',
+                        default=100)
+    parser.add_argument('--radii',
+                        dest='radii',
+                        required=False,
+                        type=int,
+                        nargs='+',
+                        action='store',
+                        help='neighbourhood radii',
+                        default=[1, 2, 3, 5])
+    parser.add_argument('--repeat',
+                        dest='repeat',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of repetitions, the best time is reported',
+                        default=3)
+
+    args = parser.parse_args()
+    return args
+
+
+def timeit(func, repeat) :
+    '''
+    Return the best wall time of func over repeat runs and its last output
+    '''
+    best = np.inf
+    for _ in range(repeat) :
+        start = perf_counter()
+        out = func()
+        best = min(best, perf_counter() - start)
+    return best, out
+
+
+def main():
+
+    args = parse_args()
+    rng = np.random.default_rng(42)
+    array = rng.integers(-1000, 1000, (args.slices, 512, 512), dtype=np.int16)
+    image = sitk.GetImageFromArray(array)
+
+    print('Volume {} int16'.format(array.shape), flush=True)
+    for radius in args.radii :
+        noise = sitk.NoiseImageFilter()
+        noise.SetRadius(radius)
+        t_itk, expected = timeit(lambda : noise.Execute(image), args.repeat)
+        t_sat, (_, std) = timeit(lambda : local_statistics(image, radius), args.repeat)
+        # NoiseImageFilter returns the input pixel type, as std_filter
+        std = sitk.Cast(std, image.GetPixelID())
+        equal = np.mean(sitk.GetArrayFromImage(std) == sitk.GetArrayFromImage(expected))
+        print('radius {}: NoiseImageFilter {:.3f} s, summed-area tables {:.3f} s ({:.1f}x), '
+              'equal voxels {:.6f}'.format(radius, t_itk, t_sat, t_itk / t_sat, equal),
+              flush=True)
+
+    t_all, _ = timeit(lambda : local_statistics(image, args.radii), args.repeat)
+    print('all the radii in a single call : {:.3f} s'.format(t_all))
+
+
+if __name__ == '__main__' :
+    main()
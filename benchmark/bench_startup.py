@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import subprocess
+import numpy as np
+
+from time import perf_counter
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+entry_points = ['CTLungSeg', 'CTLungSeg.labeling', 'CTLungSeg.lung_extraction',
+                'CTLungSeg.train', 'CTLungSeg.evaluate', 'CTLungSeg.batch',
+                'CTLungSeg.service']
+
+
+def parse_args():
+    description = 'Start-up time of the command line entry points'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--budget',
+                        dest='budget',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='maximum start-up time, in seconds',
+                        default=1.)
+    parser.add_argument('--repeat',
+                        dest='repeat',
+                        required=False,
+                        type=int,
+                        action='store',
+                        help='number of runs, the median time is reported',
+                        default=5)
+
+    args = parser.parse_args()
+    return args
+
+
+def startup_time(entry_point, repeat) :
+    '''
+    Return the median wall time of "python -m entry_point --help"
+    '''
+    times = []
+    for _ in range(repeat) :
+        start = perf_counter()
+        subprocess.run([sys.executable, '-m', entry_point, '--help'], check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return np.median(times)
+
+
+def main():
+
+    args = parse_args()
+
+    start = perf_counter()
+    for _ in range(args.repeat) :
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    interpreter = (perf_counter() - start) / args.repeat
+    print('bare interpreter : {:.3f} s'.format(interpreter))
+
+    exceeded = []
+    for entry_point in entry_points :
+        elapsed = startup_time(entry_point, args.repeat)
+        status = 'ok' if elapsed <= args.budget else 'OVER BUDGET'
+        print('{:<28} {:.3f} s [{}]'.format(entry_point, elapsed, status), flush=True)
+        if elapsed > args.budget :
+            exceeded.append(entry_point)
+
+    if exceeded :
+        raise SystemExit('start-up budget of {:.2f} s exceeded by : {}'.format(
+                            args.budget, ', '.join(exceeded)))
+
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from time import perf_counter
+
+from CTLungSeg.utils import read_image
+from CTLungSeg.segmentation import remove_vessels
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+def parse_args():
+    description = 'Benchmark of the vessel removal on a coarser spacing against the full resolution one'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('--input',
+                        dest='input',
+                        required=False,
+                        type=str,
+                        action='store',
+                        help='image in HU with -1000 outside the lungs. '
+                             'Default a synthetic 200x512x512 volume',
+                        default=None)
+    parser.add_argument('--spacing',
+                        dest='spacing',
+                        required=False,
+                        type=float,
+                        nargs='+',
+                        action='store',
+                        help='coarser spacings, in mm',
+                        default=[1., 1.5, 2.])
+    parser.add_argument('--intensity',
+                        dest='intensity',
+                        required=False,
+                        type=float,
+                        action='store',
+                        help='minimum HU of the removed vessel voxels, also tested',
+                        default=-500)
+
+    args = parser.parse_args()
+    return args
+
+
+def synthetic_lung(shape=(200, 512, 512), spacing=(.7, .7, 1.25), n_vessels=40, seed=42) :
+    '''
+    Ellipsoidal lung with noisy parenchyma and straight vessels along z and x
+    '''
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    lung = ((z - shape[0] / 2) / (shape[0] * .35))**2 + \
+           ((y - shape[1] / 2) / (shape[1] * .3))**2 + \
+           ((x - shape[2] / 2) / (shape[2] * .3))**2 < 1
+    array = rng.normal(-850, 20, shape).astype(np.int16)
+    for cy, cx, r in zip(*(rng.uniform(.2, .8, (2, n_vessels)) * np.array(shape[1:])[:, None]),
+                         rng.uniform(1.5, 4., n_vessels)) :
+        array[:, ((y - cy)**2 + (x - cx)**2 < r * r)[0]] = 40
+    for cz, cy, r in zip(*(rng.uniform(.2, .8, (2, n_vessels)) * np.array(shape[:2])[:, None]),
+                         rng.uniform(1.5, 4., n_vessels)) :
+        array[((z - cz)**2 + (y - cy)**2 < r * r)[..., 0]] = 40
+    array[~lung] = -1000
+
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(spacing)
+    return image
+
+
+def main():
+
+    args = parse_args()
+    image = synthetic_lung() if args.input is None else read_image(args.input)
+    mask = sitk.Cast(image != -1000, sitk.sitkUInt8)
+    lung = sitk.GetArrayViewFromImage(mask) > 0
+
+    def removed(**kwargs) :
+        start = perf_counter()
+        out = remove_vessels(image, sigma=2., mask=mask, **kwargs)
+        elapsed = perf_counter() - start
+        return elapsed, (sitk.GetArrayFromImage(out) == -1000) & lung
+
+    print('Volume {}, spacing {}'.format(image.GetSize(), image.GetSpacing()), flush=True)
+    t_full, full = removed()
+    print('full resolution : {:.3f} s, {} vessel voxels'.format(t_full, full.sum()), flush=True)
+    for spacing in args.spacing :
+        for intensity in (None, args.intensity) :
+            elapsed, vessels = removed(spacing=spacing, intensity=intensity)
+            dice = 2. * (vessels & full).sum() / (vessels.sum() + full.sum())
+            print('spacing {} mm, intensity {} : {:.3f} s ({:.1f}x), Dice {:.3f}'.format(
+                  spacing, intensity, elapsed, t_full / elapsed, dice), flush=True)
+
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import types
+import pytest
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+@pytest.fixture
+def lung_image():
+    '''
+    Factory of zero valued images with a box of random GL, as the lung
+    images given by the lung extraction
+    '''
+    def factory(spacing=(1., 1., 1.)):
+        array = np.zeros((10, 32, 32), dtype=np.int16)
+        array[2:8, 4:28, 4:28] = np.random.randint(50, 1200, (6, 24, 24))
+        image = sitk.GetImageFromArray(array)
+        image.SetSpacing(spacing)
+        return image
+    return factory
+
+
+
+@pytest.fixture
+def ct_image():
+    '''
+    Factory of CT-like images : air around a body, with two lungs crossed by
+    an oblique vessel
+    '''
+    def factory(n_slices=40):
+        array = np.full((n_slices, 48, 64), -1000, dtype=np.int16)
+        array[:, 4:44, 4:60] = np.random.randint(100, 180, (n_slices, 40, 56))
+        array[:, 10:38, 8:30] = np.random.randint(-900, -800, (n_slices, 28, 22))
+        array[:, 10:38, 34:56] = np.random.randint(-900, -800, (n_slices, 28, 22))
+        for z in range(n_slices) :
+            array[z, 22:26, 10 + z // 3 : 14 + z // 3] = 40
+        image = sitk.GetImageFromArray(array)
+        image.SetSpacing((1., 1., 1.25))
+        return image
+    return factory
+
+
+
+@pytest.fixture
+def lungmask(monkeypatch):
+    '''
+    Stub of the lungmask package : the lungs are the voxels between -950 and
+    60 HU, i.e. lung parenchyma and vessels, labeled 1 and 2 on the two
+    halves of each slice. The returned
+    namespace counts the model loadings, explicit or made by apply when no
+    model is given, and the apply calls
+    '''
+    calls = types.SimpleNamespace(load=0, apply=0)
+
+    def get_model(modeltype='unet', modelname='R231'):
+        calls.load += 1
+        return object()
+
+    def apply(image, model=None, batch_size=20):
+        if model is None :
+            get_model()
+        calls.apply += 1
+        array = sitk.GetArrayFromImage(image)
+        mask = ((array > -950) & (array < 60)).astype(np.uint8)
+        mask[..., array.shape[-1] // 2:] *= 2
+        return mask
+
+    package = types.ModuleType('lungmask')
+    package.mask = types.ModuleType('lungmask.mask')
+    package.mask.get_model = get_model
+    package.mask.apply = apply
+    monkeypatch.setitem(sys.modules, 'lungmask', package)
+    monkeypatch.setitem(sys.modules, 'lungmask.mask', package.mask)
+    # without a thread budget, so the model loading does not import torch
+    monkeypatch.delenv('CTLUNGSEG_THREADS', raising=False)
+    return calls
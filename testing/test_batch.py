@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import types
+import pytest
+
+from CTLungSeg.batch import list_scans
+from CTLungSeg.batch import output_filename
+from CTLungSeg.batch import is_up_to_date
+from CTLungSeg.batch import read_manifest
+from CTLungSeg.batch import run_labeling
+from CTLungSeg.batch import run_lung_extraction
+from CTLungSeg.batch import _write_output
+from CTLungSeg.labeling import centroids
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+def test_list_scans_and_output_filename(tmp_path):
+    '''
+    Given :
+        - directory with files, a DICOM folder, a hidden file and the LUNG folder
+    So :
+        - list the scans
+        - build the output filenames
+    Assert :
+        - only files and series are listed, in order
+        - output names drop all the extensions
+    '''
+    for name in ['b.nii.gz', 'a.nrrd', '.hidden'] :
+        (tmp_path / name).write_text('')
+    os.mkdir(tmp_path / 'series')
+    os.mkdir(tmp_path / 'LUNG')
+
+    scans = list_scans(str(tmp_path))
+
+    assert [os.path.basename(s) for s in scans] == ['a.nrrd', 'b.nii.gz', 'series']
+    assert output_filename(scans[1], 'out') == os.path.join('out', 'b.nrrd')
+    assert output_filename(scans[2], 'out', '_lung') == os.path.join('out', 'series_lung.nrrd')
+
+
+
+def test_list_scans_raise_file_not_found(tmp_path):
+    '''
+    Given :
+        - path to a non existing directory
+    Assert :
+        - FileNotFoundError is raised
+    '''
+    with pytest.raises(FileNotFoundError):
+        list_scans(str(tmp_path / 'missing'))
+
+
+
+def test_is_up_to_date(tmp_path):
+    '''
+    Given :
+        - input file
+        - output file older and newer than the input
+    Assert :
+        - only the newer output is up to date
+    '''
+    src = tmp_path / 'src.nrrd'
+    dst = tmp_path / 'dst.nrrd'
+    src.write_text('')
+
+    assert not is_up_to_date(str(src), str(dst))
+    dst.write_text('')
+    os.utime(dst, (0, 0))
+    assert not is_up_to_date(str(src), str(dst))
+    os.utime(src, (0, 0))
+    assert is_up_to_date(str(src), str(dst))
+
+
+
+def test_run_labeling(tmp_path, lung_image):
+    '''
+    Given :
+        - input directory with two lung images and a corrupted file
+    So :
+        - label the directory with two workers
+        - run the batch again
+    Assert :
+        - the images are labeled and the corrupted file fails
+        - the second run skips the labeled images
+        - the manifest logs the processed scans only, and its last row for
+            each scan is the current state
+    '''
+    input_dir = tmp_path / 'LUNG_INPUT'
+    output_dir = tmp_path / 'OUTPUT'
+    os.mkdir(input_dir)
+    for name in ['a', 'b'] :
+        sitk.WriteImage(lung_image(), str(input_dir / '{}.nrrd'.format(name)))
+    (input_dir / 'c.nrrd').write_text('not an image')
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+
+    first = run_labeling(str(input_dir), str(output_dir), center, workers=2, verbose=False)
+    second = run_labeling(str(input_dir), str(output_dir), center, verbose=False)
+    status = {os.path.basename(r['scan']) : r['status'] for r in first}
+
+    assert status == {'a.nrrd' : 'done', 'b.nrrd' : 'done', 'c.nrrd' : 'failed'}
+    assert sitk.ReadImage(str(output_dir / 'a.nrrd')).GetSize() == (32, 32, 10)
+    assert sorted(r['status'] for r in second) == ['failed', 'skipped', 'skipped']
+    assert len(read_manifest(str(output_dir), latest=False)) == 4
+    latest = {os.path.basename(r['scan']) : r['status'] for r in read_manifest(str(output_dir))}
+    assert latest == status
+
+
+
+def test_run_lung_extraction_skip_up_to_date(tmp_path, lung_image):
+    '''
+    Given :
+        - input directory with a scan
+        - output directory with its up to date lung image
+    So :
+        - run the batch lung extraction
+    Assert :
+        - the scan is skipped without loading the model
+        - the skipped scan is not logged into the manifest
+    '''
+    input_dir = tmp_path / 'INPUT'
+    output_dir = tmp_path / 'LUNG'
+    os.mkdir(input_dir)
+    os.mkdir(output_dir)
+    sitk.WriteImage(lung_image(), str(input_dir / 'a.nii.gz'))
+    sitk.WriteImage(lung_image(), str(output_dir / 'a.nrrd'))
+
+    rows = run_lung_extraction(str(input_dir), str(output_dir), verbose=False)
+
+    assert [r['status'] for r in rows] == ['skipped']
+    assert read_manifest(str(output_dir)) == []
+
+
+
+def test_run_lung_extraction(tmp_path, monkeypatch, ct_image, lungmask):
+    '''
+    Given :
+        - input directory with two CT scans and a corrupted file
+        - stub of the lungmask model and of torch
+    So :
+        - run the batch lung extraction with two torch threads
+    Assert :
+        - the scans are extracted and the corrupted file fails
+        - the lung images are written and no partial file is left
+        - the model is loaded only once and the torch threads are set
+    '''
+    torch_threads = []
+    torch = types.ModuleType('torch')
+    torch.set_num_threads = torch_threads.append
+    monkeypatch.setitem(sys.modules, 'torch', torch)
+    input_dir = tmp_path / 'INPUT'
+    output_dir = tmp_path / 'LUNG'
+    os.mkdir(input_dir)
+    for name in ['a', 'b'] :
+        sitk.WriteImage(ct_image(), str(input_dir / '{}.nii.gz'.format(name)))
+    (input_dir / 'c.nii.gz').write_text('not an image')
+
+    rows = run_lung_extraction(str(input_dir), str(output_dir), torch_threads=2,
+                               verbose=False)
+    status = {os.path.basename(r['scan']) : r['status'] for r in rows}
+
+    assert status == {'a.nii.gz' : 'done', 'b.nii.gz' : 'done', 'c.nii.gz' : 'failed'}
+    assert [r['status'] for r in read_manifest(str(output_dir))] == ['done', 'done', 'failed']
+    assert sorted(os.listdir(output_dir)) == ['a.nrrd', 'b.nrrd', 'manifest.csv']
+    for name in ['a', 'b'] :
+        lung = sitk.ReadImage(str(output_dir / '{}.nrrd'.format(name)))
+        assert lung.GetSize() == (64, 48, 40)
+        assert sitk.GetArrayFromImage(lung).any()
+    assert lungmask.load == 1
+    assert lungmask.apply == 2
+    assert torch_threads == [2]
+
+
+
+def test_write_output_interrupted(tmp_path, lung_image):
+    '''
+    Given :
+        - output filename
+    So :
+        - write an image
+        - write an object which is not an image, so that the writing fails
+    Assert :
+        - the image is written and no partial file is left
+        - the failed writing leaves neither the output nor a partial file
+    '''
+    output = str(tmp_path / 'a.nrrd')
+    _write_output(lung_image(), output)
+
+    assert sitk.ReadImage(output).GetSize() == (32, 32, 10)
+    assert os.listdir(tmp_path) == ['a.nrrd']
+
+    with pytest.raises(Exception) :
+        _write_output('not an image', str(tmp_path / 'b.nrrd'))
+    assert os.listdir(tmp_path) == ['a.nrrd']
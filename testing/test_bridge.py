@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.bridge import array_view
+from CTLungSeg.bridge import to_array
+from CTLungSeg.bridge import to_image
+from CTLungSeg.bridge import copy_image
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def image_strategy(draw):
+    '''
+    Generates a SimpleITK image with random 16-bit GL and random geometry
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    size = (draw(st.integers(5, 20)), 30, 30)
+    array = np.random.randint(-1000, 2048, size, dtype=np.int16)
+    image = sitk.GetImageFromArray(array)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    image.SetDirection((0., 0., 1., 1., 0., 0., 0., 1., 0.))
+    return image
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(image_strategy())
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_array_view(image):
+    '''
+    Given :
+        - image
+    So :
+        - take the array view of the image
+    Assert :
+        - the view has the image values, in (z, y, x) order
+        - the view is read-only
+    '''
+    view = array_view(image)
+
+    assert view.shape == image.GetSize()[::-1]
+    assert (view == sitk.GetArrayFromImage(image)).all()
+    with pytest.raises(ValueError):
+        view[0, 0, 0] = 1
+
+
+
+@given(image_strategy(), st.sampled_from([None, np.float32, np.int32]))
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_to_array(image, dtype):
+    '''
+    Given :
+        - image
+        - array type
+    So :
+        - copy the image buffer into an array
+        - modify the array
+    Assert :
+        - the array has the image values and the required type
+        - the image is unchanged
+    '''
+    expected = sitk.GetArrayFromImage(image)
+    array = to_array(image, dtype=dtype)
+
+    assert array.dtype == (expected.dtype if dtype is None else dtype)
+    assert (array == expected).all()
+    array[...] = 0
+    assert (array_view(image) == expected).all()
+
+
+
+@given(image_strategy(), st.booleans())
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_to_image(reference, boolean):
+    '''
+    Given :
+        - reference image
+        - integer or boolean array with the reference size
+    So :
+        - build the image from the array, with the reference geometry
+    Assert :
+        - the image has the array values
+        - the boolean arrays are stored as uint8
+        - the geometry is the one of the reference
+    '''
+    array = sitk.GetArrayFromImage(reference)
+    if boolean :
+        array = array > 0
+    image = to_image(array, reference=reference)
+
+    assert (sitk.GetArrayFromImage(image) == array).all()
+    if boolean :
+        assert image.GetPixelID() == sitk.sitkUInt8
+    assert np.isclose(image.GetOrigin(), reference.GetOrigin()).all()
+    assert np.isclose(image.GetSpacing(), reference.GetSpacing()).all()
+    assert np.isclose(image.GetDirection(), reference.GetDirection()).all()
+
+
+
+@given(image_strategy())
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_copy_image(image):
+    '''
+    Given :
+        - image
+    So :
+        - copy the image
+        - modify the copy
+    Assert :
+        - the copy has the image values and geometry
+        - the input image is unchanged
+    '''
+    expected = sitk.GetArrayFromImage(image)
+    copy = copy_image(image)
+
+    assert (sitk.GetArrayFromImage(copy) == expected).all()
+    assert np.isclose(copy.GetOrigin(), image.GetOrigin()).all()
+    copy[0, 0, 0] = 1 + int(expected[0, 0, 0])
+    assert (sitk.GetArrayFromImage(image) == expected).all()
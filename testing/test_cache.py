@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.cache import FilterCache
+from CTLungSeg.cache import enable_cache
+from CTLungSeg.cache import disable_cache
+from CTLungSeg.cache import cache_info
+from CTLungSeg.cache import image_digest
+from CTLungSeg.method import median_filter
+from CTLungSeg.method import gauss_smooth
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def random_image_strategy(draw):
+    '''
+    Generates a SimpleITK image with random 16-bit GL
+    '''
+    size = (draw(st.integers(5, 20)), 30, 30)
+    array = np.random.randint(0, 2048, size, dtype=np.int16)
+    return sitk.GetImageFromArray(array)
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(random_image_strategy(), st.integers(1, 3))
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_cached_filter(image, radius):
+    '''
+    Given :
+        - image
+        - filter radius
+    So :
+        - enable the cache
+        - apply the same filter twice, then with a different radius
+    Assert :
+        - cached result is equal to the computed one
+        - hits and misses are counted
+    '''
+    enable_cache(2**30)
+    try :
+        first = median_filter(image, radius)
+        second = median_filter(image, radius)
+        _ = median_filter(image, radius + 1)
+        info = cache_info()
+    finally :
+        disable_cache()
+
+    assert (sitk.GetArrayFromImage(first) == sitk.GetArrayFromImage(second)).all()
+    assert info['hits'] == 1
+    assert info['misses'] == 2
+    assert info['entries'] == 2
+
+
+
+@given(random_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_cached_filter_returns_copy(image):
+    '''
+    Given :
+        - image
+    So :
+        - enable the cache
+        - apply the filter and modify the result
+        - apply the filter again
+    Assert :
+        - the cached result is not modified
+    '''
+    enable_cache(2**30)
+    try :
+        first = gauss_smooth(image, 2.)
+        first.SetOrigin((10., 10., 10.))
+        first[0, 0, 0] = 1e5
+        second = gauss_smooth(image, 2.)
+    finally :
+        disable_cache()
+
+    assert second.GetOrigin() == image.GetOrigin()
+    assert second[0, 0, 0] != 1e5
+
+
+
+def test_filter_cache_eviction():
+    '''
+    Given :
+        - cache with budget for two images
+    So :
+        - store three images
+        - access the first one before storing the third
+    Assert :
+        - the least recently used image is evicted
+        - the memory budget is respected
+    '''
+    images = [sitk.Image(10, 10, 10, sitk.sitkUInt8) for _ in range(3)]
+    cache = FilterCache(max_bytes=2000)
+
+    cache.put('a', images[0])
+    cache.put('b', images[1])
+    _ = cache.get('a')
+    cache.put('c', images[2])
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.info()['evictions'] == 1
+    assert cache.info()['current_bytes'] <= 2000
+
+
+
+def test_filter_cache_raise_value_error():
+    '''
+    Given :
+        - not positive memory budget
+    Assert :
+        - ValueError is raised
+    '''
+    with pytest.raises(ValueError):
+        FilterCache(max_bytes=0)
+
+
+
+@given(random_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_image_digest(image):
+    '''
+    Given :
+        - image
+    So :
+        - compute the digest of the image, of its copy and of a modified copy
+    Assert :
+        - the digest depends on the content and on the geometry
+    '''
+    copy = sitk.Image(image)
+    moved = sitk.Image(image)
+    moved.SetOrigin((1., 2., 3.))
+    changed = sitk.Image(image)
+    changed[0, 0, 0] = int(image[0, 0, 0]) + 1
+
+    assert image_digest(image) == image_digest(copy)
+    assert image_digest(image) != image_digest(moved)
+    assert image_digest(image) != image_digest(changed)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.chunked import ChunkedVolume
+from CTLungSeg.chunked import write_chunked
+from CTLungSeg.chunked import read_chunked
+from CTLungSeg.utils import read_image
+from CTLungSeg.utils import write_volume
+
+import os
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def image_strategy(draw):
+    '''
+    Generates a SimpleITK image, scalar or vector, with random geometry
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    n_slices = draw(st.integers(1, 40))
+    vector = draw(st.booleans())
+    if vector :
+        array = np.random.rand(n_slices, 12, 10, 4).astype(np.float32)
+    else :
+        array = np.random.randint(-1000, 2048, (n_slices, 12, 10), dtype=np.int16)
+    image = sitk.GetImageFromArray(array, isVector=vector)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    image.SetDirection((0., 0., 1., 1., 0., 0., 0., 1., 0.))
+    return image
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(image_strategy(), st.integers(1, 20), st.sampled_from([None, 'zlib']))
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_chunked_round_trip(image, chunk_slices, compression):
+    '''
+    Given :
+        - image
+        - number of slices of each chunk
+        - compression
+    So :
+        - write the chunked volume
+        - read it back
+    Assert :
+        - values, pixel type and geometry are preserved
+    '''
+    with tempfile.TemporaryDirectory() as tmp :
+        filename = os.path.join(tmp, 'volume.cvol')
+        write_chunked(image, filename, chunk_slices=chunk_slices, compression=compression)
+        read = read_chunked(filename)
+
+    assert read.GetPixelID() == image.GetPixelID()
+    assert read.GetSize() == image.GetSize()
+    assert (sitk.GetArrayFromImage(read) == sitk.GetArrayFromImage(image)).all()
+    assert np.isclose(read.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(read.GetSpacing(), image.GetSpacing()).all()
+    assert np.isclose(read.GetDirection(), image.GetDirection()).all()
+
+
+
+@given(image_strategy(), st.integers(1, 20), st.sampled_from([None, 'zlib']), st.data())
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_chunked_read_slices(image, chunk_slices, compression, data):
+    '''
+    Given :
+        - image
+        - number of slices of each chunk
+        - compression
+        - range of slices
+    So :
+        - write the chunked volume
+        - read the range of slices, as array and as image
+    Assert :
+        - the slices are equal to the ones of the image
+        - the origin of the image is the one of its first slice
+        - the uncompressed volumes are equal to their memory map
+    '''
+    array = sitk.GetArrayFromImage(image)
+    start = data.draw(st.integers(0, array.shape[0] - 1))
+    stop = data.draw(st.integers(start, array.shape[0]))
+
+    with tempfile.TemporaryDirectory() as tmp :
+        filename = os.path.join(tmp, 'volume.cvol')
+        write_chunked(image, filename, chunk_slices=chunk_slices, compression=compression)
+        volume = ChunkedVolume(filename)
+        slab = volume.read_slices(start, stop)
+        if stop > start :
+            slab_image = volume.to_image(start, stop)
+            assert np.isclose(slab_image.GetOrigin(),
+                              image.TransformIndexToPhysicalPoint([0, 0, start])).all()
+        if compression is None :
+            assert (np.asarray(volume.memmap()) == array).all()
+        else :
+            with pytest.raises(ValueError):
+                volume.memmap()
+
+    assert volume.n_chunks == -(-array.shape[0] // chunk_slices)
+    assert (slab == array[start : stop]).all()
+
+
+
+def test_chunked_feature_stack():
+    '''
+    Given :
+        - feature stack array
+        - reference image
+    So :
+        - write the stack as chunked volume with the reference geometry
+        - read it back as memory map and as image
+    Assert :
+        - the stack is preserved
+        - the geometry is the reference one
+    '''
+    stack = np.random.rand(7, 8, 9, 4).astype(np.float32)
+    reference = sitk.Image(9, 8, 7, sitk.sitkInt16)
+    reference.SetSpacing((.5, .5, 2.))
+
+    with tempfile.TemporaryDirectory() as tmp :
+        filename = os.path.join(tmp, 'features.cvol')
+        write_chunked(stack, filename, chunk_slices=3, reference=reference)
+        volume = ChunkedVolume(filename)
+        mapped = np.asarray(volume.memmap())
+        image = volume.to_image()
+
+    assert (mapped == stack).all()
+    assert image.GetNumberOfComponentsPerPixel() == 4
+    assert np.isclose(image.GetSpacing(), reference.GetSpacing()).all()
+
+
+
+@given(image_strategy())
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_read_write_chunked_extension(image):
+    '''
+    Given :
+        - image
+    So :
+        - write it with write_volume and the .cvol extension
+        - read it with read_image
+    Assert :
+        - a chunked volume is written
+        - the image is preserved
+    '''
+    with tempfile.TemporaryDirectory() as tmp :
+        filename = os.path.join(tmp, 'lung.cvol')
+        write_volume(image, filename)
+        assert os.path.isdir(filename)
+        read = read_image(filename)
+
+    assert (sitk.GetArrayFromImage(read) == sitk.GetArrayFromImage(image)).all()
+    assert np.isclose(read.GetOrigin(), image.GetOrigin()).all()
+
+
+
+def test_chunked_raise_errors():
+    '''
+    Given :
+        - image
+    So :
+        - write it with invalid chunk size and compression
+        - read a missing volume
+    Assert :
+        - ValueError and FileNotFoundError are raised
+    '''
+    image = sitk.Image(5, 5, 5, sitk.sitkInt16)
+    with tempfile.TemporaryDirectory() as tmp :
+        with pytest.raises(ValueError):
+            write_chunked(image, os.path.join(tmp, 'a.cvol'), chunk_slices=0)
+        with pytest.raises(ValueError):
+            write_chunked(image, os.path.join(tmp, 'a.cvol'), compression='lz4')
+        with pytest.raises(FileNotFoundError):
+            ChunkedVolume(os.path.join(tmp, 'missing.cvol'))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.features import FeatureExtractor
+from CTLungSeg.utils import normalize
+from CTLungSeg.method import median_filter
+from CTLungSeg.method import std_filter
+from CTLungSeg.method import adaptive_histogram_equalization
+from CTLungSeg.method import adjust_gamma
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def ct_image_strategy(draw):
+    '''
+    Generates a SimpleITK image with random GL in [0, 2048]
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    size = (draw(st.integers(5, 20)), 40, 40)
+
+    array = np.random.randint(0, 2048, size, dtype=np.int16)
+    image = sitk.GetImageFromArray(array)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    return image
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(ct_image_strategy(), st.integers(1, 5), st.integers(1, 3), st.integers(1, 3),
+       st.floats(.5, 3.))
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_feature_extractor(image, ahe_radius, median_radius, std_radius, gamma):
+    '''
+    Given :
+        - image
+        - filter parameters
+    So :
+        - compute the features with the extractor
+        - compute the features by normalizing each filter response
+    Assert :
+        - the features are stored as float32 with the correct shape
+        - the features are equal up to float32 precision
+    '''
+    extractor = FeatureExtractor(ahe_radius, median_radius, std_radius, gamma)
+    features = extractor(image)
+
+    expected = np.stack([
+        sitk.GetArrayFromImage(normalize(adaptive_histogram_equalization(image, ahe_radius))),
+        sitk.GetArrayFromImage(normalize(median_filter(image, median_radius))),
+        sitk.GetArrayFromImage(normalize(adjust_gamma(image, gamma))),
+        sitk.GetArrayFromImage(normalize(std_filter(image, std_radius)))], axis=-1)
+
+    assert features.dtype == np.float32
+    assert features.shape == image.GetSize()[::-1] + (4, )
+    assert np.allclose(features, expected, atol=1e-4)
+    assert extractor.halo == max(ahe_radius, median_radius, std_radius)
+    assert extractor.get_params()['gamma'] == gamma
+
+
+
+@given(ct_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_feature_extractor_buffer(image):
+    '''
+    Given :
+        - image
+        - buffer with an extra channel
+    So :
+        - write the features into the first channels of the buffer
+    Assert :
+        - the features are written in place
+        - the extra channel is untouched
+    '''
+    extractor = FeatureExtractor()
+    buffer = np.full(image.GetSize()[::-1] + (5, ), -1., dtype=np.float32)
+    out = extractor(image, out=buffer[..., :-1])
+
+    assert np.shares_memory(out, buffer)
+    assert np.allclose(buffer[..., :-1], extractor(image))
+    assert (buffer[..., -1] == -1.).all()
+
+
+
+@given(ct_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_feature_extractor_statistics(image):
+    '''
+    Given :
+        - image
+        - mean and standard deviation of each channel response
+    So :
+        - compute the features with the given statistics
+    Assert :
+        - the features are equal to the ones normalized with their statistics
+    '''
+    extractor = FeatureExtractor()
+    statistics = []
+    for channel in extractor.channels :
+        response = sitk.GetArrayFromImage(extractor.response(image, channel))
+        statistics.append((response.mean(), response.std(ddof=1)))
+
+    assert np.allclose(extractor(image, statistics=statistics), extractor(image), atol=1e-4)
+
+
+
+@given(ct_image_strategy())
+@settings(max_examples=2,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_feature_extractor_raise_buffer_value_error(image):
+    '''
+    Given :
+        - image
+        - buffer with wrong shape
+    Assert :
+        - ValueError is raised
+    '''
+    buffer = np.empty(image.GetSize(), dtype=np.float32)
+
+    with pytest.raises(ValueError):
+        FeatureExtractor()(image, out=buffer)
+
+
+
+def test_feature_extractor_raise_zero_division():
+    '''
+    Given :
+        - constant image
+    Assert :
+        - ZeroDivisionError is raised
+    '''
+    image = sitk.Image(20, 20, 5, sitk.sitkInt16)
+
+    with pytest.raises(ZeroDivisionError):
+        FeatureExtractor()(image)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.labeling import main
+from CTLungSeg.labeling import centroids
+from CTLungSeg.labeling import coarse_to_fine
+from CTLungSeg.features import FeatureExtractor
+from CTLungSeg.segmentation import imlabeling
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def lung_image_strategy(draw):
+    '''
+    Generates a zero valued image with an ellipsoidal lung of low GL, which
+    contains a spherical patch of higher GL
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    center = draw(st.tuples(st.integers(12, 18), st.integers(20, 44), st.integers(20, 44)))
+
+    z, y, x = np.ogrid[:30, :64, :64]
+    lung = ((z - center[0])**2 / 100 + (y - center[1])**2 / 225 + (x - center[2])**2 / 225) < 1
+    patch = lung & (((z - center[0])**2 + (y - center[1])**2 + (x - center[2])**2) < 25)
+
+    array = np.zeros((30, 64, 64), dtype=np.int16)
+    array[lung] = np.random.randint(50, 250, lung.sum())
+    array[patch] = np.random.randint(600, 1200, patch.sum())
+
+    image = sitk.GetImageFromArray(array)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    return image
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(lung_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_main_crop(image):
+    '''
+    Given :
+        - image with a lung surrounded by zeros
+    So :
+        - label the image with and without the crop to the lung bounding box
+    Assert :
+        - the labels are equal
+        - the geometry of the input image is preserved
+    '''
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+
+    full = main(image, center, crop=False)
+    cropped = main(image, center)
+
+    assert (sitk.GetArrayFromImage(full) == sitk.GetArrayFromImage(cropped)).all()
+    assert cropped.GetSize() == image.GetSize()
+    assert np.isclose(cropped.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(cropped.GetSpacing(), image.GetSpacing()).all()
+
+
+@given(lung_image_strategy())
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_coarse_to_fine_full_band(image):
+    '''
+    Given :
+        - image with a lung surrounded by zeros
+    So :
+        - label the image at full resolution
+        - label the image coarse-to-fine with a band which covers the whole
+          image and the statistics computed on all the blocks
+    Assert :
+        - the labels are uint8 with the image shape
+        - the labels agree on almost all the voxels
+    '''
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+    extractor = FeatureExtractor(ahe_radius=5, median_radius=3, std_radius=3, gamma=1.5)
+
+    array = sitk.GetArrayFromImage(image)
+    weight = (array != 0).astype(np.uint8)
+    labels = imlabeling(image=extractor(image), centroids=center, weight=weight, engine='gemm')
+    full = labels == 3
+
+    refined = coarse_to_fine(image, center, extractor, factor=2, band=64,
+                             block=32, sample_fraction=1.)
+
+    assert refined.dtype == np.uint8
+    assert refined.shape == array.shape
+    assert np.mean(full == refined) > .99
+
+
+@given(lung_image_strategy(), st.integers(2, 3))
+@settings(max_examples=3,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_main_coarse_factor(image, factor):
+    '''
+    Given :
+        - image with a lung surrounded by zeros
+        - in-plane downsampling factor
+    So :
+        - label the image with the coarse-to-fine approach
+    Assert :
+        - the labels are binary and zero outside the lung
+        - the geometry of the input image is preserved
+    '''
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+
+    labels = main(image, center, coarse_factor=factor)
+    array = sitk.GetArrayFromImage(labels)
+
+    assert set(np.unique(array)) <= {0, 1}
+    assert not array[sitk.GetArrayFromImage(image) == 0].any()
+    assert labels.GetSize() == image.GetSize()
+    assert np.isclose(labels.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(labels.GetSpacing(), image.GetSpacing()).all()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from hypothesis import HealthCheck as HC
+
+from CTLungSeg.lung_extraction import main
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(slab_size=st.integers(3, 40))
+@settings(max_examples=5, deadline=None,
+          suppress_health_check=(HC.too_slow, HC.function_scoped_fixture))
+def test_main_in_slabs(ct_image, lungmask, slab_size):
+    '''
+    Given :
+        - CT image with two lungs crossed by a vessel
+        - stub of the lungmask model
+    So :
+        - extract the lungs from the whole image
+        - extract the lungs in slabs of slices
+    Assert :
+        - the slabs give the same lung image as the whole image
+        - the vessel is removed
+        - the model is loaded only once for all the slabs
+    '''
+    image = ct_image()
+    expected = main(image)
+    loaded = lungmask.load
+    slabs = main(image, slab_size=slab_size)
+
+    assert lungmask.load == loaded + 1
+    assert slabs.GetSize() == expected.GetSize()
+    assert slabs.GetSpacing() == expected.GetSpacing()
+    assert np.array_equal(sitk.GetArrayFromImage(slabs), sitk.GetArrayFromImage(expected))
+    # the vessel voxels are mostly out of the lung image
+    vessel = sitk.GetArrayFromImage(image) == 40
+    assert np.count_nonzero(sitk.GetArrayFromImage(expected)[vessel]) < vessel.sum() // 2
+
+
+
+def test_main_raise_value_error(ct_image, lungmask):
+    '''
+    Given :
+        - CT image
+        - stub of the lungmask model
+    So :
+        - extract the lungs in slabs, with the coarse vessel removal
+    Assert :
+        - ValueError is raised, since each slab would be resampled on its
+            own coarse grid
+    '''
+    with pytest.raises(ValueError):
+        main(ct_image(), slab_size=8, vessel_spacing=2.)
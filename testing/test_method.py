@@ -7,11 +7,14 @@ from hypothesis import given, settings
 from  hypothesis import HealthCheck as HC
 
 from CTLungSeg.method import median_filter
+from CTLungSeg.method import majority_filter
 from CTLungSeg.method import std_filter
+from CTLungSeg.method import local_statistics
 from CTLungSeg.method import gauss_smooth
 from CTLungSeg.method import threshold
 from CTLungSeg.method import adaptive_histogram_equalization
 from CTLungSeg.method import adjust_gamma
+from CTLungSeg.method import _gamma_pow
 from CTLungSeg.method import vesselness
 from CTLungSeg.method import cast_image
 from CTLungSeg.method import apply_mask
@@ -90,6 +93,48 @@ def median_noise_strategy(draw):
     return noise.Execute(image)
 
 
+@st.composite
+def binary_mask_strategy(draw):
+    '''
+    Generates a binary image with a random box of random density
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    shape = draw(st.tuples(st.integers(3, 20), st.integers(3, 40), st.integers(3, 40)))
+    density = draw(st.floats(.1, .9))
+
+    lower = [draw(st.integers(0, n - 1)) for n in shape]
+    upper = [draw(st.integers(l + 1, n)) for l, n in zip(lower, shape)]
+    box = tuple(slice(l, u) for l, u in zip(lower, upper))
+
+    array = np.zeros(shape, dtype=np.uint8)
+    array[box] = np.random.rand(*array[box].shape) < density
+
+    image = sitk.GetImageFromArray(array)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    return image
+
+
+@st.composite
+def textured_image_strategy(draw):
+    '''
+    Generates a noisy texture with a spherical dense region
+    '''
+    origin = draw(st.tuples(*[st.floats(0., 100.)] * 3))
+    spacing = draw(st.tuples(*[st.floats(.1, 1.)] * 3))
+    radius = draw(st.integers(3, 10))
+
+    z, y, x = np.ogrid[:20, :50, :50]
+    array = np.random.randint(0, 100, (20, 50, 50)).astype(np.int16)
+    array[((z - 10)**2 + (y - 25)**2 + (x - 25)**2) < radius**2] += 500
+
+    image = sitk.GetImageFromArray(array)
+    image.SetOrigin(origin)
+    image.SetSpacing(spacing)
+    return image
+
+
 ################################################################################
 ###                                                                          ###
 ###                                 TESTING                                  ###
@@ -139,6 +184,62 @@ def test_median_filter_raise_value_error(image) :
         image = median_filter(image, 0)
 
 
+@given(binary_mask_strategy(), st.integers(1, 4))
+@settings(max_examples=20,
+        deadline=None,
+        suppress_health_check=(HC.too_slow,))
+def test_majority_filter (image, radius) :
+    '''
+    Given :
+        - binary image
+        - kernel size
+    So :
+        - apply the majority filter
+        - apply the median filter
+    Assert that :
+        - the results are equal
+        - type and geometry are preserved
+    '''
+    filtered = majority_filter(image, radius)
+    blurred = median_filter(image, radius)
+
+    assert (sitk.GetArrayFromImage(filtered) == sitk.GetArrayFromImage(blurred)).all()
+    assert filtered.GetPixelID() == image.GetPixelID()
+    assert filtered.GetSize() == image.GetSize()
+    assert np.isclose(filtered.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(filtered.GetSpacing(), image.GetSpacing()).all()
+
+
+def test_majority_filter_empty () :
+    '''
+    Given :
+        - empty image
+    So :
+        - apply the majority filter
+    Assert that :
+        - the result is empty
+    '''
+    image = sitk.Image(20, 20, 5, sitk.sitkUInt8)
+    filtered = majority_filter(image, 3)
+
+    assert not sitk.GetArrayFromImage(filtered).any()
+
+
+def test_majority_filter_raise_value_error() :
+    '''
+    Given :
+        - SimpleITK image
+        - radius == 0
+    Then :
+        - apply majority filter
+    Assert :
+        - value error is raised
+    '''
+    image = sitk.Image(20, 20, 5, sitk.sitkUInt8)
+    with pytest.raises(ValueError):
+        image = majority_filter(image, 0)
+
+
 @given(gauss_noise_strategy(), st.floats(1., 4.))
 @settings(max_examples=5,
         deadline=None,
@@ -186,7 +287,41 @@ def tast_adjust_gamma_exception(image):
 
 
 
-@given(gauss_noise_strategy(), text_strategy)
+@given(st.sampled_from([(np.uint8, 'uint8'), (np.uint16, 'uint16'), (np.int16, 'HU'), (np.float32, 'HU')]),
+       st.floats(.2, 5.), st.integers(0, 2**14))
+@settings(max_examples=20,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_adjust_gamma_lut(types, gamma, seed):
+    '''
+    Given :
+        - Image of integer or float values, in the range of the type
+        - gamma
+    Then :
+        - apply adjust_gamma, by look-up table for the integer images
+        - apply the voxel-wise gamma correction
+    Assert :
+        - the results are equal
+        - the geometry is preserved
+    '''
+    dtype, image_type = types
+    rng = np.random.default_rng(seed)
+    low, high = (-1024, 2048) if dtype in (np.int16, np.float32) else (0, np.iinfo(dtype).max)
+    image = sitk.GetImageFromArray(rng.integers(low, high, (10, 20, 30)).astype(dtype))
+    image.SetSpacing((.5, .7, 2.))
+    image.SetOrigin((1., 2., 3.))
+
+    adjusted = adjust_gamma(image, gamma, image_type)
+    expected = _gamma_pow(image, gamma, image_type)
+
+    assert adjusted.GetPixelID() == expected.GetPixelID()
+    assert (sitk.GetArrayFromImage(adjusted) == sitk.GetArrayFromImage(expected)).all()
+    assert np.isclose(adjusted.GetSpacing(), image.GetSpacing()).all()
+    assert np.isclose(adjusted.GetOrigin(), image.GetOrigin()).all()
+
+
+
+@given(gauss_noise_strategy(), text_strategy.filter(lambda t : t not in ['HU', 'uint8', 'uint16']))
 @settings(max_examples=5,
             deadline=None,
             suppress_health_check=(HC.too_slow,))
@@ -223,6 +358,194 @@ def test_std_filter_raise_value_error(image):
 
 
 
+@given(gauss_noise_strategy(), st.integers(1, 4), st.sampled_from([sitk.sitkInt16, sitk.sitkFloat32]))
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_std_filter(image, radius, pixel_type):
+    '''
+    Given :
+        - Image
+        - Radius
+        - pixel type
+    Then :
+        - Apply std_filter
+        - Apply NoiseImageFilter
+    assert :
+        - the results are equal, bit by bit for integer images
+        - the pixel type is preserved
+    '''
+    image = sitk.Cast(image, pixel_type)
+    noise = sitk.NoiseImageFilter()
+    noise.SetRadius(radius)
+    expected = sitk.GetArrayFromImage(noise.Execute(image))
+
+    filtered = std_filter(image, radius)
+
+    assert filtered.GetPixelID() == pixel_type
+    if pixel_type == sitk.sitkInt16 :
+        assert (sitk.GetArrayFromImage(filtered) == expected).all()
+    else :
+        assert np.allclose(sitk.GetArrayFromImage(filtered), expected, rtol=1e-5, atol=1e-3)
+
+
+
+@given(gauss_noise_strategy(), st.lists(st.integers(1, 4), min_size=1, max_size=3), st.integers(1, 20))
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_local_statistics(image, radii, slab_size):
+    '''
+    Given :
+        - Image
+        - list of radii
+        - number of slices of each slab
+    Then :
+        - compute the local statistics for all the radii at once
+        - compute the local mean with the MeanImageFilter
+        - compute the local std with the NoiseImageFilter
+    assert :
+        - the statistics are equal, for each radius
+        - the geometry is preserved
+    '''
+    image = sitk.Cast(image, sitk.sitkFloat64)
+    statistics = local_statistics(image, radii, slab_size=slab_size)
+
+    assert len(statistics) == len(radii)
+    for radius, (mean, std) in zip(radii, statistics) :
+        local_mean = sitk.MeanImageFilter()
+        local_mean.SetRadius(radius)
+        noise = sitk.NoiseImageFilter()
+        noise.SetRadius(radius)
+
+        assert np.allclose(sitk.GetArrayFromImage(mean),
+                           sitk.GetArrayFromImage(local_mean.Execute(image)))
+        # on flat regions the std is the square root of a variance made of
+        # round-off only, so the two filters can differ by ~sqrt(eps) * max
+        assert np.allclose(sitk.GetArrayFromImage(std),
+                           sitk.GetArrayFromImage(noise.Execute(image)), atol=1e-4)
+        assert std.GetPixelID() == sitk.sitkFloat64
+        assert std.GetSize() == image.GetSize()
+        assert np.isclose(std.GetOrigin(), image.GetOrigin()).all()
+        assert np.isclose(std.GetSpacing(), image.GetSpacing()).all()
+
+
+
+@given(gauss_noise_strategy(), st.integers(1, 4), st.integers(1, 20))
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_local_statistics_std_only(image, radius, slab_size):
+    '''
+    Given :
+        - Image
+        - radius
+        - number of slices of each slab
+    Then :
+        - compute the float64 local statistics
+        - compute only the local std, as float32
+    assert :
+        - the mean is not computed
+        - the std has the required type and the float64 values cast
+    '''
+    _, expected = local_statistics(image, radius, slab_size=slab_size)
+    mean, std = local_statistics(image, radius, slab_size=slab_size,
+                                 mean=False, dtype=np.float32)
+
+    assert mean is None
+    assert std.GetPixelID() == sitk.sitkFloat32
+    assert (sitk.GetArrayFromImage(std) ==
+            sitk.GetArrayFromImage(sitk.Cast(expected, sitk.sitkFloat32))).all()
+
+
+
+def test_local_statistics_raise_value_error():
+    '''
+    Given :
+        - Image
+        - Radii with a zero one
+    Then :
+        - compute the local statistics
+    assert :
+        - ValueError is raised
+    '''
+    image = sitk.Image(20, 20, 5, sitk.sitkFloat32)
+    with pytest.raises(ValueError):
+        local_statistics(image, [2, 0])
+
+
+
+@given(gauss_noise_strategy(), st.integers(1, 5))
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_adaptive_histogram_equalization_tiled_pass_through(image, radius):
+    '''
+    Given :
+        - Image
+        - Radius
+    Then :
+        - apply the exact and the tiled equalization with alpha = beta = 1
+    assert :
+        - the tiled one is equal to the input
+        - the exact one is equal to the input up to the rounding
+    '''
+    image = sitk.Cast(image, sitk.sitkInt16)
+    exact = adaptive_histogram_equalization(image, radius)
+    tiled = adaptive_histogram_equalization(image, radius, mode='tiled')
+    array = sitk.GetArrayFromImage(image).astype(float)
+
+    assert (sitk.GetArrayFromImage(tiled) == array).all()
+    assert np.abs(sitk.GetArrayFromImage(exact) - array).max() <= 1
+
+
+
+@given(textured_image_strategy(), st.integers(2, 5), st.sampled_from([(0., 0.), (0., 1.), (1., 0.)]))
+@settings(max_examples=5,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_adaptive_histogram_equalization_tiled(image, radius, params):
+    '''
+    Given :
+        - textured image
+        - Radius
+        - alpha and beta
+    Then :
+        - apply the exact and the tiled equalization
+    assert :
+        - the results are correlated
+        - type and geometry are preserved
+    '''
+    alpha, beta = params
+    exact = adaptive_histogram_equalization(image, radius, alpha=alpha, beta=beta)
+    tiled = adaptive_histogram_equalization(image, radius, mode='tiled', alpha=alpha, beta=beta)
+
+    correlation = np.corrcoef(sitk.GetArrayFromImage(exact).ravel(),
+                              sitk.GetArrayFromImage(tiled).ravel())[0, 1]
+    assert correlation > .8
+    assert tiled.GetPixelID() == image.GetPixelID()
+    assert tiled.GetSize() == image.GetSize()
+    assert np.isclose(tiled.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(tiled.GetSpacing(), image.GetSpacing()).all()
+
+
+
+def test_adaptive_histogram_equalization_raise_value_error():
+    '''
+    Given :
+        - Image
+        - unknown mode
+    Then :
+        - apply the equalization
+    assert :
+        - ValueError is raised
+    '''
+    image = sitk.Image(20, 20, 5, sitk.sitkInt16)
+    with pytest.raises(ValueError):
+        adaptive_histogram_equalization(image, 2, mode='unknown')
+
+
+
 @given(gauss_noise_strategy(), st.integers(10, 100), st.integers(150, 250))
 @settings(max_examples=5,
           deadline=None,
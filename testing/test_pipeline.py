@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from CTLungSeg.pipeline import Pipeline
+from CTLungSeg.labeling import centroids
+from CTLungSeg import labeling
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+class LabelingPipeline(Pipeline) :
+    '''
+    Pipeline whose input is already a lung image, so the lung extraction
+    (and the lungmask model) is not required
+    '''
+
+    def lung(self, volume) :
+        self.lung_calls = getattr(self, 'lung_calls', 0) + 1
+        return volume
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+def test_pipeline_in_memory(lung_image):
+    '''
+    Given :
+        - lung image
+        - pipeline without lung directory
+    So :
+        - segment the image
+    Assert :
+        - the labels are the ones of the labeling
+        - no lung image is written
+    '''
+    image = lung_image(spacing=(.7, .7, 1.25))
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+    pipeline = LabelingPipeline(center)
+
+    labels = pipeline(image, name='scan.nii')
+    expected = labeling.main(image, center)
+
+    assert pipeline.lung_calls == 1
+    assert (sitk.GetArrayFromImage(labels) == sitk.GetArrayFromImage(expected)).all()
+    assert np.isclose(labels.GetSpacing(), image.GetSpacing()).all()
+
+
+
+def test_pipeline_run_keeps_lung(tmp_path, lung_image):
+    '''
+    Given :
+        - lung image file
+        - pipeline with lung directory
+    So :
+        - segment the file
+    Assert :
+        - the labels are written
+        - the lung image is written into the lung directory, named after the input
+    '''
+    image = lung_image(spacing=(.7, .7, 1.25))
+    sitk.WriteImage(image, str(tmp_path / 'scan.nrrd'))
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+    pipeline = LabelingPipeline(center, lung_dir=str(tmp_path / 'LUNG'))
+
+    pipeline.run(str(tmp_path / 'scan.nrrd'), str(tmp_path / 'labels.nrrd'))
+
+    labels = sitk.ReadImage(str(tmp_path / 'labels.nrrd'))
+    lung = sitk.ReadImage(str(tmp_path / 'LUNG' / 'scan.nrrd_lung.nrrd'))
+    assert labels.GetSize() == image.GetSize()
+    assert (sitk.GetArrayFromImage(lung) == sitk.GetArrayFromImage(image)).all()
@@ -8,11 +8,18 @@ from  hypothesis import HealthCheck as HC
 
 from CTLungSeg.utils import shuffle_and_split
 
+from CTLungSeg.segmentation import remove_vessels
+from CTLungSeg.segmentation import vessel_halo
 from CTLungSeg.segmentation import imlabeling
+from CTLungSeg.segmentation import nearest_centroid
+from CTLungSeg.segmentation import is_nearest_centroid
+from CTLungSeg.segmentation import imlabeling_target
 from CTLungSeg.segmentation import kmeans_on_subsamples
+from CTLungSeg.segmentation import _slab_size
 
 import cv2
 import numpy as np
+import SimpleITK as sitk
 from numpy import ones
 from numpy.random import randint
 
@@ -40,6 +47,103 @@ def integer_stack_strategy(draw) :
 
 
 
+@st.composite
+def lung_vessels_strategy(draw) :
+    '''
+    Generates a lung-like image with vessels along the z axis, already masked
+    to -1000 outside the lung, and its lung mask
+    '''
+    spacing = draw(st.tuples(*[st.floats(.6, 1.5)] * 3))
+    seed = draw(st.integers(0, 2**16))
+    rng = np.random.default_rng(seed)
+
+    shape = (40, 80, 80)
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    lung = ((z - 20) / 12.)**2 + ((y - 40) / 20.)**2 + ((x - 40) / 20.)**2 < 1
+    array = rng.normal(-850, 20, shape).astype(np.int16)
+    for cy, cx in rng.uniform(20, 60, (8, 2)) :
+        array[:, ((y - cy)**2 + (x - cx)**2 < 4)[0]] = 40
+    array[~lung] = -1000
+
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(spacing)
+    mask = sitk.GetImageFromArray(lung.astype(np.uint8))
+    mask.CopyInformation(image)
+    return image, mask
+
+
+
+@given(lung_vessels_strategy())
+@settings(max_examples=3, deadline=None)
+def test_remove_vessels_mask(lung) :
+    '''
+    Given :
+        - lung image with vessels
+        - lung mask
+    Then :
+        - remove the vessels on the whole image
+        - remove the vessels on the bounding box of the mask
+    Assert :
+        - the results are equal inside the mask
+        - the voxels outside the enlarged bounding box are untouched
+        - the geometry is preserved
+    '''
+    image, mask = lung
+    full = sitk.GetArrayFromImage(remove_vessels(image, sigma=2.))
+    roi = remove_vessels(image, sigma=2., mask=mask)
+    restricted = sitk.GetArrayFromImage(roi)
+    inside = sitk.GetArrayFromImage(mask) > 0
+
+    assert (full[inside] == restricted[inside]).all()
+    halo = vessel_halo(image, 2.)
+    bbox = np.argwhere(inside)
+    lower = np.maximum(bbox.min(axis=0) - halo[::-1], 0)
+    upper = bbox.max(axis=0) + 1 + halo[::-1]
+    outside = np.ones(inside.shape, dtype=bool)
+    outside[tuple(slice(l, u) for l, u in zip(lower, upper))] = False
+    assert (restricted[outside] == sitk.GetArrayFromImage(image)[outside]).all()
+    assert roi.GetSize() == image.GetSize()
+    assert np.isclose(roi.GetSpacing(), image.GetSpacing()).all()
+
+
+
+@given(lung_vessels_strategy(), st.floats(1., 2.), st.one_of(st.none(), st.integers(-900, 0)))
+@settings(max_examples=3, deadline=None)
+def test_remove_vessels_spacing(lung, spacing, intensity) :
+    '''
+    Given :
+        - lung image with vessels
+        - coarser spacing
+        - optional intensity threshold
+    Then :
+        - remove the vessels on the whole image
+        - remove the vessels on the resampled image
+    Assert :
+        - the geometry and the pixel type are preserved
+        - only voxels are set to -1000, the other ones are untouched
+        - the voxels darker than intensity are untouched
+        - without intensity, the removed voxels overlap the ones removed at
+          full resolution
+    '''
+    image, mask = lung
+    array = sitk.GetArrayFromImage(image)
+    full = sitk.GetArrayFromImage(remove_vessels(image, sigma=2.)) == -1000
+    coarse = remove_vessels(image, sigma=2., mask=mask, spacing=spacing, intensity=intensity)
+    restricted = sitk.GetArrayFromImage(coarse)
+
+    assert coarse.GetSize() == image.GetSize()
+    assert coarse.GetPixelID() == image.GetPixelID()
+    assert np.isclose(coarse.GetSpacing(), image.GetSpacing()).all()
+    changed = restricted != array
+    assert (restricted[changed] == -1000).all()
+    if intensity is not None :
+        assert not changed[array < intensity].any()
+    else :
+        vessels = full & (array != -1000)
+        assert (changed & vessels).sum() > .5 * vessels.sum()
+
+
+
 @given(integer_stack_strategy(), st.integers(1, 6))
 @settings(max_examples=4, deadline=None)
 def test_imlabeling(stack, channels):
@@ -127,6 +231,311 @@ def test_imlabeling_raise_centroids_exception(stack) :
         assert imlabeling(mc, centroids)
 
 
+@given(integer_stack_strategy(), st.integers(1, 4), st.integers(1, 30))
+@settings(max_examples=2, deadline=None)
+def test_imlabeling_chunked(stack, channels, chunk_slices):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of channels
+        - number of slices for each slab
+    So :
+        - build a noisy mulcti channel image
+        - label it at once and in slabs
+    Assert:
+        - the labels are the same, with and without weight
+    '''
+    mc = np.stack([stack[0] + np.random.rand(*stack[0].shape) for _ in range(channels)], axis=-1)
+    centroids = np.random.rand(5, channels) * stack[1]
+    w = (stack[0] != 0).astype(np.uint8)
+
+    labeled = imlabeling(mc, centroids)
+    chunked = imlabeling(mc, centroids, chunk_slices=chunk_slices)
+    weighted = imlabeling(mc, centroids, w.copy())
+    chunked_weighted = imlabeling(mc, centroids, w.copy(), chunk_slices=chunk_slices)
+
+    assert (labeled == chunked).all()
+    assert (weighted == chunked_weighted).all()
+
+
+
+@given(integer_stack_strategy(), st.integers(2**16, 2**24))
+@settings(max_examples=2, deadline=None)
+def test_imlabeling_max_memory(stack, max_memory):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - memory budget
+    So :
+        - build a noisy mulcti channel image
+        - label it at once and within the memory budget
+    Assert:
+        - the labels are the same
+    '''
+    mc = np.stack([stack[0] + np.random.rand(*stack[0].shape) for _ in range(4)], axis=-1)
+    centroids = np.random.rand(5, 4) * stack[1]
+
+    labeled = imlabeling(mc, centroids)
+    chunked = imlabeling(mc, centroids, max_memory=max_memory)
+
+    assert (labeled == chunked).all()
+
+
+
+@given(st.integers(2**20, 2**30), st.integers(1, 16))
+@settings(max_examples=20, deadline=None)
+def test_slab_size_n_workers(max_memory, n_workers):
+    '''
+    Given :
+        - memory budget
+        - number of concurrent slabs
+    So :
+        - compute the slab size for one slab and for the concurrent ones
+    Assert:
+        - the concurrent slabs together fit into the budget of a single one
+    '''
+    image = np.empty((700, 64, 64, 4), dtype=np.float32)
+    centroids = np.ones((5, 4))
+
+    single = _slab_size(image, centroids, max_memory=max_memory)
+    concurrent = _slab_size(image, centroids, max_memory=max_memory, n_workers=n_workers)
+
+    assert concurrent <= single
+    assert concurrent == 1 or concurrent * n_workers <= single
+
+
+
+@given(integer_stack_strategy(), st.integers(2, 8), st.sampled_from(['norm', 'gemm']))
+@settings(max_examples=2, deadline=None)
+def test_imlabeling_n_jobs(stack, n_jobs, engine):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of threads
+        - distance engine
+    So :
+        - build a noisy mulcti channel image
+        - label it with one and with multiple threads
+    Assert:
+        - the labels are the same, with and without weight
+    '''
+    mc = np.stack([stack[0] + np.random.rand(*stack[0].shape) for _ in range(4)], axis=-1)
+    centroids = np.random.rand(5, 4) * stack[1]
+    w = (stack[0] != 0).astype(np.uint8)
+
+    labeled = imlabeling(mc, centroids, engine=engine)
+    threaded = imlabeling(mc, centroids, engine=engine, n_jobs=n_jobs)
+    weighted = imlabeling(mc, centroids, w.copy(), engine=engine)
+    threaded_weighted = imlabeling(mc, centroids, w.copy(), engine=engine, n_jobs=n_jobs)
+
+    assert (labeled == threaded).all()
+    assert (weighted == threaded_weighted).all()
+
+
+
+@given(integer_stack_strategy(), st.integers(-10, 0))
+@settings(max_examples=2, deadline=None)
+def test_imlabeling_raise_chunk_value_error(stack, chunk_slices):
+    '''
+    Given :
+        - multi channel image tensor
+        - not positive number of slices for each slab
+    Assert :
+        - ValueError is raised
+    '''
+    mc = np.stack([stack[0] for _ in range(3)], axis=-1)
+    centroids = ones((5, 3), dtype=np.uint8)
+
+    with pytest.raises(ValueError) :
+        imlabeling(mc, centroids, chunk_slices=chunk_slices)
+
+
+@given(integer_stack_strategy(), st.integers(1, 6))
+@settings(max_examples=4, deadline=None)
+def test_imlabeling_gemm(stack, channels):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of channels
+    So :
+        - build the mulcti channel image
+        - build the centroids vector(1 value for each GL)
+        - label it with the gemm engine
+    Assert:
+        - each voxel is assigned to the correct cluster
+        - labels are stored as uint8
+    '''
+    mc = np.stack([stack[0] for i in range(channels)], axis=-1)
+    centroids = np.stack([np.arange(stack[1]) for _ in range(channels)], axis=-1)
+
+    labeled = imlabeling(mc, centroids, engine='gemm')
+
+    assert labeled.dtype == np.uint8
+    assert (labeled == stack[0]).all()
+
+
+
+@given(st.integers(1, 10), st.integers(1, 300))
+@settings(max_examples=10, deadline=None)
+def test_nearest_centroid(channels, n_centroids):
+    '''
+    Given :
+        - number of channels
+        - number of centroids
+    So :
+        - build random voxels and centroids
+        - assign each voxel to the nearest centroid
+    Assert:
+        - the labels match the argmin of the euclidean distances
+        - the smallest integer type is used for the labels
+    '''
+    voxels = np.random.rand(1000, channels).astype(np.float32)
+    centroids = np.random.rand(n_centroids, channels).astype(np.float32)
+
+    labels = nearest_centroid(voxels, centroids)
+    distances = np.sum((voxels[:, None, :] - centroids[None, :, :])**2, axis=-1)
+    expected = np.argmin(distances, axis=1)
+    # allow for float32 rounding on almost equidistant centroids
+    nearest = distances[np.arange(len(voxels)), labels]
+    closest = distances[np.arange(len(voxels)), expected]
+
+    assert labels.dtype == (np.uint8 if n_centroids <= 256 else np.uint16)
+    assert np.allclose(nearest, closest, atol=1e-4)
+
+
+
+def test_imlabeling_raise_engine_value_error():
+    '''
+    Given :
+        - multi channel image tensor
+        - unknown engine name
+    Assert :
+        - ValueError is raised
+    '''
+    mc = ones((2, 10, 10, 3))
+    centroids = ones((5, 3))
+
+    with pytest.raises(ValueError) :
+        imlabeling(mc, centroids, engine='unknown')
+
+
+
+def test_imlabeling_raise_n_jobs_value_error():
+    '''
+    Given :
+        - multi channel image tensor
+        - zero threads
+    Assert :
+        - ValueError is raised
+    '''
+    mc = ones((2, 10, 10, 3))
+    centroids = ones((5, 3))
+
+    with pytest.raises(ValueError) :
+        imlabeling(mc, centroids, n_jobs=0)
+
+
+@given(integer_stack_strategy(), st.integers(1, 4), st.integers(0, 2), st.integers(1, 30))
+@settings(max_examples=4, deadline=None)
+def test_imlabeling_target(stack, channels, target, chunk_slices):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of channels
+        - target cluster
+        - number of slices of each slab
+    So :
+        - build the mulcti channel image
+        - build the centroids vector(1 value for each GL)
+        - identify the voxels of the target cluster
+    Assert:
+        - the result is a boolean array
+        - the voxels of the target cluster are identified
+    '''
+    mc = np.stack([stack[0] for i in range(channels)], axis=-1)
+    centroids = np.stack([np.arange(stack[1]) for _ in range(channels)], axis=-1)
+
+    is_target = imlabeling_target(mc, centroids, target, chunk_slices=chunk_slices)
+
+    assert is_target.dtype == bool
+    assert (is_target == (stack[0] == target)).all()
+
+
+
+@given(integer_stack_strategy(), st.integers(1, 4), st.integers(0, 2), st.integers(1, 4))
+@settings(max_examples=4, deadline=None)
+def test_imlabeling_target_wWeight(stack, channels, target, n_jobs):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of channels
+        - target cluster
+        - number of threads
+    So :
+        - build the mulcti channel image and a random weight
+        - build random integer centroids, with equally distant ones
+        - identify the voxels of the target cluster
+    Assert:
+        - the result matches the full argmin labeling, ties included
+        - the voxels outside the weight are not in the target cluster
+        - the weight is not modified
+    '''
+    mc = np.stack([stack[0] for i in range(channels)], axis=-1)
+    centroids = randint(0, stack[1], (5, channels))
+    weight = randint(0, 2, stack[0].shape, dtype=np.uint8)
+    original = weight.copy()
+
+    is_target = imlabeling_target(mc, centroids, target, weight=weight, n_jobs=n_jobs)
+    labeled = imlabeling(mc, centroids, weight=weight.copy())
+
+    assert (is_target == ((labeled == target) & (original != 0))).all()
+    assert (weight == original).all()
+
+
+
+@given(st.integers(1, 10), st.integers(2, 30))
+@settings(max_examples=10, deadline=None)
+def test_is_nearest_centroid(channels, n_centroids):
+    '''
+    Given :
+        - number of channels
+        - number of centroids
+    So :
+        - build random voxels and centroids
+        - check each voxel against each centroid
+    Assert:
+        - the result is equal to the argmin of the distances, up to the
+          float32 rounding of almost equidistant centroids
+    '''
+    voxels = np.random.rand(1000, channels).astype(np.float32)
+    centroids = np.random.rand(n_centroids, channels).astype(np.float32)
+    distances = np.sum((voxels[:, None, :] - centroids[None, :, :])**2, axis=-1)
+    labels = np.argmin(distances, axis=1)
+    closest = distances.min(axis=1)
+
+    for target in range(n_centroids) :
+        is_target = is_nearest_centroid(voxels, centroids, target)
+        mismatch = is_target != (labels == target)
+        assert np.allclose(distances[mismatch, target], closest[mismatch], atol=1e-4)
+
+
+
+def test_is_nearest_centroid_raise_value_error():
+    '''
+    Given :
+        - voxels and centroids
+        - target index out of range
+    Assert :
+        - ValueError is raised
+    '''
+    voxels = ones((10, 3))
+    centroids = ones((5, 3))
+
+    with pytest.raises(ValueError) :
+        is_nearest_centroid(voxels, centroids, target=5)
+
+
+
 @given(integer_stack_strategy(), st.integers(1, 4), st.integers(1, 5))
 @settings(max_examples = 1, deadline=None)
 def test_kmeans_on_subsamples(stack, n_features, n_subsamples) :
@@ -205,3 +614,35 @@ def test_kmeans_on_subsamples_wobkg(stack, n_subsamples):
 
     assert centr.size == n_subsamples * (stack[1] - 1)* 2
     assert np.isclose(np.sort(centr.reshape((-1,))), gt).all()
+
+
+@given(integer_stack_strategy(), st.integers(1, 5))
+@settings(max_examples=1, deadline=None)
+def test_kmeans_on_subsamples_generator(stack, n_subsamples):
+    '''
+    Given :
+        - image tensor with GL in [0, 7]
+        - number of subsamples
+    So :
+        - select the voxels different from the background
+        - perform the kmeans on a generator of the voxel subsamples, with a
+            number of centroids equal to the number of different GL (except 0)
+    Assert :
+        - the correct number of centroids is estimated
+        - the correct value of centroids is returned
+        - the backgrond is removed
+    '''
+    stopping_criteria =  (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                          10, 1.0)
+    voxels = np.stack([stack[0], stack[0]], axis=-1)[stack[0] != 0]
+    subsamples = (voxels for _ in range(n_subsamples))
+    _, centr = kmeans_on_subsamples(subsamples,
+                                    stack[1] - 1,
+                                    stopping_criteria,
+                                    cv2.KMEANS_RANDOM_CENTERS)
+
+    # true value for each centroid
+    gt = np.repeat(np.arange(1, stack[1], 1), n_subsamples * 2, axis=-1)
+
+    assert centr.size == n_subsamples * (stack[1] - 1) * 2
+    assert np.isclose(np.sort(centr.reshape((-1,))), gt).all()
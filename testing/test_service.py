@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+import pytest
+import threading
+import urllib.request
+
+from CTLungSeg.service import SegmentationService
+from CTLungSeg.service import make_server
+from CTLungSeg.labeling import centroids
+from CTLungSeg import labeling
+
+import numpy as np
+import SimpleITK as sitk
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+class LabelingService(SegmentationService) :
+    '''
+    Service which runs only the labeling, since the input is already a lung
+    image and the lungmask model is not required
+    '''
+
+    def segment(self, volume) :
+        return labeling.main(volume, self.centroids, n_jobs=self.n_jobs)
+
+
+def _post(url, body):
+    '''
+    Send a JSON POST request and return status code and JSON response
+    '''
+    request = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                     headers={'Content-Type' : 'application/json'})
+    try :
+        with urllib.request.urlopen(request) as response :
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e :
+        return e.code, json.loads(e.read())
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+def test_service_http(tmp_path, lung_image):
+    '''
+    Given :
+        - lung image
+        - started service and HTTP server
+    So :
+        - request the segmentation of the image and of a missing file
+        - request the service status
+    Assert :
+        - the labels are written and the latency is reported
+        - the missing file is reported as failed
+        - the status counts both the requests
+    '''
+    sitk.WriteImage(lung_image(), str(tmp_path / 'lung.nrrd'))
+    center = np.asarray([np.array(v) for _, v in centroids.items()])
+    service = LabelingService(center, model=object())
+    service.start()
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    try :
+        code, done = _post(url + '/segment', {'input' : str(tmp_path / 'lung.nrrd'),
+                                              'output' : str(tmp_path / 'label.nrrd')})
+        failed_code, failed = _post(url + '/segment', {'input' : str(tmp_path / 'missing.nrrd'),
+                                                       'output' : str(tmp_path / 'out.nrrd')})
+        bad_code, _ = _post(url + '/segment', {'input' : 'only input'})
+        with urllib.request.urlopen(url + '/status') as response :
+            status = json.loads(response.read())
+    finally :
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+    assert code == 200
+    assert done['status'] == 'done'
+    assert done['seconds'] >= done['processing_seconds'] >= 0
+    assert sitk.ReadImage(str(tmp_path / 'label.nrrd')).GetSize() == (32, 32, 10)
+    assert failed_code == 500
+    assert failed['message'].startswith('FileNotFoundError')
+    assert bad_code == 400
+    assert status['processed'] == 2
+    assert status['failed'] == 1
+
+
+
+def test_service_queue_full():
+    '''
+    Given :
+        - service with a queue of one job, not started
+    So :
+        - submit two jobs
+    Assert :
+        - the second submission is rejected
+    '''
+    service = LabelingService(np.ones((5, 4)), model=object(), max_queue=1)
+    service.submit('a.nrrd', 'b.nrrd')
+
+    with pytest.raises(queue.Full):
+        service.submit('c.nrrd', 'd.nrrd')
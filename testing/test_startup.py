@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+import subprocess
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+# command line entry points of the package
+entry_points = ['CTLungSeg', 'CTLungSeg.labeling', 'CTLungSeg.lung_extraction',
+                'CTLungSeg.train', 'CTLungSeg.evaluate', 'CTLungSeg.batch',
+                'CTLungSeg.service', 'CTLungSeg.pipeline']
+# dependencies that must be imported only at their point of use
+heavy_modules = ['torch', 'lungmask', 'cv2', 'pandas', 'tqdm']
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+def test_import_is_lazy():
+    '''
+    Given :
+        - all the package modules
+    So :
+        - import them in a fresh interpreter
+    Assert :
+        - no heavy dependency is imported
+    '''
+    modules = ['CTLungSeg.__main__'] + entry_points[1:] + [
+               'CTLungSeg.segmentation', 'CTLungSeg.method', 'CTLungSeg.utils',
+               'CTLungSeg.features', 'CTLungSeg.cache', 'CTLungSeg.metrics',
+               'CTLungSeg.threads', 'CTLungSeg.bridge',
+               'CTLungSeg.chunked', 'CTLungSeg.store']
+    code = 'import sys\n{}\nprint(",".join(m for m in {} if m in sys.modules))'.format(
+            '\n'.join('import {}'.format(m) for m in modules), heavy_modules)
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, check=True,
+                         capture_output=True, text=True)
+
+    assert out.stdout.strip() == ''
+
+
+
+@pytest.mark.parametrize('entry_point', entry_points)
+def test_help(entry_point):
+    '''
+    Given :
+        - command line entry point
+    So :
+        - print its help
+    Assert :
+        - the help is printed, even if the heavy dependencies are missing
+    '''
+    out = subprocess.run([sys.executable, '-m', entry_point, '--help'], cwd=root,
+                         capture_output=True, text=True)
+
+    assert out.returncode == 0
+    assert 'usage' in out.stdout
+    if entry_point != 'CTLungSeg.batch' :
+        assert '--threads' in out.stdout
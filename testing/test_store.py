@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import hypothesis.strategies as st
+from hypothesis import given, settings
+from  hypothesis import HealthCheck as HC
+
+from CTLungSeg.store import FeatureStore
+
+import tempfile
+import numpy as np
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+################################################################################
+###                                                                          ###
+###                         Define Test strategies                           ###
+###                                                                          ###
+################################################################################
+
+
+@st.composite
+def scans_strategy(draw):
+    '''
+    Generates a list of feature stacks, with random number of slices, and
+    their random binary masks
+    '''
+    n_features = draw(st.integers(1, 5))
+    scans = []
+    for _ in range(draw(st.integers(1, 4))) :
+        n_slices = draw(st.integers(1, 40))
+        features = np.random.rand(n_slices, 12, 10, n_features).astype(np.float32)
+        mask = np.random.rand(n_slices, 12, 10) > .5
+        scans.append((features, mask))
+    return scans
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(scans_strategy())
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_store_append(scans):
+    '''
+    Given :
+        - feature stacks and masks
+    So :
+        - append them to a new store, one at a time
+        - open the store again
+    Assert :
+        - the store has one scan and one offset for each stack
+        - the voxels of each scan are the masked voxels of its stack
+        - the reopened store has the same voxels
+    '''
+    with tempfile.TemporaryDirectory() as path :
+        store = FeatureStore(path)
+        for i, (features, mask) in enumerate(scans) :
+            n_voxels = store.append(features, mask=mask, name='scan_{}'.format(i), slab_size=7)
+            assert n_voxels == mask.sum()
+
+        assert store.n_scans == len(scans)
+        assert len(store) == sum(mask.sum() for _, mask in scans)
+        assert store.names == ['scan_{}'.format(i) for i in range(len(scans))]
+        for i, (features, mask) in enumerate(scans) :
+            assert (store.scan(i) == features[mask]).all()
+
+        reopened = FeatureStore(path)
+        assert reopened.offsets == store.offsets
+        assert (reopened.memmap() == np.concatenate([f[m] for f, m in scans])).all()
+
+
+
+@given(scans_strategy(), st.integers(1, 10), st.integers(50, 1000))
+@settings(max_examples=10,
+          deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_store_subsamples(scans, n_subsamples, block):
+    '''
+    Given :
+        - store of feature stacks
+        - number of subsamples
+        - number of rows read at once
+    So :
+        - read the random subsamples of the store, twice
+    Assert :
+        - the required number of subsamples is read
+        - each voxel is in one and only one subsample
+        - the split is the same for the same seed
+    '''
+    with tempfile.TemporaryDirectory() as path :
+        store = FeatureStore(path)
+        for features, mask in scans :
+            store.append(features, mask=mask)
+
+        subsamples = list(store.subsamples(n_subsamples, block=block))
+        again = list(store.subsamples(n_subsamples, block=block))
+
+        assert len(subsamples) == n_subsamples
+        voxels = np.concatenate(subsamples)
+        expected = np.asarray(store.memmap())
+        assert voxels.shape == expected.shape
+        assert (np.sort(voxels, axis=0) == np.sort(expected, axis=0)).all()
+        assert all((s == a).all() for s, a in zip(subsamples, again))
+
+
+
+def test_store_raise():
+    '''
+    Given :
+        - store of 3 feature stack
+    So :
+        - append a 2 feature stack
+        - append a stack with a mask of different shape
+        - read zero subsamples
+    Assert :
+        - ValueError is raised each time
+    '''
+    with tempfile.TemporaryDirectory() as path :
+        store = FeatureStore(path)
+        store.append(np.ones((2, 4, 4, 3)))
+
+        with pytest.raises(ValueError) :
+            store.append(np.ones((2, 4, 4, 2)))
+        with pytest.raises(ValueError) :
+            store.append(np.ones((2, 4, 4, 3)), mask=np.ones((2, 4, 5)))
+        with pytest.raises(ValueError) :
+            next(store.subsamples(0))
+        assert len(store) == 2 * 4 * 4
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+import contextlib
+import subprocess
+import SimpleITK as sitk
+
+import hypothesis.strategies as st
+from hypothesis import given, settings
+
+from CTLungSeg.threads import THREADS_VARIABLE
+from CTLungSeg.threads import POOL_VARIABLES
+from CTLungSeg.threads import get_threads
+from CTLungSeg.threads import set_threads
+
+
+__author__ = ['Riccardo Biondi', 'Nico Curti']
+__email__  = ['riccardo.biondi4@studio.unibo.it', 'nico.curti2@unibo.it']
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+################################################################################
+###                                                                          ###
+###                                 TESTING                                  ###
+###                                                                          ###
+################################################################################
+
+
+@given(st.integers(1, 64))
+@settings(max_examples=5, deadline=None)
+def test_get_threads(threads):
+    '''
+    Given :
+        - number of threads
+    So :
+        - resolve the budget from the argument and from the environment
+    Assert :
+        - the argument has the precedence over the environment
+        - the environment is used if no argument is given
+    '''
+    with pytest.MonkeyPatch.context() as mp :
+        mp.setenv(THREADS_VARIABLE, str(threads + 1))
+
+        assert get_threads(threads) == threads
+        assert get_threads() == threads + 1
+
+        mp.delenv(THREADS_VARIABLE)
+        assert get_threads() is None
+
+
+@pytest.mark.parametrize('threads', [0, -2])
+def test_get_threads_raise_value_error(threads):
+    '''
+    Given :
+        - non positive number of threads
+    Assert :
+        - ValueError is raised
+    '''
+    with pytest.raises(ValueError) :
+        get_threads(threads)
+
+
+def test_set_threads():
+    '''
+    Given :
+        - number of threads
+    So :
+        - set the thread budget
+    Assert :
+        - the SimpleITK default number of threads is set
+        - the budget is exported to the environment
+    '''
+    default = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    cv2 = sys.modules.get('cv2')
+    cv2_default = None if cv2 is None else cv2.getNumThreads()
+    try :
+        # the BLAS limits set by threadpoolctl are restored at the exit
+        from threadpoolctl import threadpool_limits
+        blas = threadpool_limits(limits=None)
+    except ImportError :
+        blas = contextlib.nullcontext()
+
+    with pytest.MonkeyPatch.context() as mp, blas :
+        # set before being deleted, so that the variables exported by
+        # set_threads are removed at the exit
+        for variable in [THREADS_VARIABLE] + POOL_VARIABLES :
+            mp.setenv(variable, '')
+            mp.delenv(variable)
+        try :
+            assert set_threads(2) == 2
+            assert sitk.ProcessObject.GetGlobalDefaultNumberOfThreads() == 2
+            assert os.environ[THREADS_VARIABLE] == '2'
+            assert os.environ['OMP_NUM_THREADS'] == '2'
+            assert os.environ['OPENCV_FOR_THREADS_NUM'] == '2'
+        finally :
+            sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(default)
+            if cv2 is not None :
+                cv2.setNumThreads(cv2_default)
+
+        mp.delenv(THREADS_VARIABLE)
+        assert set_threads() is None
+
+
+def test_budget_exported_at_import():
+    '''
+    Given :
+        - CTLUNGSEG_THREADS environment variable
+    So :
+        - import the package in a fresh interpreter
+    Assert :
+        - the BLAS and OpenMP variables are set before numpy is imported
+    '''
+    code = ('import sys, os\nimport CTLungSeg\n'
+            'print("numpy" in sys.modules, os.environ["OMP_NUM_THREADS"], '
+            'os.environ["OPENBLAS_NUM_THREADS"])')
+    env = dict(os.environ, **{THREADS_VARIABLE : '3'})
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True,
+                         capture_output=True, text=True)
+
+    assert out.stdout.split() == ['False', '3', '3']
+
+
+
+def test_exported_at_import_keeps_user_variables():
+    '''
+    Given :
+        - CTLUNGSEG_THREADS environment variable
+        - OMP_NUM_THREADS environment variable set by the user
+    So :
+        - import the package in a fresh interpreter
+    Assert :
+        - the user variable is kept
+        - the missing variables are set to the budget
+    '''
+    code = ('import os\nimport CTLungSeg\n'
+            'print(os.environ["OMP_NUM_THREADS"], os.environ["MKL_NUM_THREADS"])')
+    env = {k : v for k, v in os.environ.items() if k not in POOL_VARIABLES}
+    env.update({THREADS_VARIABLE : '3', 'OMP_NUM_THREADS' : '1'})
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, check=True,
+                         capture_output=True, text=True)
+
+    assert out.stdout.split() == ['1', '3']
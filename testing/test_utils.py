@@ -3,7 +3,7 @@
 
 import pytest
 import hypothesis.strategies as st
-from hypothesis import given, settings, example
+from hypothesis import given, settings, example, assume
 from  hypothesis import HealthCheck as HC
 
 from CTLungSeg.utils import load_pickle
@@ -12,9 +12,14 @@ from CTLungSeg.utils import write_volume
 from CTLungSeg.utils import  _read_image
 from CTLungSeg.utils import read_image
 from CTLungSeg.utils import normalize
+from CTLungSeg.utils import image_statistics
 from CTLungSeg.utils import shift_and_crop
 from CTLungSeg.utils import shuffle_and_split
 from CTLungSeg.utils import deep_copy
+from CTLungSeg.utils import foreground_bounding_box
+from CTLungSeg.utils import paste_into_empty
+from CTLungSeg.utils import process_in_slabs
+from CTLungSeg.method import median_filter
 
 import numpy as np
 import SimpleITK as sitk
@@ -218,6 +223,102 @@ def test_normalize_raise_error(image):
         res = normalize(image)
 
 
+@given(sitk_image_strategy())
+@settings(max_examples=5, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_normalize(image):
+    '''
+    Given :
+        - image
+    Then :
+        - normalize the image
+        - normalize the image with the NormalizeImageFilter
+    Assert :
+        - the results are equal
+        - the result is float32 and the geometry is preserved
+    '''
+    assume(sitk.GetArrayViewFromImage(image).std() > 0)
+    normalized = normalize(image)
+    expected = sitk.NormalizeImageFilter().Execute(image)
+
+    assert normalized.GetPixelID() == sitk.sitkFloat32
+    assert np.allclose(sitk.GetArrayFromImage(normalized),
+                       sitk.GetArrayFromImage(expected), atol=1e-5)
+    assert np.isclose(normalized.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(normalized.GetSpacing(), image.GetSpacing()).all()
+
+
+@given(sitk_image_strategy())
+@settings(max_examples=5, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_normalize_mask_and_buffer(image):
+    '''
+    Given :
+        - image
+        - mask
+        - float32 buffer
+    Then :
+        - normalize the image into the buffer with the statistics of the mask
+    Assert :
+        - the buffer is returned and filled
+        - the statistics are the ones of the masked voxels
+    '''
+    array = sitk.GetArrayFromImage(image).astype(np.float64)
+    mask = np.zeros(array.shape, dtype=np.uint8)
+    mask[::2] = 1
+    assume(array[::2].std() > 0)
+    buffer = np.empty(array.shape, dtype=np.float32)
+
+    out = normalize(image, mask=mask, out=buffer)
+    values = array[mask != 0]
+
+    assert out is buffer
+    assert np.allclose(buffer, (array - values.mean()) / values.std(ddof=1), atol=1e-5)
+
+
+def test_normalize_raise_value_error():
+    '''
+    Given :
+        - image
+        - float64 buffer
+    Then :
+        - normalize the image into the buffer
+    Assert :
+        - ValueError is raised
+    '''
+    image = sitk.GetImageFromArray(np.random.rand(5, 10, 10))
+
+    with pytest.raises(ValueError):
+        normalize(image, out=np.empty((5, 10, 10)))
+
+
+@given(st.floats(-1e6, 1e6), st.integers(1, 40), st.integers(0, 5000))
+@settings(max_examples=10, deadline=None)
+def test_image_statistics(offset, slab_size, n_zeros):
+    '''
+    Given :
+        - image with a large offset
+        - number of slices of each slab
+        - number of zero voxels outside of the image
+    Then :
+        - compute the image statistics
+    Assert :
+        - mean and sigma are equal to the ones computed by numpy
+        - the outside zeros are accounted for
+    '''
+    array = np.random.rand(20, 30, 30) + offset
+    image = sitk.GetImageFromArray(array)
+
+    mean, sigma = image_statistics(image, slab_size=slab_size)
+    assert np.isclose(mean, array.mean())
+    assert np.isclose(sigma, array.std(ddof=1), rtol=1e-6)
+
+    padded = np.concatenate([array.ravel(), np.zeros(n_zeros)])
+    mean, sigma = image_statistics(image, n_voxels=padded.size, slab_size=slab_size)
+    assert np.isclose(mean, padded.mean())
+    assert np.isclose(sigma, padded.std(ddof=1))
+
+
 @given(sitk_image_strategy())
 @settings(max_examples=5, deadline=None,
           suppress_health_check=(HC.too_slow,))
@@ -260,3 +361,103 @@ def test_shuffle_and_split(sample, n_subsamples):
     subsample = shuffle_and_split(sample, n_subsamples)
 
     assert subsample.shape[0] == n_subsamples
+
+
+
+@given(sitk_image_strategy(), st.integers(0, 10))
+@settings(max_examples=5, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_foreground_bounding_box_and_paste(image, halo):
+    '''
+    Given :
+        - SimpleITK image
+        - halo size
+    So :
+        - keep only a box of non-zero voxels
+        - crop the image to the foreground bounding box
+        - paste the crop into an empty image
+    Assert :
+        - the bounding box contains the box enlarged by the halo
+        - the pasted image is equal to the masked one
+        - the geometry is preserved
+    '''
+    array = np.zeros(image.GetSize()[::-1], dtype=np.int16)
+    array[20:40, 30:60, 10:50] = 1
+    masked = sitk.GetImageFromArray(array)
+    masked.CopyInformation(image)
+
+    index, size = foreground_bounding_box(masked, halo)
+    crop = sitk.RegionOfInterest(masked, size, index)
+    pasted = paste_into_empty(crop, masked, index)
+
+    assert index == [max(10 - halo, 0), max(30 - halo, 0), max(20 - halo, 0)]
+    assert size == [min(50 + halo, 100) - index[0],
+                    min(60 + halo, 100) - index[1],
+                    min(40 + halo, 100) - index[2]]
+    assert (sitk.GetArrayFromImage(pasted) == array).all()
+    assert np.isclose(pasted.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(pasted.GetSpacing(), image.GetSpacing()).all()
+    assert np.isclose(pasted.GetDirection(), image.GetDirection()).all()
+
+
+
+@given(sitk_constant_image())
+@settings(max_examples=2, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_foreground_bounding_box_empty(image):
+    '''
+    Given :
+        - zero valued image
+    So :
+        - compute the foreground bounding box
+    Assert :
+        - the whole image extent is returned
+    '''
+    index, size = foreground_bounding_box(image, 3)
+
+    assert index == [0, 0, 0]
+    assert size == list(image.GetSize())
+
+
+
+@given(sitk_image_strategy(), st.integers(1, 40), st.integers(1, 3))
+@settings(max_examples=5, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_process_in_slabs(image, slab_size, radius):
+    '''
+    Given :
+        - SimpleITK image
+        - number of slices for each slab
+        - median filter radius
+    So :
+        - apply the median filter to the whole image
+        - apply the median filter by slabs with halo equal to the radius
+    Assert :
+        - the results are equal
+        - the geometry is preserved
+    '''
+    full = median_filter(image, radius)
+    slabs = process_in_slabs(image, lambda x : median_filter(x, radius),
+                             slab_size=slab_size, halo=radius)
+
+    assert (sitk.GetArrayFromImage(slabs) == sitk.GetArrayFromImage(full)).all()
+    assert slabs.GetPixelID() == full.GetPixelID()
+    assert np.isclose(slabs.GetOrigin(), image.GetOrigin()).all()
+    assert np.isclose(slabs.GetSpacing(), image.GetSpacing()).all()
+    assert np.isclose(slabs.GetDirection(), image.GetDirection()).all()
+
+
+
+@given(sitk_image_strategy(), st.integers(-5, 0))
+@settings(max_examples=2, deadline=None,
+          suppress_health_check=(HC.too_slow,))
+def test_process_in_slabs_raise_value_error(image, slab_size):
+    '''
+    Given :
+        - SimpleITK image
+        - not positive slab size
+    Assert :
+        - ValueError is raised
+    '''
+    with pytest.raises(ValueError):
+        process_in_slabs(image, lambda x : x, slab_size=slab_size)